@@ -0,0 +1,215 @@
+import asyncio
+import concurrent.futures
+import logging
+import socket
+import time
+
+import codec
+import compression
+import connection
+import pipeline
+import protocol
+import server
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+HANDLER_THREADS = 32
+LISTEN_BACKLOG = 4096
+
+
+def raise_open_file_limit():
+    """
+    Raises the soft limit on open file descriptors to the hard limit, so a single process can hold
+    tens of thousands of client connections. Does nothing on platforms without the resource module.
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            logging.info(f" Raised open file limit from {soft} to {hard}")
+        except (ValueError, OSError) as e:
+            logging.error(e)
+
+
+class AsyncConnection:
+    """
+    Wraps an asyncio stream writer with the same interface as connection.QueuedConnection, so the Server message
+    handlers can be reused unchanged. Handlers run on executor threads, so every frame is handed to the event loop
+    thread-safely; the transport's write buffer is the outbound queue and is drained by the loop. When more than
+    max_buffered frames' worth of bytes are pending, the slow consumer policy applies.
+    Attributes:
+        loop (AbstractEventLoop): The event loop that owns the stream.
+        writer (StreamWriter): The stream writer of the connected client.
+        max_buffered (int): Maximum bytes pending in the transport before the policy applies.
+        policy (str): Slow consumer policy, connection.DROP or connection.DISCONNECT.
+        dropped (int): Number of frames dropped because the buffer was full.
+        codec (JsonCodec | BinaryCodec): Message codec negotiated at login.
+        last_received (float): time.monotonic() when a frame was last received from the client.
+        pinged (bool): True if a PING has been sent since the last frame was received.
+        deflater (Deflater): Compresses frames as the event loop writes them, from the point compression was
+            negotiated, else None.
+        inflater (Inflater): Decompresses frames received from the client, once negotiated, else None.
+    """
+
+    def __init__(self, loop, writer, max_queued: int = connection.OUTBOUND_QUEUE_SIZE,
+                 policy: str = connection.DROP):
+        if policy not in connection.SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.loop = loop
+        self.writer = writer
+        self.max_buffered = max_queued * server.BUFFER_SIZE
+        self.policy = policy
+        self.dropped = 0
+        self.codec = codec.JSON
+        self.last_received = time.monotonic()
+        self.pinged = False
+        self.deflater = None
+        self.inflater = None
+
+    def send_frame(self, frame):
+        """
+        Schedules an encoded frame to be written to the client on the event loop. Never blocks the calling thread.
+
+        :param frame: Encoded frame bytes.
+        :return: False if the stream is already closing, else True (the frame may still be dropped by the
+            slow consumer policy).
+        """
+        if self.writer.is_closing():
+            return False
+        self.loop.call_soon_threadsafe(self._write, frame)
+        return True
+
+    def _write(self, frame):
+        if self.writer.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > self.max_buffered:
+            self.dropped += 1
+            if self.policy == connection.DISCONNECT:
+                logging.warning(f" Disconnecting slow client {self.getpeername()}")
+                self.writer.transport.abort()
+            return
+        if self.deflater is not None:
+            frame = self.deflater.compress_frame(frame)
+        self.writer.write(frame)
+
+    def start_compression(self, deflater):
+        """
+        Switches to compressed frames on the event loop, behind every frame already handed to it.
+
+        :param deflater: The connection's Deflater.
+        """
+        self.loop.call_soon_threadsafe(setattr, self, "deflater", deflater)
+
+    def close(self):
+        """
+        Closes the stream once any pending writes have been flushed.
+        """
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+    def abort(self):
+        """
+        Closes the stream immediately, discarding pending writes, which ends the connection's read loop.
+        """
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+    def is_closing(self):
+        return self.writer.is_closing()
+
+    def getpeername(self):
+        return self.writer.get_extra_info("peername")
+
+
+class AsyncServer(server.Server):
+    """
+    Event loop server engine. Each client connection is a coroutine rather than a thread, so idle connections
+    cost a few kilobytes instead of a thread stack. Messages are dispatched to the same Server handlers on a
+    bounded thread pool, keeping database and bcrypt work off the event loop.
+    Attributes:
+        executor (ThreadPoolExecutor): Pool running the blocking message handlers.
+    """
+
+    def __init__(self, host: str, port: int, handler_threads: int = HANDLER_THREADS,
+                 outbound_queue_size: int = connection.OUTBOUND_QUEUE_SIZE,
+                 slow_consumer_policy: str = connection.DROP, dm_durability: str = pipeline.WRITE_BEHIND,
+                 metrics_port: int = None, admins=(), heartbeat_interval: float = server.HEARTBEAT_INTERVAL,
+                 idle_timeout: float = server.IDLE_TIMEOUT, compression_threshold: int = compression.THRESHOLD):
+        super().__init__(host, port, outbound_queue_size, slow_consumer_policy, dm_durability, metrics_port, admins,
+                         heartbeat_interval, idle_timeout, compression_threshold)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=handler_threads,
+                                                              thread_name_prefix="handler")
+
+    def run(self):
+        """
+        Starts the event loop and serves clients until interrupted, then flushes queued direct messages and
+        closes the database.
+        """
+        raise_open_file_limit()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.close_resources()
+
+    async def serve(self):
+        """
+        Creates an instance of the database and all tables and the password pool, then binds the listening socket
+        to host IP and port and accepts client connections forever.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.open_resources)
+        listener = await asyncio.start_server(self.handle_stream, self.host, self.port,
+                                              backlog=LISTEN_BACKLOG, reuse_address=True,
+                                              reuse_port=self.reuse_port)
+        logging.info(f" Server is listening on port {self.port}...")
+        async with listener:
+            await listener.serve_forever()
+
+    async def handle_stream(self, reader, writer):
+        """
+        Coroutine run for each new connected client. Feeds the client stream into a frame decoder and decodes each
+        complete 'message' frame as 'data'. Each message is handled on the executor before the next one is
+        started, so messages from one client are still processed in order.
+
+        :param reader: Stream reader of connected client.
+        :param writer: Stream writer of connected client.
+        """
+        loop = asyncio.get_running_loop()
+        client_socket = AsyncConnection(loop, writer, self.outbound_queue_size, self.slow_consumer_policy)
+        connection.enable_keepalive(writer.get_extra_info("socket"))
+        decoder = protocol.FrameDecoder()
+        logging.info(f" Accepted a new connection from {client_socket.getpeername()}")
+        self.connections.inc()
+        self.open_connections.add(client_socket)
+        try:
+            while True:
+                received = await reader.read(server.BUFFER_SIZE)
+                if not received:
+                    break
+                client_socket.last_received = time.monotonic()
+                client_socket.pinged = False
+                decoder.feed(received)
+                for message in decoder.frames():
+                    data = codec.decode(compression.decompress(client_socket.inflater, message))
+                    if not await loop.run_in_executor(self.executor, self.handle_message, client_socket, data):
+                        return
+        except (socket.error, protocol.ProtocolError) as e:
+            logging.error(e)
+        finally:
+            self.open_connections.discard(client_socket)
+            self.connections.dec()
+            self.disconnect(client_socket)
+            writer.close()
+
+
+if __name__ == '__main__':
+    """
+    Instantiates the AsyncServer class with host (IP) and port numbers.
+    Runs the AsyncServer run function.
+    """
+    chat_server = AsyncServer('0.0.0.0', 5555)
+    chat_server.run()
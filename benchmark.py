@@ -0,0 +1,757 @@
+import concurrent.futures
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+import bloom
+import codec
+import compression
+import database
+import identity
+import metrics
+import pipeline
+import protocol
+import server
+import ttt_game
+import utility
+
+
+def legacy_dispatch(data, handle):
+    """
+    The if/elif header chain Server.handle_client_connection used before the dispatch table,
+    kept here as the baseline for bench_dispatch.
+    """
+    if data["header"] == utility.LoginCommands.LOGIN.value:
+        handle(data)
+    elif data["header"] == utility.LoginCommands.REGISTER.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.BROADCAST.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.DIRECT_MESSAGE.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.ADD_FRIEND.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.VIEW_FRIEND_REQUESTS.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.VIEW_FRIENDS.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.AUTH_TIC_TAC_TOE.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS.value:
+        handle(data)
+    elif data["header"] == utility.Responses.TIC_TAC_TOE_CONFIRM.value:
+        handle(data)
+    elif data["header"] == utility.Responses.PLAY_TIC_TAC_TOE.value:
+        handle(data)
+    elif data["header"] == utility.Responses.TIC_TAC_TOE_ERROR.value:
+        handle(data)
+    elif data["header"] == utility.Responses.TIC_TAC_TOE_DENY.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.SET_STATUS_AWAY.value:
+        handle(data)
+    elif data["header"] == utility.LoggedInCommands.QUIT.value:
+        handle(data)
+
+
+def legacy_update_board(the_board, turn, move):
+    """
+    ttt_game.updateBoard before the bitboard engine, kept here as the baseline for bench_ttt.
+    """
+    game_over = False
+    if the_board[move] != ' ':
+        return 'Space already filled!', turn
+    else:
+        the_board[move] = turn
+        space_list = [['7', '8', '9'], ['4', '5', '6'], ['1', '2', '3'], ['1', '4', '7'],
+                      ['2', '5', '8'], ['3', '6', '9'], ['1', '5', '9'], ['3', '5', '7']]
+
+        for win in space_list:
+            if the_board[win[0]] == the_board[win[1]] == the_board[win[2]] != ' ':
+                game_over = True
+                the_board = "won"
+                return the_board, turn
+
+        if not game_over:
+            for i in range(1, 9):
+                if the_board[str(i)] == " ":
+                    break
+            else:
+                game_over = True
+                the_board = "tie"
+
+            return the_board, turn
+
+    return the_board, turn
+
+
+def bench_dispatch(iterations=200000):
+    """
+    Measures per-message dispatch cost of the legacy if/elif chain against the Server dispatch table,
+    with no-op handlers so only the header lookup is timed.
+    """
+    chat_server = server.Server('127.0.0.1', 0)
+
+    def handle(*args):
+        pass
+
+    chat_server.handlers = {header: server.Handler(handle, False, False) for header in chat_server.handlers}
+    messages = [chat_server.build_message(header.value, None, None, None) for header in chat_server.handlers]
+    print(f"dispatch ({len(messages)} headers, {iterations} messages each, metrics disabled)")
+    metrics.set_enabled(False)
+    for header, data in zip(chat_server.handlers, messages):
+        legacy = timeit.timeit(lambda: legacy_dispatch(data, handle), number=iterations)
+        table = timeit.timeit(lambda: chat_server.handle_message(None, data), number=iterations)
+        print(f"  {header.name:<28} if/elif {legacy / iterations * 1e9:8.1f} ns"
+              f"   table {table / iterations * 1e9:8.1f} ns")
+    metrics.set_enabled(True)
+
+
+def sample_messages():
+    """
+    One representative message per message type, as built by the server.
+    """
+    build = server.Server.build_message
+    board = ttt_game.return_new_board()
+    board.update({'5': 'X', '1': 'O', '9': 'X'})
+    history = [[1000 - number, "requester", f"message number {number} in this conversation",
+                1700000000000000 + number] for number in range(10)]
+    friends = "\n".join(f"friend{number} : ONLINE" for number in range(20))
+    return {
+        "logged_in": build(utility.LoginCommands.LOGGED_IN.value, "username", utility.Responses.SUCCESS.value,
+                           codec.BINARY.name),
+        "broadcast": build(utility.Responses.BROADCAST_MSG.value, "username", "hello everybody!", None),
+        "dm_history": build(utility.LoggedInCommands.DIRECT_MESSAGE.value, "recipient", "requester", history),
+        "friends_list": build(utility.Responses.PRINT_FRIENDS_LIST.value, "username", friends, None),
+        "tic_tac_toe": build(utility.Responses.PLAY_TIC_TAC_TOE.value, "requester", "recipient",
+                             [ttt_game.get_help_board(), board, 'X', {"requester": 'X', "recipient": 'O'}]),
+    }
+
+
+def bench_codec(iterations=20000):
+    """
+    Compares bytes on the wire and encode/decode CPU time per message type for the json and binary codecs.
+    """
+    print(f"codec ({iterations} iterations)")
+    for name, message in sample_messages().items():
+        for message_codec in (codec.JSON, codec.BINARY):
+            payload = message_codec.encode(message)
+            encode = timeit.timeit(lambda: message_codec.encode(message), number=iterations)
+            decode = timeit.timeit(lambda: message_codec.decode(payload), number=iterations)
+            print(f"  {name:<14} {message_codec.name:<7} {len(payload):5d} bytes"
+                  f"   encode {encode / iterations * 1e6:6.2f} us   decode {decode / iterations * 1e6:6.2f} us")
+
+
+def seed_database(db, users, friends_per_user=5, messages_per_user=20):
+    """
+    Fills an empty database with users, a ring of friendships and direct messages between friends.
+    """
+    timestamp = "2024-01-01 00:00:00"
+
+    def seed(cursor):
+        cursor.executemany("INSERT INTO users (username, password, user_status) VALUES (?, 'x', 'OFFLINE')",
+                           ((f"user{number}",) for number in range(users)))
+        cursor.executemany("INSERT INTO friends (sender, receiver, status) VALUES (?, ?, 'FRIENDS')",
+                           ((number + 1, (number + offset) % users + 1) for number in range(users)
+                            for offset in range(1, friends_per_user + 1)))
+        pairs = ((number + 1, (number + offset % friends_per_user + 1) % users + 1)
+                 for number in range(users) for offset in range(messages_per_user))
+        cursor.executemany("INSERT INTO messages (sender, receiver, message, timestamp, conversation, created_at) "
+                           "VALUES (?, ?, 'hi', ?, ?, 0)",
+                           ((sender, receiver, timestamp, database.Database.conversation_key(sender, receiver))
+                            for sender, receiver in pairs))
+        cursor.executemany("INSERT INTO ttt (sender, receiver, status, timestamp) VALUES (?, ?, 'SENT', ?)",
+                           ((number + 1, (number + 1) % users + 1, timestamp) for number in range(users)))
+
+    db.submit(seed).result()
+    db.load_friends()
+
+
+def hot_queries(db):
+    """
+    The read queries run on every login, message or menu action, as (name, call) pairs.
+    """
+    return [
+        ("find_username_in_db", lambda: db.find_username_in_db("user500")),
+        ("find_user_id", lambda: db.find_user_id("user500")),
+        ("find_friendship_status", lambda: db.find_friendship_status("user500", "user501")),
+        ("fetch_history", lambda: db.fetch_history("user500", "user501")),
+        ("fetch_history before", lambda: db.fetch_history("user500", "user501", before_id=10010)),
+        ("find_statuses", lambda: db.find_statuses(["user499", "user501"])),
+        ("view_friend_requests", lambda: db.view_friend_requests("user500")),
+        ("view_ttt_requests", lambda: db.view_ttt_requests("user500")),
+    ]
+
+
+def bench_query_plans(users=20000, iterations=200):
+    """
+    Checks with EXPLAIN QUERY PLAN that every hot Database query is answered from an index rather than a full
+    table scan, then times each query with and without the indexes the migrations create. The identity cache is
+    disabled so user lookups reach the db.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    db = database.Database(os.path.join(directory, "bench.sqlite"), identity_cache_size=0)
+    seed_database(db, users)
+    print(f"query plans ({users} users, schema version {db.schema_version})")
+    connection = db.cursor.connection
+    full_scans = []
+    indexed = {}
+    for name, query in hot_queries(db):
+        statements = []
+        connection.set_trace_callback(statements.append)
+        query()
+        connection.set_trace_callback(None)
+        for statement in statements:
+            for row in connection.execute(f"EXPLAIN QUERY PLAN {statement}"):
+                detail = row[-1]
+                if detail.startswith("SCAN") and "USING" not in detail:
+                    full_scans.append(f"{name}: {detail}")
+        indexed[name] = timeit.timeit(query, number=iterations)
+    for index, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"):
+        db.write(f"DROP INDEX {index}").result()
+    for name, query in hot_queries(db):
+        scan = timeit.timeit(query, number=iterations)
+        print(f"  {name:<24} indexed {indexed[name] / iterations * 1e6:9.1f} us"
+              f"   no index {scan / iterations * 1e6:9.1f} us")
+    db.close()
+    shutil.rmtree(directory)
+    for full_scan in full_scans:
+        print(f"  FULL SCAN {full_scan}")
+    if full_scans:
+        raise SystemExit("hot queries must use an index")
+
+
+def bench_identity(users=20000, iterations=2000):
+    """
+    Times the user lookups behind one direct message (find_user_id for both users, plus find_friendship_id)
+    with the identity cache disabled and enabled, and reports the cache hit rate.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    print(f"identity cache ({users} users, {iterations} messages)")
+    for cache_size in (0, identity.MAX_IDENTITIES):
+        db = database.Database(os.path.join(directory, f"bench{cache_size}.sqlite"),
+                               identity_cache_size=cache_size)
+        seed_database(db, users)
+        hits, misses = db.identities.hits.value, db.identities.misses.value
+
+        def lookups():
+            db.find_user_id("user500")
+            db.find_user_id("user501")
+            db.find_friendship_id("user500", "user501")
+
+        elapsed = timeit.timeit(lookups, number=iterations)
+        hits, misses = db.identities.hits.value - hits, db.identities.misses.value - misses
+        print(f"  cache size {cache_size:<7} {elapsed / iterations * 1e6:7.1f} us per message"
+              f"   hit rate {hits / (hits + misses):.1%}")
+        db.close()
+    shutil.rmtree(directory)
+
+
+def bench_username_available(users=1000000, iterations=2000):
+    """
+    Times Database.username_available for free and taken usernames against the SELECT * FROM users scan
+    registration used before, and reports the Bloom filter's size, build time and false positive rate.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    db = database.Database(os.path.join(directory, "bench.sqlite"))
+    db.submit(lambda cursor: cursor.executemany(
+        "INSERT INTO users (username, password, user_status) VALUES (?, 'x', 'OFFLINE')",
+        ((f"user{number}",) for number in range(users)))).result()
+    db.usernames = bloom.BloomFilter(users * 2)
+    started = time.perf_counter()
+    db.load_usernames()
+    loaded = time.perf_counter() - started
+    print(f"username availability ({users} users)")
+    print(f"  bloom filter  {len(db.usernames.bits) / 2 ** 20:.1f} MiB, {db.usernames.hashes} hashes,"
+          f" built in {loaded:.2f} s")
+    false_positives = sum(f"free{number}" in db.usernames for number in range(100000))
+    print(f"  false positive rate {false_positives / 100000:.2%}")
+    for label, username in (("free", "free-username"), ("taken", f"user{users // 2}")):
+        elapsed = timeit.timeit(lambda: db.username_available(username), number=iterations)
+        print(f"  {label:<6} username_available {elapsed / iterations * 1e6:8.1f} us")
+
+    def scan():
+        db.cursor.execute("SELECT * FROM users")
+        return db.cursor.fetchall()
+
+    elapsed = timeit.timeit(scan, number=3)
+    print(f"  full table scan (previous check) {elapsed / 3 * 1e6:12.1f} us")
+    db.close()
+    shutil.rmtree(directory)
+
+
+def bench_history(messages=500000, iterations=500):
+    """
+    Times fetching one page of a single long conversation at increasing depths, with keyset pagination
+    (Database.fetch_history) against the equivalent LIMIT/OFFSET query.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    db = database.Database(os.path.join(directory, "bench.sqlite"))
+    seed_database(db, 2, friends_per_user=1, messages_per_user=0)
+    conversation = db.conversation_key(1, 2)
+    db.submit(lambda cursor: cursor.executemany(
+        "INSERT INTO messages (sender, receiver, message, conversation, created_at) VALUES (?, ?, 'hi', ?, ?)",
+        ((number % 2 + 1, (number + 1) % 2 + 1, conversation, number) for number in range(messages)))).result()
+    first_id = db.cursor.execute("SELECT MIN(message_id) FROM messages").fetchone()[0]
+    page = db.HISTORY_PAGE_SIZE
+    print(f"history ({messages} messages in one conversation, {page} per page)")
+    for depth in (0, messages // 100, messages // 2, messages - page):
+        before_id = first_id + messages - depth
+
+        def offset_page():
+            db.cursor.execute("SELECT message_id, sender, message, created_at FROM messages WHERE conversation = ? "
+                              "ORDER BY message_id DESC LIMIT ? OFFSET ?", [conversation, page, depth])
+            return db.cursor.fetchall()
+
+        keyset = timeit.timeit(lambda: db.fetch_history("user0", "user1", before_id, page), number=iterations)
+        offset = timeit.timeit(offset_page, number=max(iterations // 50, 1)) / max(iterations // 50, 1)
+        print(f"  {depth:7d} messages back   keyset {keyset / iterations * 1e6:8.1f} us"
+              f"   offset {offset * 1e6:10.1f} us")
+    db.close()
+    shutil.rmtree(directory)
+
+
+def bench_friend_graph(users=20000, iterations=2000):
+    """
+    Times the friendship checks behind a direct message or game request and the friend list behind a login
+    answered from the friend graph, against the friends table queries they replace, and the graph's load time.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    db = database.Database(os.path.join(directory, "bench.sqlite"))
+    seed_database(db, users, messages_per_user=0)
+    started = time.perf_counter()
+    db.load_friends()
+    print(f"friend graph ({users} users, {len(db.friends.edges)} friendships, loaded in"
+          f" {time.perf_counter() - started:.2f} s)")
+    user_id, friend_id = db.find_user_id("user500"), db.find_user_id("user501")
+
+    def sql_friendship_id():
+        db.cursor.execute("SELECT id FROM friends WHERE sender = ? AND receiver = ? "
+                          "UNION ALL SELECT id FROM friends WHERE sender = ? AND receiver = ?",
+                          [user_id, friend_id, friend_id, user_id])
+        return db.cursor.fetchone()
+
+    def sql_friends():
+        db.cursor.execute("SELECT username FROM users INNER JOIN friends ON users.user_id=friends.sender "
+                          "WHERE friends.status='FRIENDS' AND friends.receiver = ? UNION ALL "
+                          "SELECT username FROM users INNER JOIN friends ON users.user_id=friends.receiver "
+                          "WHERE friends.status='FRIENDS' AND friends.sender = ?", [user_id, user_id])
+        return db.cursor.fetchall()
+
+    for name, graph, sql in (
+            ("find_friendship_id", lambda: db.find_friendship_id("user500", "user501"), sql_friendship_id),
+            ("view_friends", lambda: db.view_friends("user500"), sql_friends)):
+        graph_time = timeit.timeit(graph, number=iterations)
+        sql_time = timeit.timeit(sql, number=iterations)
+        print(f"  {name:<20} graph {graph_time / iterations * 1e6:7.1f} us   sql {sql_time / iterations * 1e6:7.1f} us")
+    db.close()
+    shutil.rmtree(directory)
+
+
+class DeliveryProbe:
+    """
+    Stands in for the recipient's connection and records when a frame was handed to it.
+    """
+    codec = codec.JSON
+
+    def __init__(self):
+        self.delivered = None
+
+    def send_frame(self, frame):
+        self.delivered = time.perf_counter()
+        return True
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def bench_dm_latency(messages=2000):
+    """
+    Compares the SYNC and WRITE_BEHIND direct message durability levels: time from the server handling a
+    direct message to the frame reaching the recipient's connection, and how long persisting them all takes.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    print(f"direct message latency ({messages} messages)")
+    for durability in pipeline.DURABILITY_LEVELS:
+        chat_server = server.Server('127.0.0.1', 0, dm_durability=durability)
+        chat_server.db = database.Database(os.path.join(directory, f"{durability}.sqlite"))
+        seed_database(chat_server.db, 2, friends_per_user=1, messages_per_user=0)
+        chat_server.messages = pipeline.MessagePipeline(chat_server.db, durability)
+        probe = DeliveryProbe()
+        chat_server.clients["user1"] = probe
+        sender = PlayerProbe()
+        chat_server.sessions[sender] = "user0"
+        latencies = []
+        started = time.perf_counter()
+        for number in range(messages):
+            data = chat_server.build_message(utility.LoggedInCommands.DIRECT_MESSAGE.value, "user1",
+                                             f"message {number}", "user0")
+            sent = time.perf_counter()
+            chat_server.direct_message(sender, data)
+            latencies.append(probe.delivered - sent)
+        chat_server.messages.flush()
+        persisted = time.perf_counter() - started
+        chat_server.close_resources()
+        print(f"  {durability:<13} delivery p50 {percentile(latencies, 0.5) * 1e6:8.1f} us"
+              f"   p99 {percentile(latencies, 0.99) * 1e6:8.1f} us   all persisted in {persisted:.2f} s")
+    shutil.rmtree(directory)
+
+
+def bench_ttt(iterations=20000):
+    """
+    Plays every possible tic tac toe game with the bitboard engine, checking each result against the dict board
+    implementation it replaced, then times whole games with each.
+    """
+    mismatches = []
+    legacy_false_ties = 0
+    games = 0
+
+    def explore(board, moves, mark):
+        nonlocal legacy_false_ties, games
+        for square, bit in ttt_game.SQUARE_BITS.items():
+            if (board.x | board.o) & bit:
+                continue
+            child = ttt_game.BitBoard(board.x, board.o)
+            outcome = child.play(mark, square)
+            legacy, _ = legacy_update_board(board.to_dict(), mark, square)
+            legacy = legacy if isinstance(legacy, str) else ttt_game.PLAYING
+            if legacy != outcome:
+                if legacy == ttt_game.TIE and outcome == ttt_game.PLAYING and not (child.x | child.o) & 1 << 8:
+                    legacy_false_ties += 1
+                else:
+                    mismatches.append((moves + square, outcome, legacy))
+            if outcome == ttt_game.PLAYING:
+                explore(child, moves + square, 'O' if mark == 'X' else 'X')
+            else:
+                games += 1
+
+    explore(ttt_game.BitBoard(), "", 'X')
+    print(f"tic tac toe engine ({games} possible games checked)")
+    print(f"  positions the dict board wrongly called a tie (square 9 empty) {legacy_false_ties}")
+    script = (('X', '5'), ('O', '1'), ('X', '9'), ('O', '7'), ('X', '4'), ('O', '6'), ('X', '3'), ('O', '2'),
+              ('X', '8'))
+
+    def dict_game():
+        board = ttt_game.return_new_board()
+        for mark, square in script:
+            legacy_update_board(board, mark, square)
+
+    def bitboard_game():
+        board = ttt_game.BitBoard()
+        for mark, square in script:
+            board.play(mark, square)
+
+    legacy = timeit.timeit(dict_game, number=iterations)
+    bitboard = timeit.timeit(bitboard_game, number=iterations)
+    print(f"  9 move game   dict board {legacy / iterations * 1e6:6.2f} us"
+          f"   bitboard {bitboard / iterations * 1e6:6.2f} us")
+    for mismatch in mismatches[:10]:
+        print(f"  MISMATCH moves {mismatch[0]}: bitboard {mismatch[1]}, dict board {mismatch[2]}")
+    if mismatches:
+        raise SystemExit("the bitboard engine must agree with the dict board")
+
+
+class PlayerProbe:
+    """
+    Stands in for a player's connection and keeps the last frame sent to it.
+    """
+    codec = codec.JSON
+
+    def __init__(self):
+        self.last = None
+
+    def send_frame(self, frame):
+        self.last = frame
+        return True
+
+    def last_message(self):
+        return codec.JSON.decode(self.last[protocol.HEADER.size:])
+
+
+class IdleProbe(PlayerProbe):
+    """
+    Stands in for an open connection last heard from at a given time.
+    """
+
+    def __init__(self, last_received):
+        super().__init__()
+        self.last_received = last_received
+        self.pinged = False
+
+    @staticmethod
+    def is_closing():
+        return False
+
+    def abort(self):
+        pass
+
+
+def bench_reaper(connections=10000, iterations=20):
+    """
+    Cost of one reaper pass over every open connection: with every connection live, and with all of them silent
+    past the heartbeat interval (each sent a PING) and then past the idle timeout (each reaped).
+    """
+    chat_server = server.Server('127.0.0.1', 0)
+    now = time.monotonic()
+    print(f"reaper ({connections} connections)")
+    for name, silent in (("live", 0.0), ("ping", chat_server.heartbeat_interval),
+                         ("reap", chat_server.idle_timeout)):
+        elapsed = 0.0
+        for iteration in range(iterations):
+            chat_server.open_connections = {IdleProbe(now - silent) for number in range(connections)}
+            started = time.perf_counter()
+            chat_server.reap(now)
+            elapsed += time.perf_counter() - started
+        print(f"  {name:<5} {elapsed / iterations * 1e3:7.2f} ms per pass"
+              f"   {elapsed / iterations / connections * 1e9:6.0f} ns per connection")
+
+
+def bench_games(games=5000, threads=16):
+    """
+    Load test of the game registry: starts games concurrent tic tac toe games between distinct players and plays
+    them all at once from a pool of handler threads, one move of every game per round, so moves of different
+    games interleave. Each game is scripted for X to win on the top row; every player must end with the
+    TIC_TAC_TOE_WINNER frame of their own game.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    chat_server = server.Server('127.0.0.1', 0)
+    chat_server.db = database.Database(os.path.join(directory, "bench.sqlite"))
+    for game_id in range(games):
+        for player in (f"x{game_id}", f"o{game_id}"):
+            chat_server.clients[player] = PlayerProbe()
+            chat_server.sessions[chat_server.clients[player]] = player
+        chat_server.start_game(game_id, f"x{game_id}", f"o{game_id}")
+    print(f"game sessions ({games} concurrent games, {threads} handler threads)")
+    script = (("x", "7"), ("o", "1"), ("x", "8"), ("o", "2"), ("x", "9"))
+    latencies = []
+
+    def play(game_id, player, square):
+        data = chat_server.build_message(utility.Responses.PLAY_TIC_TAC_TOE.value, f"{player}{game_id}", None,
+                                         [game_id, square])
+        started = time.perf_counter()
+        chat_server.handle_message(chat_server.clients[f"{player}{game_id}"], data)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        for player, square in script:
+            list(executor.map(lambda game_id: play(game_id, player, square), range(games)))
+    elapsed = time.perf_counter() - started
+    wrong = [player for player, probe in chat_server.clients.items()
+             if probe.last_message()["header"] != utility.Responses.TIC_TAC_TOE_WINNER.value
+             or probe.last_message()["extra_info"][1]["9"] != "X"]
+    print(f"  {len(latencies)} moves in {elapsed:.2f} s ({len(latencies) / elapsed:.0f} moves/s)"
+          f"   p50 {percentile(latencies, 0.5) * 1e6:.1f} us   p99 {percentile(latencies, 0.99) * 1e6:.1f} us")
+    print(f"  games still in progress {len(chat_server.games)}   players with a wrong result {len(wrong)}")
+    chat_server.db.close()
+    shutil.rmtree(directory)
+    if wrong or len(chat_server.games):
+        raise SystemExit("every game must finish with its own result")
+
+
+def bench_metrics(users=2000, iterations=20000):
+    """
+    Overhead of the timing instrumentation: runs two commands through handle_message, a friends list (one
+    handler, one db call, one send) and a broadcast-sized no-op handler, with metrics disabled and enabled.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    chat_server = server.Server('127.0.0.1', 0)
+    chat_server.db = database.Database(os.path.join(directory, "bench.sqlite"))
+    seed_database(chat_server.db, users)
+    probe = PlayerProbe()
+    chat_server.sessions[probe] = "user500"
+    chat_server.handlers[utility.LoggedInCommands.FETCH_HISTORY] = server.Handler(lambda *args: None, True, False)
+    messages = {
+        "view_friends": chat_server.build_message(utility.LoggedInCommands.VIEW_FRIENDS.value, "user500", None,
+                                                  None),
+        "no-op handler": chat_server.build_message(utility.LoggedInCommands.FETCH_HISTORY.value, "user500", None,
+                                                   None),
+    }
+    print(f"metrics overhead ({iterations} messages)")
+    for name, data in messages.items():
+        timings = {}
+        for enabled in (True, False):
+            metrics.set_enabled(enabled)
+            timings[enabled] = min(timeit.repeat(lambda: chat_server.handle_message(probe, data), number=iterations,
+                                                 repeat=3))
+        print(f"  {name:<14} disabled {timings[False] / iterations * 1e6:6.2f} us"
+              f"   enabled {timings[True] / iterations * 1e6:6.2f} us"
+              f"   overhead {(timings[True] - timings[False]) / iterations * 1e6:+6.2f} us")
+    metrics.set_enabled(True)
+    chat_server.db.close()
+    shutil.rmtree(directory)
+
+
+class CountingProbe(PlayerProbe):
+    """
+    Stands in for a player's connection and counts the frames sent to it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.frames = 0
+
+    def send_frame(self, frame):
+        self.frames += 1
+        return super().send_frame(frame)
+
+
+def bench_rooms(users=10000, rooms=1000, iterations=2000):
+    """
+    Chat rooms with users spread evenly over rooms, every user online: the cost of creating and joining a room,
+    of a post reaching its room's members compared with a broadcast reaching every client, the frames each sends,
+    and the time to reload the rooms from the db at startup.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-bench-")
+    chat_server = server.Server('127.0.0.1', 0)
+    chat_server.db = database.Database(os.path.join(directory, "bench.sqlite"))
+    seed_database(chat_server.db, users, messages_per_user=0)
+    for number in range(users):
+        chat_server.clients[f"user{number}"] = CountingProbe()
+        chat_server.sessions[chat_server.clients[f"user{number}"]] = f"user{number}"
+    print(f"rooms ({users} users online in {rooms} rooms)")
+
+    def run(command, username, body):
+        data = chat_server.build_message(command.value, username, body, None)
+        chat_server.handle_message(chat_server.clients[username], data)
+
+    started = time.perf_counter()
+    for number in range(rooms):
+        run(utility.LoggedInCommands.CREATE_ROOM, f"user{number}", f"room{number}")
+    elapsed = time.perf_counter() - started
+    print(f"  create    {elapsed / rooms * 1e6:8.1f} us per room (waits for its commit)")
+    started = time.perf_counter()
+    for number in range(rooms, users):
+        run(utility.LoggedInCommands.JOIN_ROOM, f"user{number}", f"room{number % rooms}")
+    elapsed = time.perf_counter() - started
+    print(f"  join      {elapsed / (users - rooms) * 1e6:8.1f} us per join")
+
+    probes = list(chat_server.clients.values())
+    sent = sum(probe.frames for probe in probes)
+    post = chat_server.build_message(utility.LoggedInCommands.POST_ROOM.value, "room0", "hello", None)
+    elapsed = min(timeit.repeat(lambda: chat_server.handle_message(chat_server.clients["user0"], post),
+                                number=iterations, repeat=3))
+    frames = (sum(probe.frames for probe in probes) - sent) / (iterations * 3)
+    print(f"  post      {elapsed / iterations * 1e6:8.1f} us per post    {frames:6.0f} frames per post")
+    sent = sum(probe.frames for probe in probes)
+    response = chat_server.build_message(utility.Responses.BROADCAST_MSG.value, "user0", "hello", None)
+    broadcasts = max(iterations // 100, 1)
+    elapsed = min(timeit.repeat(lambda: chat_server.fan_out(response), number=broadcasts, repeat=3))
+    frames = (sum(probe.frames for probe in probes) - sent) / (broadcasts * 3)
+    print(f"  broadcast {elapsed / broadcasts * 1e6:8.1f} us per message {frames:6.0f} frames per message")
+
+    chat_server.db.submit(lambda cursor: None).result()
+    started = time.perf_counter()
+    chat_server.rooms.load(*chat_server.db.load_rooms())
+    elapsed = time.perf_counter() - started
+    members = sum(len(room.members) for room in chat_server.rooms.rooms.values())
+    print(f"  reload    {elapsed * 1e3:8.1f} ms for {len(chat_server.rooms)} rooms and {members} memberships")
+    chat_server.db.close()
+    shutil.rmtree(directory)
+    if members != users:
+        raise SystemExit("every user must be a member of one room after reloading")
+
+
+def compression_stream(kind, count, seed=1):
+    """
+    count distinct messages of one type, shaped as the server sends them, with chat text drawn from a small
+    vocabulary so consecutive messages share words but never repeat exactly.
+    """
+    generator = random.Random(seed)
+    words = [f"{stem}{suffix}" for stem in ("hello", "game", "later", "lunch", "match", "deploy", "weekend", "coffee",
+                                             "meeting", "train", "review", "server", "football", "tonight")
+             for suffix in ("", "s", "ing", "ed")]
+    build = server.Server.build_message
+
+    def text():
+        return " ".join(generator.choice(words) for word in range(generator.randint(3, 12)))
+
+    def page(size, newest):
+        return [[newest - number, f"user{generator.randint(0, 1)}", text(), 1700000000000000 + newest * 997 - number]
+                for number in range(size)]
+
+    for number in range(count):
+        if kind == "broadcast":
+            yield build(utility.Responses.BROADCAST_MSG.value, f"user{generator.randint(0, 999)}", text(), None)
+        elif kind == "dm_history":
+            yield build(utility.LoggedInCommands.DIRECT_MESSAGE.value, f"user{number}", "user0",
+                        page(database.Database.HISTORY_PAGE_SIZE, 100000 + number * 50))
+        elif kind == "history_100":
+            yield build(utility.Responses.HISTORY.value, f"user{number}", page(database.Database.MAX_HISTORY_PAGE,
+                                                                              100000 + number * 200), None)
+        elif kind == "friends_list":
+            friends = sorted(generator.sample(range(10000), 20))
+            yield build(utility.Responses.PRINT_FRIENDS_LIST.value, f"user{number}",
+                        "\n".join(f"user{friend} : {generator.choice(('ONLINE', 'OFFLINE', 'AWAY'))}"
+                                  for friend in friends), None)
+        elif kind == "tic_tac_toe":
+            board = ttt_game.return_new_board()
+            for square in generator.sample(sorted(board), generator.randint(0, 8)):
+                board[square] = generator.choice("XO")
+            yield build(utility.Responses.PLAY_TIC_TAC_TOE.value, f"user{number}", f"user{number + 1}",
+                        [ttt_game.get_help_board(), board, generator.choice("XO"), number])
+
+
+def bench_compression(count=2000):
+    """
+    Bytes saved and CPU spent by per-connection compression, per message type and codec. A stream of count
+    distinct messages of each type goes through one deflate context, as on a connection, and through a new
+    context per message for comparison. Times are per message; payloads below the threshold are sent as they
+    are on a real connection, so those rows show what compressing them anyway would give.
+    """
+    print(f"compression ({count} messages per type, level {compression.LEVEL}, window 2**{compression.WINDOW_BITS},"
+          f" threshold {compression.THRESHOLD} bytes)")
+    print(f"  {'message':<13}{'codec':<7}{'raw':>7}{'stream':>8}{'saved':>7}{'fresh':>7}{'deflate':>10}"
+          f"{'inflate':>10}")
+    for kind in ("broadcast", "dm_history", "history_100", "friends_list", "tic_tac_toe"):
+        for message_codec in (codec.JSON, codec.BINARY):
+            payloads = [message_codec.encode(message) for message in compression_stream(kind, count)]
+            deflater, inflater = compression.Deflater(threshold=0), compression.Inflater()
+            started = time.perf_counter()
+            compressed = [deflater.compress(payload) for payload in payloads]
+            deflate_time = time.perf_counter() - started
+            started = time.perf_counter()
+            inflated = [inflater.decompress(payload) for payload in compressed]
+            inflate_time = time.perf_counter() - started
+            if inflated != payloads:
+                raise SystemExit(f"{kind} {message_codec.name} did not survive a round trip")
+            fresh = sum(len(compression.Deflater(threshold=0).compress(payload)) for payload in payloads)
+            raw = sum(map(len, payloads))
+            streamed = sum(map(len, compressed))
+            note = "" if raw / count >= compression.THRESHOLD else "  (below threshold)"
+            print(f"  {kind:<13}{message_codec.name:<7}{raw / count:7.0f}{streamed / count:8.0f}"
+                  f"{1 - streamed / raw:7.0%}{fresh / count:7.0f}{deflate_time / count * 1e6:8.1f}us"
+                  f"{inflate_time / count * 1e6:8.1f}us{note}")
+
+
+BENCHMARKS = {
+    "dispatch": bench_dispatch,
+    "codec": bench_codec,
+    "query_plans": bench_query_plans,
+    "identity": bench_identity,
+    "username_available": bench_username_available,
+    "history": bench_history,
+    "friend_graph": bench_friend_graph,
+    "dm_latency": bench_dm_latency,
+    "games": bench_games,
+    "ttt": bench_ttt,
+    "metrics": bench_metrics,
+    "reaper": bench_reaper,
+    "rooms": bench_rooms,
+    "compression": bench_compression,
+}
+
+
+if __name__ == '__main__':
+    """
+    Runs the benchmarks named on the command line, or all of them.
+    """
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -0,0 +1,64 @@
+import math
+import threading
+
+HASH_MASK = (1 << 64) - 1
+HALF_MASK = (1 << 32) - 1
+
+
+class BloomFilter:
+    """
+    Fixed size probabilistic set of strings. A negative answer is always right; a positive answer is wrong with
+    roughly error_rate probability while no more than capacity items have been added, and more often beyond it.
+    Attributes:
+        size (int): Number of bits.
+        hashes (int): Bits set per item.
+        bits (bytearray): The bit array.
+        count (int): Items added so far.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def positions(self, item):
+        """
+        Bit positions of an item, by double hashing the two halves of its 64 bit hash(). The filter never leaves
+        the process, so the per-process string hash seed does not matter.
+        """
+        item_hash = hash(item) & HASH_MASK
+        first = item_hash & HALF_MASK
+        second = item_hash >> 32 | 1
+        return [(first + number * second) % self.size for number in range(self.hashes)]
+
+    def add(self, item):
+        positions = self.positions(item)
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def update(self, items):
+        """
+        Adds many items under one lock acquisition; used to build the filter at startup.
+        """
+        bits, size, hashes = self.bits, self.size, range(self.hashes)
+        added = 0
+        with self.lock:
+            for item in items:
+                item_hash = hash(item) & HASH_MASK
+                position = item_hash & HALF_MASK
+                step = item_hash >> 32 | 1
+                for _ in hashes:
+                    index = position % size
+                    bits[index >> 3] |= 1 << (index & 7)
+                    position += step
+                added += 1
+            self.count += added
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
@@ -0,0 +1,435 @@
+import asyncio
+import itertools
+import logging
+import socket
+
+import codec
+import compression
+import protocol
+import utility
+
+REPLY_TIMEOUT = 10.0
+BUSY_RETRY_DELAY = 0.05
+PUSH_QUEUE_SIZE = 1024
+READ_SIZE = 65536
+
+
+class ChatError(Exception):
+    """
+    Raised when the server refuses a request, with the reason it gave as the message.
+    Attributes:
+        reply (dict): The message refusing the request.
+    """
+
+    def __init__(self, reply):
+        super().__init__(reply["body"])
+        self.reply = reply
+
+
+class ChatClient:
+    """
+    asyncio client library for the chat server, for bots, bridges and tests as well as the terminal client.
+    Every message is sent with a request id, and a request returns an awaitable answered by the reply echoing
+    its id, so many requests can be in flight on one connection at once. Only until the server has been seen to
+    echo an id are replies without one matched to the oldest request in flight that they can answer, which the
+    server handling a connection's messages in order makes safe for servers that never echo ids. Commands the
+    server only answers when they fail (broadcasts, direct messages, tic tac toe invites and moves) complete
+    once written, and their errors, echoing the command's id, arrive as ERROR pushes.
+    Every frame that is not a reply is a push (broadcasts, direct messages, presence, game turns), handed to
+    the callbacks registered for its header or, if there are none, queued for pushes(). The server's heartbeat
+    PINGs are answered automatically.
+    Attributes:
+        host (str): Server address.
+        port (int): Server port.
+        codecs (tuple): Names of the codecs offered at login, in preference order.
+        compression_methods (tuple): Names of the compression methods offered on connecting, in preference
+            order; empty to not offer compression.
+        timeout (float): Seconds to wait for a reply before the request raises asyncio.TimeoutError.
+        username (str): Username once logged in, else None.
+        codec (JsonCodec | BinaryCodec): Codec used to send, chosen by the server at login.
+        deflater (Deflater): Compresses frames sent once the server has accepted compression, else None.
+        inflater (Inflater): Decompresses the server's compressed frames once compression has been offered.
+        pending (dict): (reply headers, Future) of each request awaiting its reply keyed by request id, oldest
+            first.
+        callbacks (dict): List of push callbacks keyed by header opcode.
+        echoes_ids (bool): True once a message echoing a request id has been received.
+        dropped (int): Pushes dropped because nothing was reading pushes() and the queue was full.
+    """
+
+    def __init__(self, host: str, port: int, codecs=(codec.BINARY.name, codec.JSON.name),
+                 timeout: float = REPLY_TIMEOUT, compression_methods=(compression.DEFLATE,)):
+        self.host = host
+        self.port = port
+        self.codecs = tuple(codecs)
+        self.compression_methods = tuple(compression_methods)
+        self.timeout = timeout
+        self.username = None
+        self.codec = codec.JSON
+        self.deflater = None
+        self.inflater = None
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.echoes_ids = False
+        self.callbacks = {}
+        self.queue = asyncio.Queue(PUSH_QUEUE_SIZE)
+        self.dropped = 0
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+
+    async def connect(self):
+        """
+        Opens the connection, starts reading replies and pushes from it and offers compression. The inflater is
+        ready before the offer is sent, since the server may compress frames as soon as it has accepted; this
+        side compresses only once the acceptance has arrived.
+        """
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.reader_task = asyncio.create_task(self.read_loop())
+        if self.compression_methods:
+            self.inflater = compression.Inflater()
+            reply = await self.call(utility.LoginCommands.COMPRESS, None, list(self.compression_methods), None,
+                                    (utility.LoginCommands.COMPRESS,))
+            if reply["body"] is not None:
+                self.deflater = compression.Deflater(reply["extra_info"])
+
+    async def close(self):
+        """
+        Quits, if logged in, and closes the connection.
+        """
+        if self.writer is None:
+            return
+        if self.username is not None and not self.writer.is_closing():
+            try:
+                await self.request(utility.LoggedInCommands.QUIT, self.username, None, "OFFLINE",
+                                   (utility.LoggedInCommands.QUIT,))
+            except (asyncio.TimeoutError, socket.error) as e:
+                logging.error(e)
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except socket.error:
+            pass
+        self.reader_task.cancel()
+        self.username = None
+
+    def on(self, header, callback):
+        """
+        Registers a callback run with each pushed message with the header. Callbacks run on the event loop, so
+        they must not block; pushes with a callback are not queued for pushes().
+
+        :param header: Header enum of the pushes.
+        :param callback: Function taking the message dictionary.
+        """
+        self.callbacks.setdefault(int(header), []).append(callback)
+
+    async def pushes(self):
+        """
+        Async iterator over the pushed messages that have no callback, ending when the connection closes.
+        """
+        while True:
+            data = await self.queue.get()
+            if data is None:
+                return
+            yield data
+
+    def send(self, header, addressee, body, extra_info, request_id=None):
+        """
+        Writes a message to the connection without waiting for anything.
+
+        :param header: Header enum.
+        :param request_id: Id for the server to echo in its reply, or None.
+        """
+        if self.writer is None or self.writer.is_closing():
+            raise ConnectionResetError("Not connected to the server")
+        message = {"header": int(header), "addressee": addressee, "body": body, "extra_info": extra_info}
+        if request_id is not None:
+            message["request_id"] = request_id
+        payload = self.codec.encode(message)
+        if self.deflater is not None:
+            payload = self.deflater.compress(payload)
+        self.writer.write(protocol.encode_frame(payload))
+
+    async def command(self, header, addressee, body, extra_info):
+        """
+        Sends a command the server does not answer unless it fails, waiting only until it has been written. It
+        carries a request id like any request, so an ERROR it causes can never answer a request in flight.
+        """
+        self.send(header, addressee, body, extra_info, next(self.request_ids))
+        await self.writer.drain()
+
+    async def request(self, header, addressee, body, extra_info, replies):
+        """
+        Sends a request and waits for its reply.
+
+        :param header: Header enum of the request.
+        :param replies: Header enums of the messages that answer the request.
+        :return: The reply message dictionary.
+        """
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = ({int(reply) for reply in replies}, future)
+        try:
+            self.send(header, addressee, body, extra_info, request_id)
+            await self.writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def call(self, header, addressee, body, extra_info, replies):
+        """
+        Sends a request that the server answers with one of the reply headers, or with ERROR if it fails.
+
+        :return: The reply message dictionary.
+        :raises ChatError: If the server answered ERROR.
+        """
+        reply = await self.request(header, addressee, body, extra_info, replies + (utility.Responses.ERROR,))
+        if reply["header"] == utility.Responses.ERROR.value:
+            raise ChatError(reply)
+        return reply
+
+    async def read_loop(self):
+        decoder = protocol.FrameDecoder()
+        try:
+            while True:
+                received = await self.reader.read(READ_SIZE)
+                if not received:
+                    break
+                decoder.feed(received)
+                for payload in decoder.frames():
+                    self.dispatch(codec.decode(compression.decompress(self.inflater, payload)))
+        except (socket.error, protocol.ProtocolError) as e:
+            logging.error(e)
+        finally:
+            for replies, future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionResetError("Connection closed by server"))
+            self.queue_push(None)
+
+    def dispatch(self, data):
+        """
+        Answers the request the message is a reply to, else handles it as a push. A message echoing a request id
+        answers that request if it is still in flight and the header is one of its replies; other messages sent
+        while the server handled the request (such as INBOX after LOGGED_IN) are pushes. A message without an
+        id is matched by header only if the server has never echoed one.
+        """
+        if "request_id" in data:
+            self.echoes_ids = True
+            waiter = self.pending.get(data["request_id"])
+            if waiter is not None and data["header"] in waiter[0]:
+                self.answer(data["request_id"], data)
+                return
+        elif not self.echoes_ids:
+            for request_id, (replies, future) in self.pending.items():
+                if data["header"] in replies:
+                    self.answer(request_id, data)
+                    return
+        if data["header"] == utility.Heartbeats.PING.value:
+            self.send(utility.Heartbeats.PONG, None, None, None)
+            return
+        callbacks = self.callbacks.get(data["header"])
+        if not callbacks:
+            self.queue_push(data)
+            return
+        for callback in callbacks:
+            try:
+                callback(data)
+            except Exception as e:
+                logging.error(e)
+
+    def answer(self, request_id, data):
+        replies, future = self.pending.pop(request_id)
+        if not future.done():
+            future.set_result(data)
+
+    def queue_push(self, data):
+        """
+        Queues a push for pushes(), dropping the oldest queued push if the queue is full.
+        """
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+    async def sign_in(self, header, username, password, extra_info, replies):
+        while True:
+            reply = await self.request(header, username, password, extra_info, replies + (utility.Responses.BUSY,))
+            if reply["header"] != utility.Responses.BUSY.value:
+                return reply
+            await asyncio.sleep(BUSY_RETRY_DELAY)
+
+    async def register(self, username, password):
+        """
+        Registers a new account, retrying while the server's password pool is busy.
+
+        :raises ChatError: If the username is taken or invalid.
+        """
+        reply = await self.sign_in(utility.LoginCommands.REGISTER, username, password, None,
+                                   (utility.LoginCommands.REGISTERED, utility.LoginCommands.REGISTER))
+        if reply["header"] != utility.LoginCommands.REGISTERED.value:
+            raise ChatError(reply)
+
+    async def login(self, username, password):
+        """
+        Logs in, retrying while the server's password pool is busy, and switches to the codec the server chose.
+        Direct messages received while offline follow as INBOX pushes.
+
+        :raises ChatError: If the username or password is wrong.
+        """
+        reply = await self.sign_in(utility.LoginCommands.LOGIN, username, password, {"codecs": list(self.codecs)},
+                                   (utility.LoginCommands.LOGGED_IN, utility.LoginCommands.LOGIN))
+        if reply["header"] != utility.LoginCommands.LOGGED_IN.value:
+            raise ChatError(reply)
+        self.username = username
+        self.codec = codec.CODECS.get(reply["extra_info"], codec.JSON)
+
+    async def broadcast(self, text):
+        """
+        Sends a message to every online user. The sender gets their own copy as a BROADCAST_MSG push.
+        """
+        await self.command(utility.LoggedInCommands.BROADCAST, self.username, text, None)
+
+    async def open_dm(self, recipient):
+        """
+        Checks a user exists before direct messaging them.
+
+        :return: The latest page of the conversation, as [message_id, sender, message, created_at] lists newest
+            first.
+        :raises ChatError: If the user does not exist.
+        """
+        reply = await self.call(utility.LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE, recipient, self.username,
+                                None, (utility.LoggedInCommands.DIRECT_MESSAGE,))
+        return reply["extra_info"]
+
+    async def send_dm(self, recipient, text):
+        """
+        Sends a direct message, delivered straight away if the recipient is online, else to their inbox.
+        """
+        await self.command(utility.LoggedInCommands.DIRECT_MESSAGE, recipient, text, self.username)
+
+    async def history(self, recipient, before_id, limit=None):
+        """
+        :param before_id: Oldest message id already seen.
+        :param limit: Page size, or None for the server's default.
+        :return: (page of older messages newest first, message id to request the next page with or None).
+        """
+        reply = await self.call(utility.LoggedInCommands.FETCH_HISTORY, recipient, limit, before_id,
+                                (utility.Responses.HISTORY,))
+        return reply["body"], reply["extra_info"]
+
+    async def add_friend(self, username):
+        """
+        Sends a friend request, or accepts the one the user sent.
+
+        :return: The server's confirmation text.
+        :raises ChatError: If the user does not exist or is already a friend or requested.
+        """
+        reply = await self.call(utility.LoggedInCommands.ADD_FRIEND, self.username, username, None,
+                                (utility.Responses.SUCCESS,))
+        return reply["body"]
+
+    async def friend_requests(self):
+        """
+        :return: List of the usernames who have sent a friend request not yet accepted.
+        """
+        reply = await self.call(utility.LoggedInCommands.VIEW_FRIEND_REQUESTS, self.username, None, None,
+                                (utility.Responses.PRINT_FRIEND_REQUESTS,))
+        return reply["body"].split("\n") if reply["body"] else []
+
+    async def friends(self):
+        """
+        :return: List of (username, status) of each friend.
+        """
+        reply = await self.call(utility.LoggedInCommands.VIEW_FRIENDS, self.username, None, None,
+                                (utility.Responses.PRINT_FRIENDS_LIST,))
+        return [tuple(line.split(" : ", 1)) for line in reply["body"].split("\n")] if reply["body"] else []
+
+    async def set_status(self, status):
+        """
+        :return: The server's confirmation text.
+        """
+        reply = await self.call(utility.LoggedInCommands.SET_STATUS_AWAY, self.username, status, None,
+                                (utility.Responses.PRINT_STATUS_AWAY,))
+        return reply["body"]
+
+    async def invite(self, username):
+        """
+        Invites an online user to a game of tic tac toe; they get a TIC_TAC_TOE_REQUEST push.
+        """
+        await self.command(utility.LoggedInCommands.AUTH_TIC_TAC_TOE, self.username, username, None)
+
+    async def game_invites(self):
+        """
+        :return: List of (username, game_id) of each tic tac toe invite received.
+        """
+        reply = await self.call(utility.LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS, self.username, None, None,
+                                (utility.Responses.PRINT_TTT_REQUESTS,))
+        return [tuple(invite) for invite in reply["body"]]
+
+    async def accept_game(self, requester, game_id):
+        """
+        Accepts a tic tac toe invite. The requester plays X and gets the first PLAY_TIC_TAC_TOE push.
+        """
+        await self.command(utility.Responses.TIC_TAC_TOE_CONFIRM, self.username, requester, game_id)
+
+    async def deny_game(self, requester, game_id):
+        await self.command(utility.Responses.TIC_TAC_TOE_DENY, self.username, requester, game_id)
+
+    async def move(self, game_id, square, opponent=None):
+        """
+        Plays a square, '1' to '9' as on the help board, in a game. The opponent is then asked to move, or both
+        players get the result.
+        """
+        await self.command(utility.Responses.PLAY_TIC_TAC_TOE, self.username, opponent, [game_id, square])
+
+    async def create_room(self, name):
+        """
+        Creates a chat room, with this user as its first member.
+
+        :raises ChatError: If the name is taken or invalid.
+        """
+        await self.call(utility.LoggedInCommands.CREATE_ROOM, self.username, name, None, (utility.Responses.SUCCESS,))
+
+    async def join_room(self, name):
+        """
+        Joins a chat room; its posts then arrive as ROOM_MSG pushes.
+
+        :return: The room's recent posts as [sender, message, created_at] lists, oldest first.
+        :raises ChatError: If there is no such room.
+        """
+        reply = await self.call(utility.LoggedInCommands.JOIN_ROOM, self.username, name, None,
+                                (utility.Responses.ROOM_HISTORY,))
+        return reply["body"]
+
+    async def leave_room(self, name):
+        await self.call(utility.LoggedInCommands.LEAVE_ROOM, self.username, name, None, (utility.Responses.SUCCESS,))
+
+    async def rooms(self):
+        """
+        :return: List of (name, member count, whether this user is a member) of every room.
+        """
+        reply = await self.call(utility.LoggedInCommands.LIST_ROOMS, self.username, None, None,
+                                (utility.Responses.ROOM_LIST,))
+        return [tuple(room) for room in reply["body"]]
+
+    async def post(self, name, text):
+        """
+        Posts a message to a room this user is a member of. Every online member, this user included, gets it as
+        a ROOM_MSG push.
+        """
+        await self.command(utility.LoggedInCommands.POST_ROOM, name, text, None)
+
+    async def ping(self):
+        """
+        :return: Round trip time to the server in seconds.
+        """
+        started = asyncio.get_running_loop().time()
+        await self.request(utility.Heartbeats.PING, None, None, None, (utility.Heartbeats.PONG,))
+        return asyncio.get_running_loop().time() - started
+
+    async def stats(self):
+        """
+        :return: Every server metric in the Prometheus text format.
+        :raises ChatError: If the user is not logged in as one of the server's admins.
+        """
+        reply = await self.call(utility.LoggedInCommands.STATS, None, None, None, (utility.Responses.STATS,))
+        return reply["body"]
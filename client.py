@@ -1,22 +1,21 @@
-import json
+import asyncio
 import logging
-import socket
 import sys
 import threading
-import time
 
+import chat_client
 import ttt_game
 import utility
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
-ENCODE = "utf-8"
-BUFFER_SIZE = 2048
 
 
 class Client:
     """
-    The client socket is created and attempts to connect to
-    the server on the defined host IP and port.
+    Terminal client, built on the chat_client library. Typed lines are read by a daemon thread and queued on the
+    event loop, so pushes from the server are printed while the user types. Each line goes to whatever the user
+    is doing (a prompt, the main menu, a broadcast or direct message session), except that while it is the
+    user's turn in a game of tic tac toe the next line is their move.
 
     :param: host (str): IP address used to connect to server.
     :param: port (int): PORT number used to connect to server.
@@ -25,394 +24,351 @@ class Client:
     def __init__(self, host: str, port: int):
         self.host = host
         self.port = port
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.chat = chat_client.ChatClient(host, port)
+        self.lines = None
+        self.turn = None
+        self.menu = self.build_menu()
 
     def run(self):
         """
-        Connects client socket to server IP and port. Spins up thread for client_send
-        function and runs receive in a loop (listens for new messages from server).
-        Starts the method for welcome menu().
+        Runs the client on an event loop until the user quits.
         """
         try:
-            logging.debug(f" Trying to connect to {self.host} : {self.port}...")
-            self.client_socket.connect((self.host, self.port))
-            logging.info(f" Successfully connected to {self.host} : {self.port}")
-            self.welcome_menu()
-        except socket.error as e:
+            asyncio.run(self.main())
+        except (OSError, EOFError) as e:
             logging.error(e)
 
-    def welcome_menu(self):
+    async def main(self):
         """
-        Method runs once the main 'run' function starts. Asks the users whether they want to login or register.
-        Runs function for login or registration accordingly.
+        Connects to the server, starts reading typed lines and registers the push handlers, then runs the
+        welcome menu and, once logged in, the main menu.
         """
+        self.lines = asyncio.Queue()
+        threading.Thread(target=self.read_lines, args=(asyncio.get_running_loop(),), daemon=True).start()
+        logging.debug(f" Trying to connect to {self.host} : {self.port}...")
+        await self.chat.connect()
+        logging.info(f" Successfully connected to {self.host} : {self.port}")
+        for header, handler in self.build_handlers().items():
+            self.chat.on(header, handler)
         try:
-            while True:
-                user_input = input("What would you like to do? Type '1' for login or 2 for 'register': ")
-                if user_input.lower() == utility.LoginCommands.LOGIN.value:
-                    self.client_login()
-                    break
-                elif user_input.lower() == utility.LoginCommands.REGISTER.value:
-                    self.client_register()
-                    break
-                else:
-                    logging.error("Incorrect entry. Please try again...")
-        except socket.error as e:
-            logging.error(e)
+            if await self.welcome_menu():
+                self.menu_print()
+                await self.main_menu()
+        finally:
+            await self.chat.close()
 
-    def recv_json(self):
+    def read_lines(self, loop):
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(self.lines.put_nowait, line.rstrip("\n"))
+        loop.call_soon_threadsafe(self.lines.put_nowait, None)
+
+    async def prompt(self, text=""):
         """
-        Method receives 'message' from the server and loads message json as 'data'.
-        Runs separate functions depending on the header of the json data.
-        Method run in a while true loop, so it constantly receives new data from server.
+        Prints a prompt and waits for the next typed line. Lines typed while it is the user's turn are played
+        as their move first.
+
+        :return: The line typed, without its newline.
         """
+        print(text, end="", flush=True)
         while True:
-            try:
-                message = self.recv_message(self.client_socket)
-                data = json.loads(message)
-                if data["header"] == utility.Responses.BROADCAST_MSG.value:
-                    print(f"{data['addressee']} {':'} {data['body']}")
-                    continue
-                elif data["header"] == utility.LoggedInCommands.DIRECT_MESSAGE.value:
-                    self.direct_messages(data)
-                    continue
-                elif data["header"] == utility.Responses.DM_ERROR.value:
-                    print(data["body"])
-                    self.main_menu(data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.PRINT_DM.value:
-                    print(data["addressee"], data["body"])
-                    continue
-                elif data["header"] == utility.Responses.PRINT_FRIEND_REQUESTS.value:
-                    print(data["body"])
-                    self.main_menu(data)
-                    continue
-                elif data["header"] == utility.Responses.PRINT_FRIENDS_LIST.value:
-                    print(data["body"])
-                    continue
-                elif data["header"] == utility.Responses.PRINT_STATUS_AWAY.value:
-                    print(data["body"])
-                    continue
-                elif data["header"] == utility.Responses.PRINT_TTT_REQUESTS.value:
-                    ttt_request_list = "\n".join([x[0] for x in data["body"]])
-                    logging.info(f"You have Tic Tac Toe requests from: \n{ttt_request_list}")
-                    self.tic_tac_toe_invite_response(data)
-                    continue
-                elif data["header"] == utility.Responses.ONLINE_NOTIFICATION.value:
-                    logging.info(f'{data["addressee"]} {"is ONLINE!"}')
-                    continue
-                elif data["header"] == utility.Responses.PLAY_TIC_TAC_TOE.value:
-                    self.play_tic_tac_toe(data)
-                    continue
-                elif data["header"] == utility.Responses.TIC_TAC_TOE_ERROR.value:
-                    self.tic_tac_toe_error(data)
-                    continue
-                elif data["header"] == utility.Responses.TIC_TAC_TOE_REQUEST.value:
-                    logging.info(f'{data["body"]} would like to play TIC TAC TOE!')
-                    continue
-                elif data["header"] == utility.Responses.TIC_TAC_TOE_WINNER.value:
-                    logging.info(data["extra_info"][3])
-                    self.main_menu(data)
-                    continue
-                elif data["header"] == utility.Responses.TIC_TAC_TOE_TIE.value:
-                    logging.info(data["extra_info"][3])
-                    self.main_menu(data)
-                    continue
-                elif data["header"] == utility.Responses.SUCCESS.value:
-                    logging.info(data["body"])
-                    continue
-                elif data["header"] == utility.Responses.ERROR.value:
-                    logging.error(data["body"])
-                    continue
-                elif data["header"] == utility.LoggedInCommands.QUIT.value:
-                    sys.exit()
-            except socket.error as e:
-                logging.error(e)
-                self.client_socket.close()
-                break
+            line = await self.lines.get()
+            if line is None:
+                raise EOFError("Input closed")
+            if self.turn is None:
+                return line
+            await self.play_move(line)
 
-    @staticmethod
-    def recv_message(client_socket):
+    async def welcome_menu(self):
         """
-        Receives messages from client sockets (2048 bytes of data). Decodes using 'UTF-8'.
+        Method runs once connected. Asks the users whether they want to login or register, until they have
+        logged in.
+
+        :return: True once logged in.
         """
-        return client_socket.recv(BUFFER_SIZE).decode(ENCODE)
+        while True:
+            user_input = await self.prompt("What would you like to do? Type '1' for login or 2 for 'register': ")
+            if user_input.lower() == str(utility.LoginCommands.LOGIN.value):
+                if await self.client_login():
+                    return True
+            elif user_input.lower() == str(utility.LoginCommands.REGISTER.value):
+                if await self.client_register():
+                    return True
+            else:
+                logging.error("Incorrect entry. Please try again...")
 
-    @staticmethod
-    def build_message(header, addressee, body, extra_info):
+    def build_handlers(self):
         """
-       Static method takes in arguments and assigns them to a dictionary that it returns.
+        Builds the table of push handlers registered with the chat client, mapping each header opcode the
+        server pushes to the method run for it. Every handler takes the decoded message data.
 
-       :param header: Variable to store header enum.
-       :param addressee: Variable to store usernames.
-       :param body: Variable to store messages.
-       :param extra_info: Variable to store an extra info required.
-       """
-        x = {"header": header,
-             "addressee": addressee,
-             "body": body,
-             "extra_info": extra_info}
-        return x
+        :return: Dictionary of handler methods keyed by utility header enums.
+        """
+        return {
+            utility.Responses.BROADCAST_MSG: self.print_broadcast,
+            utility.LoggedInCommands.PRINT_DM: self.print_direct_message,
+            utility.Responses.DM_ERROR: self.print_body,
+            utility.Responses.PRESENCE_NOTIFICATION: self.print_presence_notification,
+            utility.Responses.PLAY_TIC_TAC_TOE: self.print_turn,
+            utility.Responses.TIC_TAC_TOE_ERROR: self.print_turn_error,
+            utility.Responses.TIC_TAC_TOE_REQUEST: self.print_ttt_request,
+            utility.Responses.TIC_TAC_TOE_WINNER: self.print_game_over,
+            utility.Responses.TIC_TAC_TOE_TIE: self.print_game_over,
+            utility.Responses.SUCCESS: self.log_success,
+            utility.Responses.ERROR: self.log_error,
+            utility.Responses.INBOX: self.print_inbox,
+            utility.Responses.ROOM_MSG: self.print_room_message,
+        }
 
-    def client_send(self, msg_to_send):
+    def build_menu(self):
         """
-        Method takes the message dictionary and dumps into json message packet.
-        Json message packet is sent to the client.
+        :return: Dictionary of the coroutine run for each main menu command, keyed by utility header enums.
+        """
+        return {
+            utility.LoggedInCommands.BROADCAST: self.broadcast_messages,
+            utility.LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE: self.direct_messages,
+            utility.LoggedInCommands.ADD_FRIEND: self.add_friend,
+            utility.LoggedInCommands.VIEW_FRIEND_REQUESTS: self.view_friend_requests,
+            utility.LoggedInCommands.VIEW_FRIENDS: self.view_friends,
+            utility.LoggedInCommands.AUTH_TIC_TAC_TOE: self.send_tic_tac_toe_request,
+            utility.LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS: self.tic_tac_toe_invite_response,
+            utility.LoggedInCommands.SET_STATUS_AWAY: self.set_status_away,
+            utility.LoggedInCommands.HELP: self.help,
+            utility.LoggedInCommands.CREATE_ROOM: self.create_room,
+            utility.LoggedInCommands.JOIN_ROOM: self.room_messages,
+            utility.LoggedInCommands.LEAVE_ROOM: self.leave_room,
+            utility.LoggedInCommands.LIST_ROOMS: self.list_rooms,
+        }
+
+    @staticmethod
+    def print_broadcast(data):
+        print(f"{data['addressee']} {':'} {data['body']}")
+
+    @staticmethod
+    def print_direct_message(data):
+        print(data["addressee"], data["body"])
+
+    @staticmethod
+    def print_body(data):
+        print(data["body"])
 
-        :param client_socket: Socket of connected client.
-        :param msg_to_send: Parameter for (build_message) dictionary to be sent.
+    @staticmethod
+    def print_presence_notification(data):
+        logging.info(f'{data["addressee"]} is {data["body"]}!')
+
+    @staticmethod
+    def print_ttt_request(data):
+        logging.info(f'{data["body"]} would like to play TIC TAC TOE!')
+
+    def print_turn(self, data):
         """
-        try:
-            msg_packet = json.dumps(msg_to_send)
-            self.client_socket.send(msg_packet.encode(ENCODE))
-        except socket.error as e:
-            logging.error(e)
+        Shows the board sent by the server and asks for a move; the next line typed is sent as the move.
+        """
+        help_board, board, turn, game_id = data["extra_info"]
+        print(f"{help_board}\n"
+              f"{ttt_game.get_board(board)}\n")
+        print(f"It's your turn {turn}. Move to which place?: ")
+        self.turn = data
+
+    def print_turn_error(self, data):
+        print("Please choose another: ")
+        self.turn = data
+
+    def print_game_over(self, data):
+        self.turn = None
+        print(f"{ttt_game.get_board(data['extra_info'][1])}\n")
+        logging.info(data["extra_info"][3])
 
-    def client_login(self):
+    @staticmethod
+    def print_room_message(data):
+        print(f"[{data['addressee']}] {data['extra_info']} : {data['body']}")
+
+    @staticmethod
+    def print_inbox(data):
+        for sender, message, created_at in data["body"]:
+            print(f"{sender} (while you were offline): {message}")
+
+    @staticmethod
+    def log_success(data):
+        logging.info(data["body"])
+
+    @staticmethod
+    def log_error(data):
+        logging.error(data["body"])
+
+    async def client_login(self):
         """
-        Asks user for their username and password to be sent to server along with LOGIN header, for login validation.
+        Asks user for their username and password to be sent to server for login validation. The chat client
+        offers the binary codec, falling back to json.
+
+        :return: True if logged in.
         """
-        uname = input("Enter username: ")
-        pw = input("Enter password: ")
-        msg_input = self.build_message(utility.LoginCommands.LOGIN.value, uname, pw, None)
-        self.client_send(msg_input)
-        while True:
-            message = self.recv_message(self.client_socket)
-            data = json.loads(message)
-            if data["header"] == utility.LoginCommands.LOGGED_IN.value:
-                recv_json_thread = threading.Thread(target=self.recv_json)
-                recv_json_thread.start()
-                self.menu_print()
-                self.main_menu(data)
-                break
-            elif data["header"] == utility.LoginCommands.LOGIN.value:
-                print(data["body"])
-                self.welcome_menu()
-                break
+        uname = await self.prompt("Enter username: ")
+        pw = await self.prompt("Enter password: ")
+        try:
+            await self.chat.login(uname, pw)
+            return True
+        except chat_client.ChatError as e:
+            print(e)
+            return False
 
-    def client_register(self):
+    async def client_register(self):
         """
-        Asks user for new username and password. Ensures both password entries match. Sends username and password
-        inputs to server along with REGISTER header.
+        Asks user for new username and password. Ensures both password entries match, registers the account and
+        logs in with it.
+
+        :return: True if registered and logged in.
         """
-        uname = input("Enter new username: ")
-        pw = input("Enter new password: ")
-        pw2 = input("Re-enter password: ")
+        uname = await self.prompt("Enter new username: ")
+        pw = await self.prompt("Enter new password: ")
+        pw2 = await self.prompt("Re-enter password: ")
         if pw != pw2:
             logging.error("Passwords do not match. Please try again...")
-        else:
-            msg_input = self.build_message(utility.LoginCommands.REGISTER.value, uname, pw, None)
-            self.client_send(msg_input)
-            while True:
-                message = self.recv_message(self.client_socket)
-                data = json.loads(message)
-                if data["header"] == utility.LoginCommands.REGISTERED.value:
-                    self.client_login()
-                    break
-                elif data["header"] == utility.LoginCommands.REGISTER.value:
-                    print(data["body"])
-                    self.welcome_menu()
-                    break
+            return False
+        try:
+            await self.chat.register(uname, pw)
+        except chat_client.ChatError as e:
+            print(e)
+            return False
+        return await self.client_login()
 
     @staticmethod
     def menu_print():
-        print(f"Please select an option from the menu: \n"
-              f"'broadcast' : Broadcast \n"
-              f"'dm': Direct Message \n"
-              f"'af': Add Friend \n"
-              f"'fr': View Friend Requests \n"
-              f"'vf': View Friends \n"
-              f"'ttt': Tic Tac Toe Invite \n"
-              f"'vttt': Tic Tac Toe Requests\n"
-              f"'ssa' : Set Status Away \n"
-              f"'help': Help \n"
-              f"'quit' : Quit \n")
+        print("Please select an option from the menu: \n" +
+              "".join(f"'{selection}': {description} \n" for selection, description, command in utility.MENU))
 
-    def main_menu(self, data):
+    async def main_menu(self):
+        """
+        Function runs once logged in. Reads menu selections and runs the command chosen, until the user quits.
+        Requests the server refuses are reported and the menu carries on.
         """
-        Function runs once server has authenticated and logged in client. Menu displays a list of options that the
-        client can enter and runs separate functions accordingly.
+        while True:
+            user_input = utility.MENU_OPTIONS.get(await self.prompt())
+            if user_input == utility.LoggedInCommands.QUIT:
+                return
+            command = self.menu.get(user_input)
+            if command is None:
+                logging.error("Invalid selection- Please try again...")
+                continue
+            try:
+                await command()
+            except chat_client.ChatError as e:
+                logging.error(e)
 
-        :param data: Client username (str).
+    async def broadcast_messages(self):
         """
-        try:
-            while True:
-                user_input = input()
-                if user_input == utility.LoggedInCommands.BROADCAST.value:
-                    self.broadcast_messages(data)
-                    break
-                elif user_input == utility.LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE.value:
-                    recipient = input("Who would you like to send a DM to?:\n")
-                    self.dm_recipient(data, recipient)
-                    break
-                elif user_input == utility.LoggedInCommands.ADD_FRIEND.value:
-                    recipient = input("Type the username of the friend to add:\n")
-                    self.add_friend(data, recipient)
-                    break
-                elif user_input == utility.LoggedInCommands.VIEW_FRIEND_REQUESTS.value:
-                    msg_input = self.build_message(utility.LoggedInCommands.VIEW_FRIEND_REQUESTS.value,
-                                                   data["addressee"], None, None)
-                    self.client_send(msg_input)
-                    break
-                elif user_input == utility.LoggedInCommands.VIEW_FRIENDS.value:
-                    msg_input = self.build_message(utility.LoggedInCommands.VIEW_FRIENDS.value, data["addressee"],
-                                                   None, None)
-                    self.client_send(msg_input)
-                    break
-                elif user_input == utility.LoggedInCommands.AUTH_TIC_TAC_TOE.value:
-                    self.send_tic_tac_toe_request(data)
-                    break
-                elif user_input == utility.LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS.value:
-                    msg_input = self.build_message(utility.LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS.value,
-                                                   data["addressee"], None, None)
-                    self.client_send(msg_input)
-                    break
-                elif user_input == utility.LoggedInCommands.SET_STATUS_AWAY.value:
-                    msg_input = self.build_message(utility.LoggedInCommands.SET_STATUS_AWAY.value,
-                                                   data["addressee"],
-                                                   "AWAY", None)
-                    self.client_send(msg_input)
-                    break
-                elif user_input == utility.LoggedInCommands.HELP.value:
-                    msg_input = self.build_message(utility.LoggedInCommands.HELP.value, None, None, None)
-                    self.client_send(msg_input)
-                    break
-                elif user_input == utility.LoggedInCommands.QUIT.value:
-                    msg_input = self.build_message(utility.LoggedInCommands.QUIT.value, data["addressee"],
-                                                   None, "OFFLINE")
-                    self.client_send(msg_input)
-                    break
-                else:
-                    logging.error("Invalid selection- Please try again...")
-        except socket.error as e:
-            logging.error(e)
+        Function runs when client requests to broadcast multiple messages to all connected clients. Every line
+        the user enters is broadcast, until they type in 'QUIT'.
+        """
+        while True:
+            msg_body = await self.prompt(">")
+            if msg_body == "QUIT":
+                return
+            await self.chat.broadcast(msg_body)
 
-    def broadcast_messages(self, data):
+    async def direct_messages(self):
         """
-        Function runs when client requests to broadcast multiple messages to all connected clients. The user
-        enters a while true loop that constantly allows user input and sends every client message to the server
-        with the header "BROADCAST". The user exits the loop if and when they type in 'QUIT'.
-        :param data: Client username.
+        Function runs when client requests to direct message a specific user. The server checks that the user
+        exists and sends the latest page of previous messages, newest first, which is printed in timeline order.
+        Every line the user enters is then sent to the recipient until they input 'QUIT', or they type '/more'
+        to page further back through the conversation.
         """
+        recipient = await self.prompt("Who would you like to send a DM to?:\n")
+        previous_messages = await self.chat.open_dm(recipient)
+        self.print_history(previous_messages)
+        before_id = previous_messages[-1][0] if previous_messages else None
         while True:
-            try:
-                msg_body = input(">")
-                msg_input = self.build_message(utility.LoggedInCommands.BROADCAST.value, data["addressee"],
-                                               msg_body, None)
-                if msg_body == "QUIT":
-                    self.main_menu(data)
-                    break
+            msg_body = await self.prompt(">")
+            if msg_body == 'QUIT':
+                return
+            elif msg_body == '/more':
+                if before_id is None:
+                    print("No older messages.")
                 else:
-                    self.client_send(msg_input)
-                    continue
-            except socket.error as e:
-                logging.error(e)
+                    page, before_id = await self.chat.history(recipient, before_id)
+                    self.print_history(page)
+            else:
+                await self.chat.send_dm(recipient, msg_body)
 
-    def dm_recipient(self, data, recipient):
+    @staticmethod
+    def print_history(page):
         """
-        Function runs when client requests to direct message a specific user and enter a private chat room with
-        the requested individual. The function sends the header 'AUTHENTICATE_DIRECT_MESSAGE' to the server as
-        a pre-check to ensure that the user exists, the two users are friends and other checks take place.
-        :param data: client username
-        :param recipient: recipient username
+        Prints a page of conversation history, received newest first, in timeline order.
+        :param page: List of [message_id, sender, message, created_at] lists.
         """
-        requester = data["addressee"]
-        try:
-            msg_input = self.build_message(utility.LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE.value, recipient,
-                                           requester, None)
-            self.client_send(msg_input)
-        except socket.error as e:
-            logging.error(e)
+        for message_id, sender, message, created_at in reversed(page or []):
+            print(f"{sender}: {message}")
 
-    def direct_messages(self, data):
-        """
-        Function runs once the server has authenticated the request to direct message. A list of previous messages
-        (held in data parameter) has already been fetched by the server. The list is reversed to correct timeline order
-        and printed. The client then enters a while true loop, enabling them to constantly direct message the recipient
-        until the client inputs 'QUIT'. The messages are sent back to the server with the header 'DIRECT_MESSAGE' along
-        with the recipient to be distributed.
-        :param data: requester username, list of previous messages exchanged between clients.
-        """
-        requester = data["body"]
-        previous_messages = data["extra_info"]
-        if previous_messages:
-            previous_messages.reverse()
-            for i in previous_messages:
-                print(i)
-        while True:
-            try:
-                msg_body = input(">")
-                msg_input = self.build_message(utility.LoggedInCommands.DIRECT_MESSAGE.value, data["addressee"],
-                                               msg_body, requester)
-                if msg_body == 'QUIT':
-                    self.main_menu(data)
-                    break
-                else:
-                    self.client_send(msg_input)
-                    continue
-            except socket.error as e:
-                logging.error(e)
+    async def create_room(self):
+        name = await self.prompt("Name of the room to create:\n")
+        await self.chat.create_room(name)
+        logging.info(f"Room {name} created")
 
-    def add_friend(self, data, recipient):
+    async def room_messages(self):
         """
-        Function runs when the client requests to add a user as a friend. The function send a message to the server
-        with the header 'ADD_FRIEND' and the recipients' username to be processed by the server.
-        :param data: Client username.
-        :param recipient: Recipient username.
+        Function runs when the user joins a room. The room's recent posts are printed, then every line the user
+        enters is posted to the room until they type 'QUIT'. They stay a member of the room afterwards.
         """
-        msg_input = self.build_message(utility.LoggedInCommands.ADD_FRIEND.value, data["addressee"],
-                                       recipient, None)
-        self.client_send(msg_input)
-        self.main_menu(data)
+        name = await self.prompt("Which room would you like to join?:\n")
+        for sender, message, created_at in await self.chat.join_room(name):
+            print(f"[{name}] {sender} : {message}")
+        while True:
+            msg_body = await self.prompt(">")
+            if msg_body == "QUIT":
+                return
+            await self.chat.post(name, msg_body)
+
+    async def leave_room(self):
+        name = await self.prompt("Which room would you like to leave?:\n")
+        await self.chat.leave_room(name)
+        logging.info(f"Left room {name}")
+
+    async def list_rooms(self):
+        for name, members, joined in await self.chat.rooms():
+            print(f"{name} : {members} members{' (joined)' if joined else ''}")
+
+    async def add_friend(self):
+        recipient = await self.prompt("Type the username of the friend to add:\n")
+        logging.info(await self.chat.add_friend(recipient))
+
+    async def view_friend_requests(self):
+        print("\n".join(await self.chat.friend_requests()))
+
+    async def view_friends(self):
+        print("\n".join(f"{username} : {status}" for username, status in await self.chat.friends()))
+
+    async def set_status_away(self):
+        print(await self.chat.set_status("AWAY"))
 
-    def send_tic_tac_toe_request(self, data):
-        requester = data["addressee"]
-        recipient = input("Who would you like to play with?:\n")
+    async def help(self):
+        self.menu_print()
+
+    async def send_tic_tac_toe_request(self):
+        recipient = await self.prompt("Who would you like to play with?:\n")
         logging.info(f'Request sent to {recipient} - Waiting for response...')
-        msg_input = self.build_message(utility.LoggedInCommands.AUTH_TIC_TAC_TOE.value, requester,
-                                       recipient, None)
-        self.client_send(msg_input)
-
-    def tic_tac_toe_invite_response(self, data):
-        requester = data["addressee"]
-        time.sleep(1)
-        for user in data["body"]:
-            response = input(f"Would you like to play ttt with {user[0]}?: ")
+        await self.chat.invite(recipient)
+
+    async def tic_tac_toe_invite_response(self):
+        """
+        Lists the tic tac toe invites received and asks about each in turn, until one is accepted.
+        """
+        invites = await self.chat.game_invites()
+        ttt_request_list = "\n".join([username for username, game_id in invites])
+        logging.info(f"You have Tic Tac Toe requests from: \n{ttt_request_list}")
+        for username, game_id in invites:
+            response = await self.prompt(f"Would you like to play ttt with {username}?: ")
             if response == 'yes':
-                msg_input = self.build_message(utility.Responses.TIC_TAC_TOE_CONFIRM.value,
-                                               requester, user[0], None)
-                self.client_send(msg_input)
-                logging.info(f"Response 'CONFIRM' sent to {user[0]}. They will go first...")
-                break
-            else:
-                msg_input = self.build_message(utility.Responses.TIC_TAC_TOE_DENY.value,
-                                               requester, user[0], None)
-                self.client_send(msg_input)
-            break
-
-    def play_tic_tac_toe(self, data):
-        requester = data["body"]
-        recipient = data["addressee"]
-        turn = data['extra_info'][2]
-        turn_dict = data['extra_info'][3]
-        board = data['extra_info'][1]
-        print(f"{data['extra_info'][0]}\n"
-              f"{ttt_game.get_board(board)}\n")
-        move = input(f"It's your turn {turn}. Move to which place?: \n")
-        msg_input = self.build_message(utility.Responses.PLAY_TIC_TAC_TOE.value,
-                                       requester, recipient, [board, turn, move, turn_dict])
-        self.client_send(msg_input)
-
-    def tic_tac_toe_error(self, data):
-        requester = data["body"]
-        recipient = data["addressee"]
-        turn_dict = data['extra_info'][3]
-        turn = turn_dict[recipient]
-        board = data['extra_info'][1]
-        move = input("Please choose another: ")
-        msg_input = self.build_message(utility.Responses.TIC_TAC_TOE_ERROR.value,
-                                       requester, recipient, [board, turn, move, turn_dict])
-        self.client_send(msg_input)
+                await self.chat.accept_game(username, game_id)
+                logging.info(f"Response 'CONFIRM' sent to {username}. They will go first...")
+                return
+            await self.chat.deny_game(username, game_id)
+
+    async def play_move(self, move):
+        """
+        Sends the square chosen for the game whose turn was last shown, with the game id. The server holds the
+        game and checks the move.
+        """
+        data, self.turn = self.turn, None
+        await self.chat.move(data["extra_info"][3], move, data["body"])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,308 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import async_server
+import codec
+import connection
+import protocol
+import server
+
+BUS_CONNECT_ATTEMPTS = 50
+BUS_CONNECT_INTERVAL = 0.1
+
+
+def send_envelope(bus_socket, lock, envelope):
+    """
+    Sends a bus envelope dictionary as a single json frame. The lock serialises writers sharing the socket.
+    """
+    frame = protocol.encode_frame(json.dumps(envelope).encode(server.ENCODE))
+    with lock:
+        bus_socket.sendall(frame)
+
+
+def recv_envelopes(bus_socket):
+    """
+    Yields bus envelope dictionaries received on the socket until it is closed.
+    """
+    decoder = protocol.FrameDecoder()
+    while True:
+        data = bus_socket.recv(server.BUFFER_SIZE)
+        if not data:
+            return
+        decoder.feed(data)
+        for frame in decoder.frames():
+            yield json.loads(frame)
+
+
+class MessageHub:
+    """
+    Runs in the launcher process and relays envelopes between worker processes over a Unix socket. Envelopes
+    with a 'target' worker id go only to that worker; all others go to every worker except the sender.
+    Attributes:
+        path (str): Filesystem path of the hub's Unix socket.
+        workers (dict): Connected worker sockets keyed by worker id.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.workers = {}
+        self.locks = {}
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen()
+
+    def start(self):
+        threading.Thread(target=self.accept_workers, daemon=True).start()
+
+    def accept_workers(self):
+        while True:
+            worker_socket, _ = self.listener.accept()
+            threading.Thread(target=self.relay, args=(worker_socket,), daemon=True).start()
+
+    def relay(self, worker_socket):
+        """
+        Reads envelopes from one worker and forwards them. The first envelope must be the worker's 'hello';
+        other workers are then asked to announce their users so the new worker learns the cluster presence.
+        """
+        worker = None
+        try:
+            for envelope in recv_envelopes(worker_socket):
+                if envelope["type"] == "hello":
+                    worker = envelope["worker"]
+                    self.workers[worker] = worker_socket
+                    self.locks[worker] = threading.Lock()
+                    logging.info(f" Worker {worker} joined the message bus")
+                    self.forward(worker, {"type": "announce"})
+                elif "target" in envelope:
+                    self.send(envelope["target"], envelope)
+                else:
+                    self.forward(worker, envelope)
+        except socket.error as e:
+            logging.error(e)
+        finally:
+            self.workers.pop(worker, None)
+            worker_socket.close()
+
+    def forward(self, sender, envelope):
+        for worker in list(self.workers):
+            if worker != sender:
+                self.send(worker, envelope)
+
+    def send(self, worker, envelope):
+        try:
+            send_envelope(self.workers[worker], self.locks[worker], envelope)
+        except (KeyError, socket.error) as e:
+            logging.error(f" Could not reach worker {worker}: {e}")
+
+
+class MessageBus:
+    """
+    A worker's connection to the hub. Publishes this worker's presence changes, broadcasts and deliveries to
+    users on other workers, and applies the envelopes other workers publish to the local Server, keeping
+    server.clients a cluster-wide presence view in which remote users are RemoteConnection entries. The worker
+    only joins the bus once started, which the server does when its database and rooms are open.
+    Attributes:
+        server (Server): The worker's server instance.
+        worker (int): Id of this worker.
+        socket (socket): Unix socket connected to the hub.
+    """
+
+    def __init__(self, chat_server, path, worker):
+        self.server = chat_server
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        for attempt in range(BUS_CONNECT_ATTEMPTS):
+            try:
+                self.socket.connect(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                time.sleep(BUS_CONNECT_INTERVAL)
+        else:
+            raise ConnectionError(f"Worker {worker} could not connect to the message bus at {path}")
+
+    def start(self):
+        """
+        Joins the bus and starts applying the envelopes other workers publish.
+        """
+        self.publish({"type": "hello", "worker": self.worker})
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def publish(self, envelope):
+        try:
+            send_envelope(self.socket, self.lock, envelope)
+        except socket.error as e:
+            logging.error(e)
+
+    def publish_presence(self, username, online):
+        self.publish({"type": "presence", "worker": self.worker, "username": username, "online": online})
+
+    def publish_friendship(self, requester, recipient, friendship_id):
+        """
+        Tells the other workers about a committed friend request, or with no friendship_id about an accepted one.
+        """
+        self.publish({"type": "friendship", "requester": requester, "recipient": recipient,
+                      "friendship_id": friendship_id})
+
+    def publish_game_move(self, message):
+        """
+        Forwards a tic tac toe move to the other workers; the worker holding the game plays it.
+        """
+        self.publish({"type": "game_move", "message": message})
+
+    def publish_room(self, event, name, username, room_id=None):
+        """
+        Tells the other workers a room was created ('create', with its room_id), joined ('join') or left
+        ('leave'), so their room registries stay current.
+        """
+        self.publish({"type": "room", "event": event, "name": name, "username": username, "room_id": room_id})
+
+    def publish_room_post(self, name, sender, message, created_at):
+        """
+        Forwards a room post to the other workers, which deliver it to the room's members connected to them.
+        """
+        self.publish({"type": "room_post", "name": name, "sender": sender, "message": message,
+                      "created_at": created_at})
+
+    def publish_broadcast(self, message):
+        self.publish({"type": "broadcast", "message": message})
+
+    def publish_delivery(self, worker, username, frame):
+        """
+        Forwards a json frame addressed to a user connected to another worker.
+        """
+        message = codec.JSON.decode(frame[protocol.HEADER.size:])
+        self.publish({"type": "deliver", "target": worker, "username": username, "message": message})
+
+    def listen(self):
+        """
+        Bus thread. Applies envelopes published by other workers until the hub goes away. An envelope that fails
+        to apply is logged and skipped, so the worker stays in the cluster.
+        """
+        try:
+            for envelope in recv_envelopes(self.socket):
+                try:
+                    self.apply(envelope)
+                except Exception:
+                    logging.exception(f" Worker {self.worker} could not apply a bus envelope")
+        except socket.error as e:
+            logging.error(e)
+        logging.error(f" Worker {self.worker} lost the message bus")
+
+    def apply(self, envelope):
+        """
+        Applies one envelope published by another worker to the local Server.
+        """
+        if envelope["type"] == "deliver":
+            client_socket = self.server.clients.get(envelope["username"])
+            if client_socket is not None and not isinstance(client_socket, connection.RemoteConnection):
+                self.server.server_send(client_socket, envelope["message"])
+        elif envelope["type"] == "broadcast":
+            self.server.fan_out(envelope["message"])
+        elif envelope["type"] == "presence":
+            self.apply_presence(envelope)
+        elif envelope["type"] == "friendship":
+            self.apply_friendship(envelope)
+        elif envelope["type"] == "room":
+            self.apply_room(envelope)
+        elif envelope["type"] == "room_post":
+            self.server.deliver_room_post(envelope["name"], envelope["sender"], envelope["message"],
+                                          envelope["created_at"])
+        elif envelope["type"] == "game_move":
+            self.server.play_tic_tac_toe(None, envelope["message"])
+        elif envelope["type"] == "announce":
+            for username, client_socket in list(self.server.clients.items()):
+                if not isinstance(client_socket, connection.RemoteConnection):
+                    self.publish_presence(username, True)
+
+    def apply_presence(self, envelope):
+        username = envelope["username"]
+        current = self.server.clients.get(username)
+        if envelope["online"]:
+            self.server.clients[username] = connection.RemoteConnection(self, envelope["worker"], username)
+        elif isinstance(current, connection.RemoteConnection) and current.worker == envelope["worker"]:
+            del self.server.clients[username]
+            self.server.end_games(username)
+
+    def apply_friendship(self, envelope):
+        requester, recipient = envelope["requester"], envelope["recipient"]
+        if envelope["friendship_id"] is None:
+            self.server.db.record_friendship(requester, recipient)
+            self.server.presence.add_friendship(requester, recipient)
+        else:
+            self.server.db.record_friend_request(envelope["friendship_id"], requester, recipient)
+
+    def apply_room(self, envelope):
+        name, username = envelope["name"], envelope["username"]
+        if envelope["event"] == "create":
+            self.server.rooms.create(envelope["room_id"], name, username)
+        elif envelope["event"] == "join":
+            self.server.rooms.join(name, username)
+        else:
+            self.server.rooms.leave(name, username)
+
+
+def run_worker(engine, host, port, path, worker):
+    """
+    Entry point of a worker process: binds its own SO_REUSEPORT listening socket, connects to the message bus,
+    which the server joins once its resources are open, and serves clients with the chosen engine. SIGTERM,
+    which the supervisor stops workers with, exits through the engine's run, so its password pool and database
+    are closed rather than orphaned.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    chat_server = engine(host, port)
+    chat_server.reuse_port = True
+    chat_server.bus = MessageBus(chat_server, path, worker)
+    logging.info(f" Worker {worker} (pid {os.getpid()}) starting")
+    chat_server.run()
+
+
+def run_cluster(host: str, port: int, workers: int = os.cpu_count(), engine=async_server.AsyncServer):
+    """
+    Starts the message hub and forks worker processes that share the listening port via SO_REUSEPORT, so the
+    kernel spreads incoming connections across cores. Restarts nothing; returns when every worker has exited.
+    Workers are not daemon processes, since each starts its own bcrypt process pool, so any still running when
+    the supervisor stops (on KeyboardInterrupt or SIGTERM) are terminated and joined here.
+
+    :param host: IP address to listen on.
+    :param port: Port shared by every worker.
+    :param workers: Number of worker processes.
+    :param engine: Server class each worker runs, server.Server or async_server.AsyncServer.
+    """
+    directory = tempfile.mkdtemp(prefix="tcpchat-")
+    path = os.path.join(directory, "bus.sock")
+    hub = MessageHub(path)
+    hub.start()
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=run_worker, args=(engine, host, port, path, worker))
+                 for worker in range(workers)]
+    try:
+        for process in processes:
+            process.start()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            if process.pid is not None:
+                process.join()
+        os.unlink(path)
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    """
+    Runs a cluster with one worker per core on the default host and port.
+    """
+    run_cluster('0.0.0.0', 5555)
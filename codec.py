@@ -0,0 +1,254 @@
+import json
+import struct
+
+import protocol
+import ttt_game
+
+ENCODE = "utf-8"
+MESSAGE_KEYS = ("header", "addressee", "body", "extra_info")
+MAX_DEPTH = 32
+
+NONE = 0
+STR = 1
+INT = 2
+FLOAT = 3
+TRUE = 4
+FALSE = 5
+LIST = 6
+DICT = 7
+BOARD = 8
+HELP_BOARD = 9
+
+INT_FORMAT = struct.Struct("!q")
+FLOAT_FORMAT = struct.Struct("!d")
+HELP_BOARD_TEXT = ttt_game.get_help_board()
+BOARD_SQUARES = [str(square) for square in range(1, 10)]
+SQUARE_CODES = {' ': 0, 'X': 1, 'O': 2}
+SQUARE_VALUES = {code: value for value, code in SQUARE_CODES.items()}
+BOARD_SHIFTS = [(square, 2 * (9 - int(square))) for square in ttt_game.return_new_board()]
+
+
+class JsonCodec:
+    """
+    The original message encoding: the four key message dictionary, plus the optional request_id, dumped as
+    utf-8 json. Decoding checks the payload is such a dictionary with an integer (or null) header, so the
+    server's dispatch can rely on its shape. Payloads nested too deeply for the json parser are malformed too.
+    """
+    name = "json"
+
+    @staticmethod
+    def encode(msg_to_send):
+        return json.dumps(msg_to_send).encode(ENCODE)
+
+    @staticmethod
+    def decode(payload):
+        try:
+            message = json.loads(payload)
+        except (ValueError, RecursionError) as e:
+            raise protocol.ProtocolError(f"Malformed json message: {e}")
+        if not isinstance(message, dict) or any(key not in message for key in MESSAGE_KEYS):
+            raise protocol.ProtocolError("Malformed json message: not a message dictionary")
+        header = message["header"]
+        if header is not None and (not isinstance(header, int) or isinstance(header, bool)):
+            raise protocol.ProtocolError(f"Malformed json message: header {header!r} is not an opcode")
+        return message
+
+
+class BinaryCodec:
+    """
+    Compact message encoding. The header is a single opcode byte, followed by addressee, body and extra_info
+    as tagged values: strings, lists and dictionaries are length-prefixed with a varint, a tic tac toe board is
+    packed into three bytes and the constant help board text is a single tag byte. A message carrying a
+    request_id has it appended as a fifth tagged value; decoders that predate it stop after extra_info.
+    Decoding refuses lists and dictionaries nested more than MAX_DEPTH deep and dictionary keys that are not
+    strings, as json would.
+    """
+    name = "binary"
+
+    @staticmethod
+    def encode(msg_to_send):
+        out = bytearray()
+        header = msg_to_send["header"]
+        out.append(0 if header is None else header)
+        encode_value(out, msg_to_send["addressee"])
+        encode_value(out, msg_to_send["body"])
+        encode_value(out, msg_to_send["extra_info"])
+        request_id = msg_to_send.get("request_id")
+        if request_id is not None:
+            encode_value(out, request_id)
+        return bytes(out)
+
+    @staticmethod
+    def decode(payload):
+        view = bytes(payload)
+        try:
+            header = view[0] or None
+            addressee, offset = decode_value(view, 1)
+            body, offset = decode_value(view, offset)
+            extra_info, offset = decode_value(view, offset)
+            request_id = decode_value(view, offset)[0] if offset < len(view) else None
+        except (IndexError, KeyError, TypeError, ValueError, RecursionError, struct.error) as e:
+            raise protocol.ProtocolError(f"Malformed binary message: {e}")
+        message = {"header": header,
+                   "addressee": addressee,
+                   "body": body,
+                   "extra_info": extra_info}
+        if request_id is not None:
+            message["request_id"] = request_id
+        return message
+
+
+JSON = JsonCodec()
+BINARY = BinaryCodec()
+CODECS = {JSON.name: JSON, BINARY.name: BINARY}
+
+
+def decode(payload):
+    """
+    Decodes a message payload in either encoding. Json payloads always start with '{' and binary payloads with
+    an opcode byte, which is never that character, so a message queued just before the codec switch at login
+    is still decoded correctly.
+
+    :param payload: Frame payload bytes.
+    :return: The message dictionary.
+    """
+    if payload[:1] == b"{":
+        return JSON.decode(payload)
+    return BINARY.decode(payload)
+
+
+def negotiate(offered):
+    """
+    Picks the codec used for a connection after login, from the names the client offered in preference order.
+    Clients that offer nothing keep json.
+
+    :param offered: extra_info of the LOGIN message, e.g. {"codecs": ["binary", "json"]}.
+    :return: The chosen codec instance.
+    """
+    if isinstance(offered, dict):
+        for name in offered.get("codecs") or ():
+            if name in CODECS:
+                return CODECS[name]
+    return JSON
+
+
+def encode_varint(out, number):
+    while number >= 0x80:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def decode_varint(view, offset):
+    number = 0
+    shift = 0
+    while True:
+        byte = view[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def is_board(value):
+    return len(value) == 9 and all(value.get(square) in SQUARE_CODES for square in BOARD_SQUARES)
+
+
+def encode_value(out, value):
+    """
+    Appends the tagged binary encoding of a json compatible value to out.
+    """
+    if value is None:
+        out.append(NONE)
+    elif isinstance(value, str):
+        if value == HELP_BOARD_TEXT:
+            out.append(HELP_BOARD)
+            return
+        encoded = value.encode(ENCODE)
+        out.append(STR)
+        encode_varint(out, len(encoded))
+        out += encoded
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        out.append(INT)
+        out += INT_FORMAT.pack(value)
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += FLOAT_FORMAT.pack(value)
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST)
+        encode_varint(out, len(value))
+        for item in value:
+            encode_value(out, item)
+    elif isinstance(value, dict):
+        if is_board(value):
+            packed = 0
+            for square in BOARD_SQUARES:
+                packed = (packed << 2) | SQUARE_CODES[value[square]]
+            out.append(BOARD)
+            out += packed.to_bytes(3, "big")
+            return
+        out.append(DICT)
+        encode_varint(out, len(value))
+        for key, item in value.items():
+            encode_value(out, str(key))
+            encode_value(out, item)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} value")
+
+
+def decode_value(view, offset, depth=0):
+    """
+    Decodes one tagged value from the view bytes starting at offset.
+
+    :param depth: Number of lists and dictionaries the value is inside.
+    :return: Tuple of the decoded value and the offset of the next value.
+    :raises ValueError: If the value is malformed or nested more than MAX_DEPTH deep.
+    """
+    tag = view[offset]
+    offset += 1
+    if tag == NONE:
+        return None, offset
+    if tag == STR:
+        length, offset = decode_varint(view, offset)
+        if offset + length > len(view):
+            raise ValueError("Truncated string")
+        return view[offset:offset + length].decode(ENCODE), offset + length
+    if tag == INT:
+        return INT_FORMAT.unpack_from(view, offset)[0], offset + INT_FORMAT.size
+    if tag == FLOAT:
+        return FLOAT_FORMAT.unpack_from(view, offset)[0], offset + FLOAT_FORMAT.size
+    if tag == TRUE:
+        return True, offset
+    if tag == FALSE:
+        return False, offset
+    if tag in (LIST, DICT) and depth >= MAX_DEPTH:
+        raise ValueError(f"Value nested more than {MAX_DEPTH} deep")
+    if tag == LIST:
+        count, offset = decode_varint(view, offset)
+        items = []
+        for _ in range(count):
+            item, offset = decode_value(view, offset, depth + 1)
+            items.append(item)
+        return items, offset
+    if tag == DICT:
+        count, offset = decode_varint(view, offset)
+        items = {}
+        for _ in range(count):
+            key, offset = decode_value(view, offset, depth + 1)
+            if not isinstance(key, str):
+                raise ValueError(f"Dictionary key is {type(key).__name__}, not str")
+            items[key], offset = decode_value(view, offset, depth + 1)
+        return items, offset
+    if tag == BOARD:
+        if offset + 3 > len(view):
+            raise ValueError("Truncated board")
+        packed = int.from_bytes(view[offset:offset + 3], "big")
+        return {square: SQUARE_VALUES[(packed >> shift) & 0b11] for square, shift in BOARD_SHIFTS}, offset + 3
+    if tag == HELP_BOARD:
+        return HELP_BOARD_TEXT, offset
+    raise ValueError(f"Unknown value tag {tag}")
@@ -0,0 +1,115 @@
+import threading
+import zlib
+
+import metrics
+import protocol
+
+DEFLATE = "deflate"
+METHODS = (DEFLATE,)
+MARKER = 0xFF
+THRESHOLD = 256
+LEVEL = 6
+WINDOW_BITS = 13
+MEMORY_LEVEL = 6
+SYNC_TAIL = b"\x00\x00\xff\xff"
+
+
+class Deflater:
+    """
+    Compresses the frames sent on one connection with a single raw deflate stream, so strings repeated across
+    messages (usernames, keys, the tic tac toe help board) are sent as back references to earlier frames. Each
+    message is sync flushed, ending on a byte boundary with the empty block's four byte tail, which is left off
+    the wire. Payloads below the threshold are sent as they are and never enter the stream; compressed payloads
+    start with the MARKER byte, which is neither '{' nor a message opcode, so both kinds can be mixed freely.
+    Frames must be compressed in the order they are written, which the caller guarantees.
+    The window is 2 ** WINDOW_BITS bytes rather than zlib's 32KB, keeping the deflate state of a connection to
+    about 64KB.
+    Attributes:
+        threshold (int): Smallest payload, in bytes, that is compressed.
+        stream (Compress): The connection's deflate context.
+    """
+
+    def __init__(self, threshold: int = THRESHOLD, level: int = LEVEL):
+        self.threshold = threshold
+        self.stream = zlib.compressobj(level, zlib.DEFLATED, -WINDOW_BITS, MEMORY_LEVEL)
+        self.lock = threading.Lock()
+        self.bytes_in = metrics.counter("compression_bytes_in_total", "Payload bytes compressed.")
+        self.bytes_out = metrics.counter("compression_bytes_out_total", "Compressed payload bytes sent.")
+
+    def compress(self, payload):
+        """
+        :param payload: Encoded message bytes.
+        :return: The payload compressed and marked, or unchanged if it is below the threshold.
+        """
+        if len(payload) < self.threshold:
+            return payload
+        with self.lock:
+            compressed = self.stream.compress(payload) + self.stream.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_in.inc(len(payload))
+        self.bytes_out.inc(len(compressed) - len(SYNC_TAIL) + 1)
+        return bytes((MARKER,)) + compressed[:-len(SYNC_TAIL)]
+
+    def compress_frame(self, frame):
+        """
+        :param frame: Length-prefixed frame, as queued on a connection.
+        :return: The frame with its payload compressed, or the same frame if it is below the threshold.
+        """
+        if len(frame) - protocol.HEADER.size < self.threshold:
+            return frame
+        return protocol.encode_frame(self.compress(frame[protocol.HEADER.size:]))
+
+
+class Inflater:
+    """
+    Decompresses the marked payloads received on one connection, from the peer's single deflate stream.
+    Attributes:
+        stream (Decompress): The connection's inflate context.
+    """
+
+    def __init__(self):
+        self.stream = zlib.decompressobj(-WINDOW_BITS)
+
+    def decompress(self, payload):
+        """
+        :param payload: Frame payload, compressed or not.
+        :return: The payload decompressed if it is marked, else unchanged.
+        :raises ProtocolError: If the payload does not continue the deflate stream or inflates past the maximum
+            frame size.
+        """
+        if payload[:1] != bytes((MARKER,)):
+            return payload
+        try:
+            inflated = self.stream.decompress(payload[1:] + SYNC_TAIL, protocol.MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise protocol.ProtocolError(f"Malformed compressed message: {e}")
+        if self.stream.unconsumed_tail:
+            raise protocol.ProtocolError(f"Compressed message exceeds maximum of {protocol.MAX_FRAME_SIZE}")
+        return inflated
+
+
+def decompress(inflater, payload):
+    """
+    Decompresses a payload received on a connection that may not have negotiated compression.
+
+    :param inflater: The connection's Inflater, or None.
+    :return: The message payload.
+    :raises ProtocolError: If the payload is compressed but compression was not negotiated.
+    """
+    if inflater is not None:
+        return inflater.decompress(payload)
+    if payload[:1] == bytes((MARKER,)):
+        raise protocol.ProtocolError("Compressed message on a connection without compression")
+    return payload
+
+
+def negotiate(offered):
+    """
+    Picks the compression method for a connection from the names the client offered in preference order.
+
+    :param offered: List of method names, e.g. ["deflate"].
+    :return: The chosen method name, or None if none is supported.
+    """
+    for name in offered or ():
+        if name in METHODS:
+            return name
+    return None
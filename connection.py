@@ -0,0 +1,192 @@
+import logging
+import queue
+import socket
+import threading
+import time
+
+import codec
+import compression
+
+DROP = "drop"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP, DISCONNECT)
+OUTBOUND_QUEUE_SIZE = 256
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+
+def enable_keepalive(client_socket):
+    """
+    Turns on TCP keepalive for an accepted socket, so the kernel notices peers that vanished without closing the
+    connection after about KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT seconds of silence. Options the
+    platform lacks are skipped.
+
+    :param client_socket: Accepted socket, or the socket of an asyncio transport.
+    """
+    try:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                              ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+            if hasattr(socket, option):
+                client_socket.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+    except socket.error as e:
+        logging.error(e)
+
+
+class QueuedConnection:
+    """
+    Wraps an accepted client socket with a bounded outbound queue drained by its own writer thread, so handlers
+    (and broadcasts) only enqueue frames and never block on a slow client's socket. When the queue is full the
+    slow consumer policy either drops the frame or disconnects the client.
+    Attributes:
+        socket (socket): The accepted client socket.
+        queue (Queue): Encoded frames waiting to be written.
+        policy (str): Slow consumer policy, DROP or DISCONNECT.
+        dropped (int): Number of frames dropped because the queue was full.
+        closed (bool): True once the connection has been closed or aborted.
+        codec (JsonCodec | BinaryCodec): Message codec negotiated at login.
+        last_received (float): time.monotonic() when a frame was last received from the client.
+        pinged (bool): True if a PING has been sent since the last frame was received.
+        deflater (Deflater): Compresses frames as the writer thread sends them, from the point in the queue where
+            compression was negotiated, else None.
+        inflater (Inflater): Decompresses frames received from the client, once negotiated, else None.
+    """
+
+    def __init__(self, client_socket, max_queued: int = OUTBOUND_QUEUE_SIZE, policy: str = DROP):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.socket = client_socket
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self.codec = codec.JSON
+        self.last_received = time.monotonic()
+        self.pinged = False
+        self.deflater = None
+        self.inflater = None
+        self.writer = threading.Thread(target=self.drain, daemon=True)
+        self.writer.start()
+
+    def recv(self, size):
+        return self.socket.recv(size)
+
+    def getpeername(self):
+        return self.socket.getpeername()
+
+    def is_closing(self):
+        return self.closed
+
+    def send_frame(self, frame):
+        """
+        Queues an encoded frame for the writer thread. Never blocks. The same frame object may be queued on
+        many connections.
+
+        :param frame: Encoded frame bytes.
+        :return: True if the frame was queued, False if it was dropped.
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.policy == DISCONNECT:
+                logging.warning(f" Disconnecting slow client {self.socket.getpeername()}")
+                self.abort()
+            return False
+
+    def start_compression(self, deflater):
+        """
+        Queues the switch to compressed frames behind every frame already queued, so those still go out as they
+        were when they were sent. If the queue is full the connection is closed, as the client could no longer
+        tell which frames are compressed.
+
+        :param deflater: The connection's Deflater.
+        """
+        try:
+            self.queue.put_nowait(deflater)
+        except queue.Full:
+            logging.warning(f" Disconnecting slow client {self.socket.getpeername()}")
+            self.abort()
+
+    def drain(self):
+        """
+        Writer thread. Sends queued frames in order until the connection is closed, then shuts down the socket.
+        Frames are compressed here rather than when queued, so they enter the deflate stream in the order they
+        are sent and frames dropped from a full queue never do. Compression starts when the writer reaches the
+        Deflater queued by start_compression.
+        """
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if isinstance(frame, compression.Deflater):
+                self.deflater = frame
+                continue
+            try:
+                if self.deflater is not None:
+                    frame = self.deflater.compress_frame(frame)
+                self.socket.sendall(frame)
+            except socket.error as e:
+                logging.error(e)
+                break
+        self.closed = True
+        self.shutdown()
+        self.socket.close()
+
+    def close(self):
+        """
+        Closes the connection once all frames already queued have been written.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            self.abort()
+
+    def abort(self):
+        """
+        Closes the connection immediately, discarding queued frames. Wakes both the reader and writer threads.
+        """
+        self.closed = True
+        self.shutdown()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def shutdown(self):
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+class RemoteConnection:
+    """
+    Stands in the clients dictionary for a user connected to another worker process in a cluster. Frames sent
+    to it are forwarded over the message bus to the worker that owns the user's real connection.
+    Attributes:
+        bus (MessageBus): The local worker's message bus.
+        worker (int): Id of the worker the user is connected to.
+        username (str): Username of the remote user.
+        codec (JsonCodec): Always json; the owning worker re-encodes for the client's own codec.
+    """
+
+    def __init__(self, bus, worker, username):
+        self.bus = bus
+        self.worker = worker
+        self.username = username
+        self.codec = codec.JSON
+
+    def send_frame(self, frame):
+        self.bus.publish_delivery(self.worker, self.username, frame)
+        return True
+
+    def close(self):
+        pass
@@ -1,62 +1,168 @@
+import collections
+import concurrent.futures
+import logging
+import queue
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
+import bloom
+import friends
+import identity
+import metrics
+import migrations
 
+Write = collections.namedtuple("Write", ["operation", "future"])
+
+
+@metrics.instrument("db_call_seconds", "Time spent in each Database method.", "method", exclude=("write_loop",))
 class Database:
+    """
+    Storage layer over sqlite in WAL mode. Every thread reads through its own connection, so readers never share
+    a cursor and never block the writer. All writes are queued to a single writer thread which groups them into
+    one transaction per batch (group commit), trading up to max_batch_latency seconds of latency for one fsync
+    per batch instead of one per write. Write methods return a Future that completes once the write is
+    committed; callers that need durability (or read-your-writes) wait on it. Every public method is timed
+    into the db_call_seconds histogram, and each batch's size and commit time are recorded too.
+    Attributes:
+        location (str): Path of the sqlite database file.
+        max_batch_size (int): Most writes committed in one transaction.
+        max_batch_latency (float): Longest the writer waits for more writes before committing a batch.
+        schema_version (int): Version of the last migration applied at startup.
+        identities (IdentityCache): Usernames and user ids of known users, so hot paths skip the users table.
+        usernames (BloomFilter): Every registered username, for availability checks without a query.
+        usernames_loaded (Event): Set once the usernames already in the db have been added to the filter.
+        friends (FriendGraph): The friends table in memory, answering friendship checks and friend lists.
+    """
     DB_LOCATION = 'db.sqlite'
+    MAX_BATCH_SIZE = 256
+    MAX_BATCH_LATENCY = 0.002
+    BUSY_TIMEOUT = 5.0
+    USERNAME_FILTER_CAPACITY = 1000000
+    HISTORY_PAGE_SIZE = 10
+    MAX_HISTORY_PAGE = 100
+    MAX_INBOX_SIZE = 500
+    INSERT_MESSAGE = "INSERT INTO messages (sender, receiver, message, timestamp, friend_id, conversation, " \
+                     "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)"
 
-    def __init__(self):
-        """Initialise db class variables"""
-        self.connection = sqlite3.connect(self.DB_LOCATION, check_same_thread=False)
-        self.cursor = self.connection.cursor()
-        self.create_users_table()
-        self.create_friends_table()
-        self.create_messages_table()
-        self.create_ttt_table()
+    def __init__(self, location: str = DB_LOCATION, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_batch_latency: float = MAX_BATCH_LATENCY, identity_cache_size: int = identity.MAX_IDENTITIES):
+        """
+        Initialise db class variables, start the writer thread, migrate the schema to the latest version, load
+        the friend graph and start loading the registered usernames in the background.
+        """
+        self.location = location
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency = max_batch_latency
+        self.local = threading.local()
+        self.identities = identity.IdentityCache(identity_cache_size)
+        self.writes = queue.Queue()
+        self.batch_sizes = metrics.histogram("db_write_batch_size", "Writes committed per transaction.",
+                                             buckets=metrics.SIZE_BUCKETS)
+        self.commit_latency = metrics.histogram("db_commit_seconds", "Time to run and commit one batch of writes.")
+        self.writer = threading.Thread(target=self.write_loop, daemon=True, name="db-writer")
+        self.writer.start()
+        self.schema_version = self.submit(migrations.migrate).result()
+        self.friends = friends.FriendGraph()
+        self.load_friends()
+        self.cursor.execute("SELECT COUNT(*) FROM users")
+        self.usernames = bloom.BloomFilter(max(self.USERNAME_FILTER_CAPACITY, 2 * self.cursor.fetchone()[0]))
+        self.usernames_loaded = threading.Event()
+        threading.Thread(target=self.load_usernames, daemon=True, name="db-usernames").start()
 
-    def execute(self, new_data):
+    def connect(self):
         """
-        Function executes a stored procedure.
-        :param new_data: The SQL statement to execute.
+        Opens a new connection to the database file in WAL mode.
         """
-        self.cursor.execute(new_data)
+        connection = sqlite3.connect(self.location, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
 
-    def commit(self):
+    @property
+    def cursor(self):
         """
-        Function commits the changes made to the database.
+        The calling thread's read cursor, on a connection opened the first time the thread reads.
         """
-        self.connection.commit()
+        cursor = getattr(self.local, "cursor", None)
+        if cursor is None:
+            cursor = self.local.cursor = self.connect().cursor()
+        return cursor
 
-    def create_users_table(self):
+    def submit(self, operation):
         """
-        Function uses SQL 'CREATE' statement to create the user's table with required columns.
+        Queues a write for the writer thread.
+        :param operation: Callable taking the writer's cursor. Its return value becomes the future's result.
+        :return: Future completed when the batch containing the write has been committed.
         """
-        self.execute(f"CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, "
-                     f"username TEXT, password TEXT, user_status TEXT)")
-        self.commit()
+        future = concurrent.futures.Future()
+        self.writes.put(Write(operation, future))
+        return future
 
-    def create_friends_table(self):
+    def write(self, statement, parameters=()):
         """
-        Function uses SQL 'CREATE' statement to create the friend's table with required columns.
+        Queues a single SQL write statement.
+        :param statement: The SQL statement to execute.
+        :param parameters: Statement parameters.
+        :return: Future resolving to the lastrowid of the statement once committed.
         """
-        self.execute(f"CREATE TABLE IF NOT EXISTS friends (id INTEGER PRIMARY KEY, "
-                     f"sender TEXT, receiver TEXT, status TEXT)")
-        self.commit()
+        return self.submit(lambda cursor: cursor.execute(statement, parameters).lastrowid)
+
+    def write_loop(self):
+        """
+        Writer thread. Takes the next queued write, gathers more until the batch is full or max_batch_latency
+        has passed, and commits them together. Each write runs inside its own savepoint so a failing write, whatever
+        it raises, only fails its own future and the writer carries on. Stops when close() queues None.
+        """
+        connection = self.connect()
+        cursor = connection.cursor()
+        running = True
+        while running:
+            batch = [self.writes.get()]
+            deadline = time.monotonic() + self.max_batch_latency
+            while len(batch) < self.max_batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.writes.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            outcomes = []
+            started = time.perf_counter()
+            try:
+                cursor.execute("BEGIN")
+                for write in batch:
+                    cursor.execute("SAVEPOINT write")
+                    try:
+                        outcomes.append((write.future, write.operation(cursor), None))
+                        cursor.execute("RELEASE write")
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO write")
+                        cursor.execute("RELEASE write")
+                        outcomes.append((write.future, None, e))
+                cursor.execute("COMMIT")
+            except sqlite3.Error as e:
+                if connection.in_transaction:
+                    cursor.execute("ROLLBACK")
+                outcomes = [(write.future, None, e) for write in batch]
+            if metrics.enabled() and batch:
+                self.commit_latency.observe(time.perf_counter() - started)
+                self.batch_sizes.observe(len(batch))
+            for future, result, error in outcomes:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+        connection.close()
 
-    def create_messages_table(self):
+    def close(self):
         """
-        Function uses SQL 'CREATE' statement to create the message's table with required columns.
+        Function commits all queued writes and stops the writer thread.
         """
-        self.execute(f"CREATE TABLE IF NOT EXISTS messages (message_id INTEGER PRIMARY KEY, "
-                     f"sender TEXT, receiver TEXT, message TEXT, timestamp TEXT, "
-                     f"friend_id INTEGER, FOREIGN KEY (friend_id) REFERENCES friends(id))")
-        self.commit()
-
-    def create_ttt_table(self):
-        self.execute(f"CREATE TABLE IF NOT EXISTS ttt (game_id INTEGER PRIMARY KEY,"
-                     f" sender TEXT, receiver TEXT, status TEXT, timestamp TEXT,"
-                     f" friend_id INTEGER, FOREIGN KEY (friend_id) REFERENCES friends(id))")
-        self.commit()
+        self.writes.put(None)
+        self.writer.join()
 
     def find_username_in_db(self, username):
         """
@@ -66,7 +172,10 @@ class Database:
         """
         find_user = "SELECT * FROM users WHERE username = ?"
         self.cursor.execute(find_user, [username])
-        return self.cursor.fetchall()
+        rows = self.cursor.fetchall()
+        for row in rows:
+            self.identities.add(row[0], row[1])
+        return rows
 
     def find_user_pw_in_db(self, username, password):
         """
@@ -79,142 +188,271 @@ class Database:
         self.cursor.execute(find_user, [username, password])
         return self.cursor.fetchall()
 
-    def fetch_all_users_data(self, username):
+    def load_usernames(self):
         """
-        Function selects all data from the users table.
-        :param username: Client username
-        :return: All rows from users table in db.
+        Function adds every username in the users table to the Bloom filter, then sets usernames_loaded.
+        Usernames registered meanwhile are added by insert_username_and_password as usual.
         """
-        self.cursor.execute("SELECT * FROM users")
-        rows = self.cursor.fetchall()
-        return rows
+        self.usernames.update(username for username, in self.cursor.execute("SELECT username FROM users"))
+        self.usernames_loaded.set()
+
+    def load_friends(self):
+        """
+        Function (re)builds the friend graph from every row of the friends table.
+        """
+        self.friends.load(self.cursor.execute("SELECT id, sender, receiver, status FROM friends ORDER BY id"))
 
-    def fetch_messages(self, requester, recipient):
+    def after_commit(self, future, apply):
         """
-        Functions fetches and returns a list of all messages exchanged between client requester and recipient
-        in timeline order. The list is a list of tuples- therefore a new list is created and returned, which
-        only contains the messages.
+        Function chains an in-memory update to a queued write.
+        :param future: Future of the write.
+        :param apply: Callable taking the write's result, run once it has committed.
+        :return: Future completed with the write's result after apply has run, so callers that wait on it
+        always see the update.
+        """
+        applied = concurrent.futures.Future()
+
+        def done(committed):
+            if committed.exception() is not None:
+                applied.set_exception(committed.exception())
+                return
+            apply(committed.result())
+            applied.set_result(committed.result())
+
+        future.add_done_callback(done)
+        return applied
+
+    def username_available(self, username):
+        """
+        Function checks whether a username is free to register. Usernames the Bloom filter has never seen are
+        free without touching the db; possible matches, and every check made before the filter has loaded, are
+        confirmed against the unique username index. The filter only learns usernames registered through this
+        process, so the unique index remains the authority when the insert is made.
+        :param username: Requested username.
+        :return: True if no user has the username.
+        """
+        if self.usernames_loaded.is_set() and username not in self.usernames:
+            return True
+        self.cursor.execute("SELECT 1 FROM users WHERE username = ?", [username])
+        return self.cursor.fetchone() is None
+
+    @staticmethod
+    def conversation_key(first_id, second_id):
+        """
+        Function returns the key shared by every message between two users, whichever of them sent it.
+        :param first_id: user_id of one user.
+        :param second_id: user_id of the other user.
+        :return: Conversation key (str).
+        """
+        return f"{min(first_id, second_id)}:{max(first_id, second_id)}"
+
+    def fetch_history(self, requester, recipient, before_id=None, limit=HISTORY_PAGE_SIZE):
+        """
+        Function fetches one page of the conversation between requester and recipient, newest first, using
+        keyset pagination on message_id: a page is a range scan of the conversation index that starts below
+        before_id, so it costs the same however far back it is.
         :param requester: Username of client (requester)
         :param recipient: Username of recipient
-        :return: List of all messages exchanged between requester and recipient. Returns None if no messages found.
-        """
-        sender = self.find_user_id(requester)
-        receiver = self.find_user_id(recipient)
-        fetch_messages = f"SELECT message FROM messages WHERE sender = ? AND receiver = ? " \
-                         f"OR sender = ? AND receiver = ? " \
-                         f"ORDER BY timestamp DESC LIMIT 10;"
-        self.cursor.execute(fetch_messages, [receiver, sender, sender, receiver])
-        retval = self.cursor.fetchall()
-        previous_messages = []
-        for i in retval:
-            previous_messages.append(i[0])
-        if retval:
-            return previous_messages
+        :param before_id: Only messages with a lower message_id are returned. None for the latest page.
+        :param limit: Most messages returned, capped at MAX_HISTORY_PAGE.
+        :return: List of [message_id, sender username, message, created_at] lists, newest first.
+        """
+        conversation = self.conversation_key(self.find_user_id(requester), self.find_user_id(recipient))
+        limit = max(min(limit, self.MAX_HISTORY_PAGE), 1)
+        if before_id is None:
+            fetch_history = f"SELECT message_id, sender, message, created_at FROM messages " \
+                            f"WHERE conversation = ? ORDER BY message_id DESC LIMIT ?"
+            self.cursor.execute(fetch_history, [conversation, limit])
         else:
-            return None
+            fetch_history = f"SELECT message_id, sender, message, created_at FROM messages " \
+                            f"WHERE conversation = ? AND message_id < ? ORDER BY message_id DESC LIMIT ?"
+            self.cursor.execute(fetch_history, [conversation, before_id, limit])
+        return [[message_id, self.find_user_name(int(sender)), message, created_at]
+                for message_id, sender, message, created_at in self.cursor.fetchall()]
 
     def find_friendship_id(self, requester, recipient):
         """
-        Function uses an SQL 'SELECT' statement to fetch and return the friendship id of the requester and
-        recipient in the friends table. A 'UNION' statement makes another statement and merges the results.
-        Only one id should be found and returned.
+        Function returns the friendship id of the requester and recipient from the friend graph, checking the
+        request sent by the requester first and then the one sent by the recipient. Only one id should be found.
         :param requester: Requester username.
         :param recipient: Recipient username.
         :return: ID of friendship between requester and recipient. Returns none if no friendship_id is found.
         """
-        receiver = self.find_user_id(requester)
-        sender = self.find_user_id(recipient)
-        find_friendship_id = f"SELECT id FROM friends WHERE sender = ? AND receiver = ? " \
-                             f"UNION ALL SELECT id FROM friends WHERE sender = ? AND receiver = ?"
-        self.cursor.execute(find_friendship_id, [receiver, sender, sender, receiver])
-        retval = self.cursor.fetchone()
-        if retval:
-            return retval[0]
-        else:
-            return None
+        return self.friends.friendship_id(self.find_user_id(requester), self.find_user_id(recipient))
 
     def find_user_id(self, user):
         """
-        Function selects and returns the user_id of the user passed in the users table.
+        Function returns the user_id of the user passed from the identity cache, or selects it from the users
+        table and caches it.
         :param user: client username.
-        :return: user_id (int)
-        """
-        find_user_id = f"SELECT user_id FROM users WHERE username = ?"
-        self.cursor.execute(find_user_id, [user])
-        return self.cursor.fetchone()[0]
+        :return: user_id (int), or None if there is no such user.
+        """
+        user_id = self.identities.user_id(user)
+        if user_id is None:
+            find_user_id = f"SELECT user_id FROM users WHERE username = ?"
+            self.cursor.execute(find_user_id, [user])
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            user_id = row[0]
+            self.identities.add(user_id, user)
+        return user_id
 
     def find_user_name(self, id):
         """
-        Function selects and returns a username of the id passed to the user's table in db.
+        Function returns the username of the id passed from the identity cache, or selects it from the user's
+        table in db and caches it.
         :param id: id of the username to find.
         :return: Username found from id passed.
         """
-        find_user_name = f"SELECT username FROM users WHERE user_id = ?"
-        self.cursor.execute(find_user_name, [id])
-        return self.cursor.fetchone()[0]
+        username = self.identities.username(id)
+        if username is None:
+            find_user_name = f"SELECT username FROM users WHERE user_id = ?"
+            self.cursor.execute(find_user_name, [id])
+            username = self.cursor.fetchone()[0]
+            self.identities.add(id, username)
+        return username
 
     def find_friendship_status(self, requester, recipient):
         """
-        Function finds and returns the status of the two users passed, in the friends table.
+        Function returns the status of the friend request the recipient sent the requester, from the friend graph.
         :param requester: username of requester.
         :param recipient: username of recipient.
         :return: Status (str) of the two users friendship.
         """
-        receiver = self.find_user_id(requester)
-        sender = self.find_user_id(recipient)
-        find_status = f"SELECT status FROM friends WHERE sender = ? AND receiver = ?"
-        self.cursor.execute(find_status, [sender, receiver])
-        retval = self.cursor.fetchone()
-        if retval:
-            return retval[0]
-        else:
-            return None
+        return self.friends.status(self.find_user_id(recipient), self.find_user_id(requester))
+
+    def are_friends(self, requester, recipient):
+        """
+        Function checks the friend graph for a friendship between the two users passed, in either direction.
+        :param requester: username of requester.
+        :param recipient: username of recipient.
+        :return: True if the users are friends.
+        """
+        return self.friends.are_friends(self.find_user_id(requester), self.find_user_id(recipient))
 
     def insert_friend_relationship(self, requester, recipient):
         """
         Function uses an SQL 'UPDATE' statement to insert the status 'FRIENDS', if the requester and recipient
-        status is already 'SENT'.
+        status is already 'SENT', and records the friendship in the friend graph once committed.
         :param requester: Requester username.
         :param recipient: Recipient username.
+        :return: Future completed once the update is committed and the graph updated.
         """
-        if self.find_friendship_status(requester, recipient) == "SENT":
-            receiver = self.find_user_id(requester)
-            sender = self.find_user_id(recipient)
-            friends_accepted = f"UPDATE friends SET status = 'FRIENDS' WHERE sender = " \
-                               f"? AND receiver = ?"
-            self.cursor.execute(friends_accepted, [sender, receiver])
-            self.commit()
+        receiver = self.find_user_id(requester)
+        sender = self.find_user_id(recipient)
+        friends_accepted = f"UPDATE friends SET status = 'FRIENDS' WHERE sender = " \
+                           f"? AND receiver = ? AND status = 'SENT'"
+        return self.after_commit(self.write(friends_accepted, [sender, receiver]),
+                                 lambda _: self.friends.accept(sender, receiver))
 
     def insert_friend_request(self, requester, recipient):
         """
         Function uses an SQL 'INSERT' statement to insert the string 'SENT' in the status column of the requester
-        and recipient.
+        and recipient, and records the request in the friend graph once committed.
         :param requester: Requester username.
         :param recipient: Recipient username.
+        :return: Future resolving to the friendship id once the write is committed and the graph updated.
         """
         sender = self.find_user_id(requester)
         receiver = self.find_user_id(recipient)
         add_relationship = f"INSERT INTO friends (sender, receiver, status) VALUES (?, ?, ?)"
-        self.cursor.execute(add_relationship, (sender, receiver, "SENT"))
-        self.commit()
+        return self.after_commit(self.write(add_relationship, (sender, receiver, "SENT")),
+                                 lambda friendship_id: self.friends.add_request(friendship_id, sender, receiver))
 
-    def insert_message(self, requester, recipient, message):
+    def record_friend_request(self, friendship_id, requester, recipient):
+        """
+        Function records in the friend graph a friend request another cluster worker has committed.
+        """
+        self.friends.add_request(friendship_id, self.find_user_id(requester), self.find_user_id(recipient))
+
+    def record_friendship(self, requester, recipient):
+        """
+        Function records in the friend graph a friend request accepted on another cluster worker.
         """
-        Function finds the friendship_id of the requester and recipient from the friends table and then uses that ID
-        as a foreign key to insert the message between the users into the messages table. Alongside the message is
-        a timestamp that uses a date/time function.
+        self.friends.accept(self.find_user_id(recipient), self.find_user_id(requester))
+
+    def message_row(self, requester, recipient, message, sent):
+        """
+        Function finds the user ids and friendship_id of the requester and recipient and returns the messages
+        table row for a message between them: the friendship_id as a foreign key, the conversation key, a
+        timestamp that uses a date/time function and created_at in integer microseconds.
         :param requester: Requester username.
         :param recipient: Recipient username.
         :param message: The string message exchanged between the requester and recipient.
+        :param sent: datetime the message was sent.
+        :return: Tuple of column values, in INSERT_MESSAGE order, or None if either user does not exist.
         """
         sender = self.find_user_id(requester)
         receiver = self.find_user_id(recipient)
+        if sender is None or receiver is None:
+            return None
         friend_id = self.find_friendship_id(requester, recipient)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        insert_message = f"INSERT INTO messages (sender, receiver, message, timestamp, friend_id) " \
-                         f"VALUES (?, ?, ?, ?, ?)"
-        self.cursor.execute(insert_message, (sender, receiver, message, timestamp, friend_id))
-        self.commit()
+        return (sender, receiver, message, sent.strftime("%Y-%m-%d %H:%M:%S"), friend_id,
+                self.conversation_key(sender, receiver), int(sent.timestamp() * 1000000))
+
+    def insert_messages(self, messages):
+        """
+        Function inserts many messages as one multi-row write. The users are resolved on the calling thread, so
+        the writer thread only runs the insert. A message between users that do not exist is logged and left
+        out, so it cannot fail the rest of the batch.
+        :param messages: Iterable of (requester, recipient, message, sent datetime) tuples.
+        :return: Future completed once every other message is committed.
+        """
+        rows = []
+        for requester, recipient, message, sent in messages:
+            row = self.message_row(requester, recipient, message, sent)
+            if row is None:
+                logging.error(f" Dropped direct message from {requester} to {recipient}: unknown user")
+                continue
+            rows.append(row)
+        return self.submit(lambda cursor: cursor.executemany(self.INSERT_MESSAGE, rows).rowcount)
+
+    def store_offline_message(self, requester, recipient, message, max_inbox=MAX_INBOX_SIZE):
+        """
+        Function queues a direct message in the inbox of an offline recipient, unless their inbox already holds
+        max_inbox messages. The size check and insert run together on the writer thread, so concurrent senders
+        cannot overfill the inbox.
+        :param requester: Sender username.
+        :param recipient: Recipient username.
+        :param message: The message text.
+        :param max_inbox: Most messages an inbox may hold.
+        :return: Future resolving to True once the message is committed, or False if the inbox was full.
+        :raises ValueError: If the recipient does not exist.
+        """
+        receiver = self.find_user_id(recipient)
+        if receiver is None:
+            raise ValueError(f"Unknown recipient {recipient}")
+        created_at = int(datetime.now().timestamp() * 1000000)
+
+        def store(cursor):
+            cursor.execute("SELECT COUNT(*) FROM inbox WHERE recipient = ?", [receiver])
+            if cursor.fetchone()[0] >= max_inbox:
+                return False
+            cursor.execute("INSERT INTO inbox (recipient, sender, message, created_at) VALUES (?, ?, ?, ?)",
+                           (receiver, requester, message, created_at))
+            return True
+
+        return self.submit(store)
+
+    def drain_inbox(self, user):
+        """
+        Function takes every message waiting in a user's inbox, oldest first, removing them in the same
+        transaction so two drains never return the same message.
+        :param user: Username of the recipient.
+        :return: Future resolving to a list of [sender, message, created_at] lists.
+        """
+        receiver = self.find_user_id(user)
+
+        def drain(cursor):
+            cursor.execute("SELECT inbox_id, sender, message, created_at FROM inbox WHERE recipient = ? "
+                           "ORDER BY inbox_id", [receiver])
+            rows = cursor.fetchall()
+            if rows:
+                cursor.execute("DELETE FROM inbox WHERE recipient = ? AND inbox_id <= ?", [receiver, rows[-1][0]])
+            return [[sender, message, created_at] for inbox_id, sender, message, created_at in rows]
+
+        return self.submit(drain)
 
     def insert_ttt_game_request(self, requester, recipient):
         sender = self.find_user_id(requester)
@@ -223,82 +461,152 @@ class Database:
         timestamp = datetime.now().strftime("%Y-%m-%d %H-%M-%S")
         insert_game = f"INSERT INTO ttt (sender, receiver, status, timestamp, friend_id) " \
                       f"VALUES (?, ?, ?, ?, ?)"
-        self.cursor.execute(insert_game, (sender, receiver, 'SENT', timestamp, friend_id))
-        self.commit()
+        return self.write(insert_game, (sender, receiver, 'SENT', timestamp, friend_id))
 
-    def insert_ttt_game_response(self, requester, recipient, status):
-        sender = self.find_user_id(requester)
-        receiver = self.find_user_id(recipient)
-        update_response = f"UPDATE ttt SET status = ? WHERE sender = ? AND receiver = ?"
-        self.cursor.execute(update_response, [status, receiver, sender])
-        self.commit()
+    def insert_ttt_game_response(self, game_id, status):
+        """
+        Function updates the status of a game in the ttt table: 'CONFIRM' or 'DENY' when the invite is answered,
+        'FINISHED' once the game has ended.
+        :param game_id: Id of the game.
+        :param status: Status (str) to insert.
+        :return: Future completed once the update is committed.
+        """
+        update_response = f"UPDATE ttt SET status = ? WHERE game_id = ?"
+        return self.write(update_response, [status, game_id])
+
+    def find_ttt_game(self, game_id):
+        """
+        Function selects a game from the ttt table by its id.
+        :param game_id: Id of the game.
+        :return: Username of the player who sent the invite, username of the player invited and the game's
+        status, or None if there is no such game.
+        """
+        find_game = f"SELECT sender, receiver, status FROM ttt WHERE game_id = ?"
+        self.cursor.execute(find_game, [game_id])
+        game = self.cursor.fetchone()
+        if game is None:
+            return None
+        return self.find_user_name(int(game[0])), self.find_user_name(int(game[1])), game[2]
+
+    def load_rooms(self):
+        """
+        Function selects every room and every room membership, for the room registry to be loaded from.
+        :return: List of (room_id, name) of each room, and list of (room_id, username) of each membership.
+        """
+        rooms = self.cursor.execute("SELECT room_id, name FROM rooms ORDER BY room_id").fetchall()
+        members = self.cursor.execute("SELECT room_id, username FROM room_members "
+                                      "INNER JOIN users ON users.user_id = room_members.user_id").fetchall()
+        return rooms, members
+
+    def insert_room(self, name, owner):
+        """
+        Function inserts a new room, with its owner as its first member. The unique room name index rejects a
+        name already taken, failing the future with sqlite3.IntegrityError.
+        :param name: Name of the room.
+        :param owner: Username of the user creating it.
+        :return: Future resolving to the new room_id once the write is committed.
+        """
+        owner_id = self.find_user_id(owner)
+        created_at = int(datetime.now().timestamp() * 1000000)
+
+        def insert(cursor):
+            room_id = cursor.execute("INSERT INTO rooms (name, owner, created_at) VALUES (?, ?, ?)",
+                                     (name, owner_id, created_at)).lastrowid
+            cursor.execute("INSERT INTO room_members (room_id, user_id) VALUES (?, ?)", (room_id, owner_id))
+            return room_id
+
+        return self.submit(insert)
+
+    def insert_room_member(self, room_id, user):
+        """
+        Function adds a user to a room's members, if they are not already one.
+        :return: Future completed once the write is committed.
+        """
+        return self.write("INSERT OR IGNORE INTO room_members (room_id, user_id) VALUES (?, ?)",
+                          (room_id, self.find_user_id(user)))
+
+    def delete_room_member(self, room_id, user):
+        """
+        Function removes a user from a room's members.
+        :return: Future completed once the write is committed.
+        """
+        return self.write("DELETE FROM room_members WHERE room_id = ? AND user_id = ?",
+                          (room_id, self.find_user_id(user)))
 
     def insert_username_and_password(self, username, password):
         """
         Function uses an 'SQL' INSERT statement to insert the username and password passed to it.
         As this function is run upon user registration, the function also inserts the status 'OFFLINE' into
-        the users table.
+        the users table. The username is added to the Bloom filter straight away, and the new user to the
+        identity cache once the insert has been committed.
         :param username: Username to insert.
         :param password: Password to insert.
+        :return: Future resolving to the new user_id once the write is committed.
         """
         add_user = f"INSERT INTO users (username, password, user_status) VALUES (?, ?, ?)"
-        self.cursor.execute(add_user, (username, password, 'OFFLINE'))
-        self.commit()
+        self.usernames.add(username)
+        future = self.write(add_user, (username, password, 'OFFLINE'))
+
+        def cache_identity(committed):
+            if committed.exception() is None:
+                self.identities.add(committed.result(), username)
+
+        future.add_done_callback(cache_identity)
+        return future
 
     def set_status(self, status, user):
         """
         Function updates the user's table user_status, depending on the username and status string passed.
         :param status: Status (str) to insert.
         :param user:  Username of client.
+        :return: Future completed once the write is committed.
         """
         set_status = f"UPDATE users SET user_status = ? WHERE username = ?"
-        self.cursor.execute(set_status, [status, user])
-        self.commit()
+        return self.write(set_status, [status, user])
 
     def view_friend_requests(self, user):
         """
-        Function selects and returns all usernames from the friend's table where the status between passed requester
-        and recipient is 'SENT'. An 'inner join' and 'sub-statement' are used in the SQL statement.
+        Function returns all usernames of the users who have sent the user passed a friend request that is still
+        'SENT', from the friend graph.
         :param user: Username of client.
         :return: List of friend requests received by user.
         """
-        find_request_status = f"SELECT username FROM users INNER JOIN friends ON users.user_id=friends.sender WHERE" \
-                              f" friends.status='SENT' AND friends.receiver=" \
-                              f"(SELECT user_id FROM users" \
-                              f" WHERE username = ?)"
-        self.cursor.execute(find_request_status, [user])
-        friend_requests = self.cursor.fetchall()
-        return friend_requests
+        return [(self.find_user_name(sender),) for sender in self.friends.requests_for(self.find_user_id(user))]
 
     def view_ttt_requests(self, user):
         """
-        Function selects and returns all usernames from the friend's table where the status between passed requester
-        and recipient is 'SENT'. An 'inner join' and 'sub-statement' are used in the SQL statement.
+        Function selects and returns the usernames and game ids of all games in the ttt table where the user
+        passed was invited and the status is still 'SENT'. An 'inner join' is used in the SQL statement.
         :param user: Username of client.
-        :return: List of friend requests received by user.
+        :return: List of (username, game_id) of the tic tac toe invites received by user.
         """
-        find_request_status = f"SELECT username FROM users INNER JOIN ttt ON users.user_id=ttt.sender WHERE" \
-                              f" ttt.status='SENT' AND ttt.receiver=" \
-                              f"(SELECT user_id FROM users" \
-                              f" WHERE username = ?)"
-        self.cursor.execute(find_request_status, [user])
+        receiver = self.find_user_id(user)
+        find_request_status = f"SELECT username, game_id FROM users INNER JOIN ttt ON users.user_id=ttt.sender WHERE" \
+                              f" ttt.status='SENT' AND ttt.receiver = ?"
+        self.cursor.execute(find_request_status, [receiver])
         ttt_requests = self.cursor.fetchall()
         return ttt_requests
 
-    def view_friends_and_status(self, user):
+    def find_statuses(self, users):
+        """
+        Function selects the user_status of each of the usernames passed from the users table, using the unique
+        username index.
+        :param users: List of usernames.
+        :return: List of (username, status) of the users found.
+        """
+        if not users:
+            return []
+        find_statuses = f"SELECT username, user_status FROM users WHERE username IN " \
+                        f"({', '.join('?' * len(users))})"
+        self.cursor.execute(find_statuses, users)
+        return self.cursor.fetchall()
+
+    def view_friends(self, user):
         """
-        Function selects and returns all usernames of users in the friend's table where the requester and recipient
-        status equal 'FRIENDS (and vice versa).'
+        Function returns the usernames of the friends of the user passed, from the friend graph.
         :param user: Client username.
         :return: List of friends usernames.
         """
-        find_friends = f"SELECT username, user_status FROM users INNER JOIN friends" \
-                       f" ON users.user_id=friends.sender WHERE" \
-                       f" friends.status='FRIENDS' AND friends.receiver = " \
-                       f"(SELECT user_id FROM users WHERE username = ?) UNION ALL" \
-                       f" SELECT username, user_status FROM users INNER JOIN friends ON" \
-                       f" users.user_id=friends.receiver WHERE" \
-                       f" friends.status='FRIENDS' AND friends.sender = (SELECT user_id FROM users WHERE username = ?)"
-        self.cursor.execute(find_friends, [user, user])
-        friend_list = self.cursor.fetchall()
-        return friend_list
+        friend_ids = self.friends.friends_of(self.find_user_id(user))
+        return [username if username is not None else self.find_user_name(friend_id)
+                for friend_id, username in zip(friend_ids, self.identities.usernames_of(friend_ids))]
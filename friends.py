@@ -0,0 +1,97 @@
+import collections
+import threading
+
+SENT = "SENT"
+FRIENDS = "FRIENDS"
+
+
+class FriendGraph:
+    """
+    In-memory index of the friends table, keyed by user id, so friendship checks and friend lists never query
+    the db. The table stays the durable source: the graph is loaded from it at startup and each change is applied
+    to the graph once its write has committed. Each directed (sender, receiver) pair keeps the id of its first
+    row; a pair is FRIENDS if any of its rows is, matching what the queries this replaces returned.
+    Attributes:
+        edges (dict): [friendship_id, status] keyed by (sender_id, receiver_id), as stored in the friends table.
+        friends (defaultdict): Set of friend user ids of each user.
+        pending (defaultdict): friendship_id of each friend request received, keyed by receiver then sender id.
+    """
+
+    def __init__(self):
+        self.edges = {}
+        self.friends = collections.defaultdict(set)
+        self.pending = collections.defaultdict(dict)
+        self.lock = threading.Lock()
+
+    def load(self, rows):
+        """
+        Rebuilds the graph from friends table rows.
+
+        :param rows: (friendship_id, sender_id, receiver_id, status) tuples, in friendship_id order.
+        """
+        with self.lock:
+            self.edges.clear()
+            self.friends.clear()
+            self.pending.clear()
+            for friendship_id, sender, receiver, status in rows:
+                self.apply(friendship_id, int(sender), int(receiver), status)
+
+    def apply(self, friendship_id, sender, receiver, status):
+        """
+        Applies one friends table row or status change. Caller holds the lock.
+        """
+        edge = self.edges.setdefault((sender, receiver), [friendship_id, status])
+        if status == FRIENDS:
+            edge[1] = FRIENDS
+            self.pending[receiver].pop(sender, None)
+            self.friends[sender].add(receiver)
+            self.friends[receiver].add(sender)
+        elif edge[1] == SENT:
+            self.pending[receiver].setdefault(sender, edge[0])
+
+    def add_request(self, friendship_id, sender, receiver):
+        """
+        Records a committed friend request from sender to receiver.
+        """
+        with self.lock:
+            self.apply(friendship_id, sender, receiver, SENT)
+
+    def accept(self, sender, receiver):
+        """
+        Records that receiver has accepted the friend request sender sent them.
+        """
+        with self.lock:
+            if (sender, receiver) in self.edges:
+                self.apply(None, sender, receiver, FRIENDS)
+
+    def status(self, sender, receiver):
+        """
+        :return: Status of the friend request sent by sender to receiver, or None if there is none.
+        """
+        edge = self.edges.get((sender, receiver))
+        return edge[1] if edge else None
+
+    def friendship_id(self, first, second):
+        """
+        :return: friendship_id of the row between two users in either direction, or None.
+        """
+        edge = self.edges.get((first, second)) or self.edges.get((second, first))
+        return edge[0] if edge else None
+
+    def are_friends(self, first, second):
+        return second in self.friends.get(first, ())
+
+    def friends_of(self, user_id):
+        """
+        :return: List of the user ids of a user's friends.
+        """
+        with self.lock:
+            return list(self.friends.get(user_id, ()))
+
+    def requests_for(self, user_id):
+        """
+        :return: List of the user ids who have sent a user a friend request they have not accepted, oldest first.
+        """
+        with self.lock:
+            received = self.pending.get(user_id, {})
+            return sorted(received, key=received.get)
@@ -0,0 +1,118 @@
+import threading
+
+import metrics
+import ttt_game
+
+PLAYING = ttt_game.PLAYING
+WON = ttt_game.WON
+TIE = ttt_game.TIE
+SPACE_FILLED = ttt_game.SPACE_FILLED
+NOT_YOUR_TURN = "not your turn"
+INVALID_SQUARE = "invalid square"
+MARKS = ("X", "O")
+
+
+class GameSession:
+    """
+    Authoritative state of one tic tac toe game. The player who sent the invite plays X and moves first; moves
+    are checked against the turn order and the board here, so clients only ever send the square they chose.
+    Attributes:
+        game_id (int): Id of the game's row in the ttt table.
+        players (tuple): Usernames of the X and O players.
+        marks (dict): Mark ('X' or 'O') of each player.
+        board (BitBoard): The board.
+        turn (str): Username of the player to move.
+    """
+
+    def __init__(self, game_id, first, second):
+        self.game_id = game_id
+        self.players = (first, second)
+        self.marks = dict(zip(self.players, MARKS))
+        self.board = ttt_game.BitBoard()
+        self.turn = first
+        self.lock = threading.Lock()
+
+    def opponent(self, username):
+        return self.players[1] if username == self.players[0] else self.players[0]
+
+    def move(self, username, square):
+        """
+        Plays a player's move if it is their turn and the square is free.
+
+        :param username: Username of the player moving.
+        :param square: Square chosen, '1' to '9' as on the help board.
+        :return: PLAYING, WON or TIE if the move was played, else NOT_YOUR_TURN, INVALID_SQUARE or SPACE_FILLED.
+        """
+        with self.lock:
+            if username != self.turn:
+                return NOT_YOUR_TURN
+            if square not in ttt_game.SQUARE_BITS:
+                return INVALID_SQUARE
+            outcome = self.board.play(self.marks[username], square)
+            if outcome == PLAYING:
+                self.turn = self.opponent(username)
+            return outcome
+
+
+class GameRegistry:
+    """
+    Every tic tac toe game in progress on this server, keyed by game id, with an index of the games each player
+    is in so a player's games can be ended when they leave.
+    Attributes:
+        games (dict): GameSession keyed by game_id.
+        players (dict): Set of the game_ids each player is in, keyed by username.
+    """
+
+    def __init__(self):
+        self.games = {}
+        self.players = {}
+        self.lock = threading.Lock()
+        self.started = metrics.counter("ttt_games_started_total", "Tic tac toe games started.")
+        self.finished = metrics.counter("ttt_games_finished_total", "Tic tac toe games won, tied or abandoned.")
+
+    def __len__(self):
+        return len(self.games)
+
+    def start(self, game_id, first, second):
+        """
+        Creates the session of an accepted game.
+
+        :return: The new GameSession, or None if the game has already started.
+        """
+        with self.lock:
+            if game_id in self.games:
+                return None
+            session = self.games[game_id] = GameSession(game_id, first, second)
+            for player in session.players:
+                self.players.setdefault(player, set()).add(game_id)
+        self.started.inc()
+        return session
+
+    def get(self, game_id):
+        return self.games.get(game_id)
+
+    def finish(self, game_id):
+        """
+        Removes a game that has ended.
+
+        :return: The removed GameSession, or None if it was not in progress.
+        """
+        with self.lock:
+            session = self.games.pop(game_id, None)
+            if session is None:
+                return None
+            for player in session.players:
+                game_ids = self.players.get(player)
+                if game_ids is not None:
+                    game_ids.discard(game_id)
+                    if not game_ids:
+                        del self.players[player]
+        self.finished.inc()
+        return session
+
+    def games_of(self, username):
+        """
+        :return: List of the GameSessions of the games a player is in.
+        """
+        with self.lock:
+            return [self.games[game_id] for game_id in self.players.get(username, ())]
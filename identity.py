@@ -0,0 +1,91 @@
+import collections
+import threading
+
+import metrics
+
+MAX_IDENTITIES = 100000
+
+
+class IdentityCache:
+    """
+    Bounded, thread-safe two way map between usernames and user ids, so the database layer can resolve known
+    users without a query. Entries are added when a user logs in or registers, or on a cache miss, and the least
+    recently used pair is evicted once max_size users are cached. Only committed users are ever cached, and users
+    are never deleted or renamed, so a cached pair never goes stale. The hit rate is exported as a gauge.
+    Attributes:
+        max_size (int): Most users held at once.
+        user_ids (OrderedDict): user_id keyed by username, in least recently used order.
+        usernames (dict): username keyed by user_id.
+        hits (Counter): Lookups answered from the cache.
+        misses (Counter): Lookups that had to query the db.
+    """
+
+    def __init__(self, max_size: int = MAX_IDENTITIES):
+        self.max_size = max_size
+        self.user_ids = collections.OrderedDict()
+        self.usernames = {}
+        self.lock = threading.Lock()
+        self.hits = metrics.counter("identity_cache_hits_total", "User id lookups answered from the cache.")
+        self.misses = metrics.counter("identity_cache_misses_total", "User id lookups that queried the db.")
+        metrics.gauge("identity_cache_hit_ratio", "Fraction of user id lookups answered from the cache.",
+                      function=self.hit_rate)
+
+    def add(self, user_id, username):
+        """
+        Caches a committed user, evicting the least recently used user if the cache is full.
+        """
+        with self.lock:
+            self.user_ids[username] = user_id
+            self.user_ids.move_to_end(username)
+            self.usernames[user_id] = username
+            while len(self.user_ids) > self.max_size:
+                evicted, evicted_id = self.user_ids.popitem(last=False)
+                self.usernames.pop(evicted_id, None)
+
+    def user_id(self, username):
+        """
+        :param username: Username to resolve.
+        :return: Cached user_id, or None on a miss.
+        """
+        with self.lock:
+            user_id = self.user_ids.get(username)
+            if user_id is not None:
+                self.user_ids.move_to_end(username)
+        (self.misses if user_id is None else self.hits).inc()
+        return user_id
+
+    def username(self, user_id):
+        """
+        :param user_id: User id to resolve.
+        :return: Cached username, or None on a miss.
+        """
+        with self.lock:
+            username = self.usernames.get(user_id)
+            if username is not None:
+                self.user_ids.move_to_end(username)
+        (self.misses if username is None else self.hits).inc()
+        return username
+
+    def usernames_of(self, user_ids):
+        """
+        Resolves many user ids under one lock acquisition.
+
+        :param user_ids: User ids to resolve.
+        :return: List of the cached usernames, in user_ids order, with None for each miss.
+        """
+        with self.lock:
+            usernames = [self.usernames.get(user_id) for user_id in user_ids]
+            for username in usernames:
+                if username is not None:
+                    self.user_ids.move_to_end(username)
+        missed = usernames.count(None)
+        self.hits.inc(len(usernames) - missed)
+        self.misses.inc(missed)
+        return usernames
+
+    def hit_rate(self):
+        """
+        :return: Fraction of lookups answered from the cache since startup.
+        """
+        lookups = self.hits.value + self.misses.value
+        return self.hits.value / lookups if lookups else 0.0
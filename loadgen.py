@@ -0,0 +1,343 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import async_server
+import chat_client
+import codec
+import compression
+import ttt_game
+import utility
+
+logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
+COMMANDS = ("broadcast", "dm", "friend", "view_friends", "ttt")
+DEFAULT_MIX = "broadcast=1,dm=6,friend=1,view_friends=1,ttt=1"
+PASSWORD = "loadgen"
+SIGN_IN_CONCURRENCY = 64
+SERVER_START_TIMEOUT = 10.0
+PUSHES = (utility.Responses.BROADCAST_MSG, utility.LoggedInCommands.PRINT_DM, utility.Responses.TIC_TAC_TOE_REQUEST,
+          utility.Responses.PLAY_TIC_TAC_TOE, utility.Responses.TIC_TAC_TOE_ERROR, utility.Responses.TIC_TAC_TOE_WINNER,
+          utility.Responses.TIC_TAC_TOE_TIE)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def parse_mix(mix):
+    """
+    :param mix: Command weights as 'name=weight' pairs separated by commas, e.g. 'dm=6,broadcast=1'.
+    :return: Dictionary of weights keyed by command name.
+    """
+    weights = {}
+    for pair in mix.split(","):
+        name, _, weight = pair.partition("=")
+        if name not in COMMANDS:
+            raise ValueError(f"Unknown command {name!r}, choose from {', '.join(COMMANDS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class LatencyRecorder:
+    """
+    Latency samples and failures per command type.
+    Attributes:
+        samples (dict): Latencies in seconds keyed by command name.
+        failures (dict): Requests that timed out or never arrived, keyed by command name.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.failures = {}
+
+    def record(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def fail(self, name, count=1):
+        self.failures[name] = self.failures.get(name, 0) + count
+
+    def report(self, elapsed, phases=None):
+        """
+        Prints throughput and p50/p95/p99 latency per command type.
+
+        :param elapsed: Seconds the load ran for, to compute throughput.
+        :param phases: Seconds to compute throughput over instead, for commands run outside the load.
+        """
+        phases = phases or {}
+        print(f"{'command':<14}{'count':>8}{'per sec':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'failed':>8}")
+        for name in sorted(set(self.samples) | set(self.failures)):
+            samples = self.samples.get(name, [])
+            if samples:
+                latencies = "".join(f"{percentile(samples, fraction) * 1000:10.2f}" for fraction in (0.5, 0.95, 0.99))
+            else:
+                latencies = f"{'-':>10}" * 3
+            print(f"{name:<14}{len(samples):8d}{len(samples) / phases.get(name, elapsed):10.1f}{latencies}"
+                  f"{self.failures.get(name, 0):8d}")
+
+
+class SimulatedUser:
+    """
+    One simulated user on its own connection, driven through chat_client.ChatClient so the load exercises the
+    same framing, codec and compression negotiation and request matching as every other client. The pushes
+    that complete or answer a command are handed to the load generator; the rest are left queued on the client.
+    Attributes:
+        username (str): The user's username.
+        generator (LoadGenerator): The load generator driving the user.
+        chat (ChatClient): The user's connection.
+    """
+
+    def __init__(self, generator, username):
+        self.generator = generator
+        self.username = username
+        compression_methods = (compression.DEFLATE,) if generator.compress else ()
+        self.chat = chat_client.ChatClient(generator.host, generator.port, (generator.codec_name, codec.JSON.name),
+                                           compression_methods=compression_methods)
+        for header in PUSHES:
+            self.chat.on(header, lambda data: generator.on_push(self, data))
+
+    async def sign_in(self, recorder):
+        """
+        Connects, registers and logs in; the client retries while the server's password pool answers BUSY. A
+        username that is already registered (from an earlier run with the same prefix) just logs in.
+
+        :return: True once logged in.
+        """
+        await self.chat.connect()
+        started = time.perf_counter()
+        try:
+            await self.chat.register(self.username, PASSWORD)
+        except chat_client.ChatError:
+            pass
+        recorder.record("register", time.perf_counter() - started)
+        started = time.perf_counter()
+        try:
+            await self.chat.login(self.username, PASSWORD)
+        except chat_client.ChatError:
+            recorder.fail("login")
+            return False
+        recorder.record("login", time.perf_counter() - started)
+        return True
+
+    async def close(self):
+        await self.chat.close()
+
+
+class LoadGenerator:
+    """
+    Drives simulated users against a running server. Users register and log in, then commands are started at a
+    fixed total rate (open loop, so a slow server builds a backlog rather than slowing the load), each from a
+    random user and chosen by the weighted mix. Latency is measured to the frame that completes each command:
+    the sender's own copy of a broadcast, the recipient's copy of a direct message, the reply to a friend
+    request or friend list, the invitee's copy of a tic tac toe invite and the opponent's next turn after a
+    move that does not end the game. Invitees accept every game, and each player answers their turn with a
+    random free square.
+    Attributes:
+        host (str): Server address.
+        port (int): Server port.
+        codec_name (str): Codec the users offer at login, ahead of json.
+        compress (bool): Whether the users offer compression on connecting.
+        users (list): The SimulatedUsers.
+        weights (dict): Command weights keyed by command name.
+        recorder (LatencyRecorder): Latencies and failures per command.
+        pending (dict): Start time of each command completed by a push, keyed by (command, token).
+    """
+
+    def __init__(self, host: str, port: int, users: int, mix: str = DEFAULT_MIX, codec_name: str = codec.BINARY.name,
+                 seed=None, prefix=None, compress: bool = False):
+        self.host = host
+        self.port = port
+        self.codec_name = codec_name
+        self.compress = compress
+        self.random = random.Random(seed)
+        prefix = prefix or f"lg{os.getpid()}x{int(time.time()) % 100000}u"
+        self.users = [SimulatedUser(self, f"{prefix}{number}") for number in range(users)]
+        self.weights = parse_mix(mix)
+        self.recorder = LatencyRecorder()
+        self.pending = {}
+        self.tokens = itertools.count()
+        self.tasks = set()
+        self.games_finished = 0
+
+    async def run(self, duration: float, rate: float):
+        """
+        Signs every user in, runs the command mix for duration seconds at rate commands per second, then prints
+        the report.
+        """
+        limit = asyncio.Semaphore(SIGN_IN_CONCURRENCY)
+
+        async def start(user):
+            async with limit:
+                return await user.sign_in(self.recorder)
+
+        started = time.perf_counter()
+        signed_in = await asyncio.gather(*(start(user) for user in self.users), return_exceptions=True)
+        self.users = [user for user, ok in zip(self.users, signed_in) if ok is True]
+        sign_in = time.perf_counter() - started
+        print(f"{len(self.users)} users signed in in {sign_in:.1f} s")
+        if len(self.users) < 2:
+            raise SystemExit("need at least two signed in users")
+        names, weights = zip(*self.weights.items())
+        started = time.perf_counter()
+        for number in itertools.count():
+            due = started + number / rate
+            if due - started >= duration:
+                break
+            await asyncio.sleep(max(due - time.perf_counter(), 0))
+            command = self.random.choices(names, weights)[0]
+            self.spawn(getattr(self, f"run_{command}")(self.random.choice(self.users)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(1)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for command, token in self.pending:
+            self.recorder.fail(command)
+        self.recorder.report(elapsed, {"register": sign_in, "login": sign_in})
+        print(f"tic tac toe games finished {self.games_finished}")
+        await asyncio.gather(*(user.close() for user in self.users))
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def timed(self, name, request):
+        """
+        Awaits a request, recording its latency. A request the server refuses still counts as answered.
+        """
+        started = time.perf_counter()
+        try:
+            await request
+        except chat_client.ChatError:
+            pass
+        except asyncio.TimeoutError:
+            self.recorder.fail(name)
+            return
+        self.recorder.record(name, time.perf_counter() - started)
+
+    def other_user(self, user):
+        other = self.random.choice(self.users)
+        while other is user:
+            other = self.random.choice(self.users)
+        return other
+
+    async def run_broadcast(self, user):
+        token = f"lg{next(self.tokens)}"
+        self.pending[("broadcast", token)] = time.perf_counter()
+        await user.chat.broadcast(token)
+
+    async def run_dm(self, user):
+        token = f"lg{next(self.tokens)}"
+        self.pending[("dm", token)] = time.perf_counter()
+        await user.chat.send_dm(self.other_user(user).username, token)
+
+    async def run_friend(self, user):
+        await self.timed("friend", user.chat.add_friend(self.other_user(user).username))
+
+    async def run_view_friends(self, user):
+        await self.timed("view_friends", user.chat.friends())
+
+    async def run_ttt(self, user):
+        invitee = self.other_user(user).username
+        self.pending[("ttt_invite", (user.username, invitee))] = time.perf_counter()
+        await user.chat.invite(invitee)
+
+    def complete(self, command, token):
+        started = self.pending.pop((command, token), None)
+        if started is not None:
+            self.recorder.record(command, time.perf_counter() - started)
+
+    def play_turn(self, user, data):
+        help_board, board, mark, game_id = data["extra_info"]
+        square = self.random.choice([square for square, value in board.items() if value == ' '])
+        if ttt_game.BitBoard.from_dict(board).play(mark, square) == ttt_game.PLAYING:
+            self.pending[("ttt_move", game_id)] = time.perf_counter()
+        self.spawn(user.chat.move(game_id, square, data["body"]))
+
+    def on_push(self, user, data):
+        """
+        Handles a push: completes the command it ends and answers game frames. Runs on the event loop, so
+        answers are sent from tasks.
+        """
+        header = data["header"]
+        if header == utility.Responses.BROADCAST_MSG.value and data["addressee"] == user.username:
+            self.complete("broadcast", data["body"])
+        elif header == utility.LoggedInCommands.PRINT_DM.value:
+            self.complete("dm", data["body"])
+        elif header == utility.Responses.TIC_TAC_TOE_REQUEST.value:
+            self.complete("ttt_invite", (data["addressee"], data["body"]))
+            self.spawn(user.chat.accept_game(data["addressee"], data["extra_info"]))
+        elif header == utility.Responses.PLAY_TIC_TAC_TOE.value:
+            self.complete("ttt_move", data["extra_info"][3])
+            self.play_turn(user, data)
+        elif header == utility.Responses.TIC_TAC_TOE_ERROR.value:
+            self.play_turn(user, data)
+        elif header in (utility.Responses.TIC_TAC_TOE_WINNER.value, utility.Responses.TIC_TAC_TOE_TIE.value):
+            self.games_finished += 1
+
+
+def start_server(host, port, engine, directory):
+    """
+    Starts a server process with a fresh database and waits until it accepts connections.
+
+    :param engine: 'threaded' for server.Server or 'async' for async_server.AsyncServer.
+    :param directory: Directory the server process runs in, where it creates its database.
+    :return: The server process.
+    """
+    engine_class = "server.Server" if engine == "threaded" else "async_server.AsyncServer"
+    package = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, "-c", f"import server, async_server; {engine_class}"
+                                f"({host!r}, {port}).run()"], cwd=directory,
+                               env=dict(os.environ, PYTHONPATH=package), stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process
+        except socket.error:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit(f"server did not start on {host}:{port}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated users generating load against a chat server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--users", type=int, default=200, help="simulated users, each on its own connection")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load after signing in")
+    parser.add_argument("--rate", type=float, default=500, help="commands started per second, over all users")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"command weights, from {', '.join(COMMANDS)}")
+    parser.add_argument("--codec", default=codec.BINARY.name, choices=sorted(codec.CODECS))
+    parser.add_argument("--compress", action="store_true", help="offer compression on connecting")
+    parser.add_argument("--seed", type=int, help="random seed, for repeatable runs")
+    parser.add_argument("--prefix", help="username prefix; reuse one to skip registering users again")
+    parser.add_argument("--serve", choices=("threaded", "async"),
+                        help="start a server with a fresh database on --host/--port for the run")
+    args = parser.parse_args(argv)
+    async_server.raise_open_file_limit()
+    with tempfile.TemporaryDirectory(prefix="tcpchat-loadgen-") as directory:
+        process = start_server(args.host, args.port, args.serve, directory) if args.serve else None
+        try:
+            generator = LoadGenerator(args.host, args.port, args.users, args.mix, args.codec, args.seed,
+                                      args.prefix, args.compress)
+            asyncio.run(generator.run(args.duration, args.rate))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == '__main__':
+    """
+    Runs the load generator with the options given on the command line.
+    """
+    main()
@@ -0,0 +1,269 @@
+import bisect
+import functools
+import http.server
+import inspect
+import threading
+import time
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    """
+    A monotonically increasing count.
+    Attributes:
+        name (str): Metric name.
+        description (str): One line description of the metric.
+        labels (dict): Label values distinguishing this metric from others with the same name.
+        value (float): Current count.
+    """
+    kind = "counter"
+
+    def __init__(self, name, description, labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    """
+    A value that goes up and down, such as open connections. Either set directly, or read from function each
+    time the metrics are rendered so the hot path pays nothing.
+    Attributes:
+        name (str): Metric name.
+        description (str): One line description of the metric.
+        labels (dict): Label values distinguishing this metric from others with the same name.
+        function (callable): Returns the current value, or None for a gauge that is set directly.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=None, function=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.function = function
+        self.current = 0
+        self.lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self.current
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.current += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.current = value
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Histogram:
+    """
+    Counts observations (usually latencies in seconds) into fixed buckets, rendered as cumulative buckets.
+    Attributes:
+        name (str): Metric name.
+        description (str): One line description of the metric.
+        labels (dict): Label values distinguishing this metric from others with the same name.
+        buckets (tuple): Upper bounds of the buckets, ascending.
+        counts (list): Observations per bucket, with a final overflow bucket.
+        sum (float): Sum of all observations.
+        count (int): Number of observations.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, observed in zip(self.buckets + (float("inf"),), counts):
+            cumulative += observed
+            yield f"{self.name}_bucket", dict(self.labels, le="+Inf" if bound == float("inf") else repr(bound)), \
+                cumulative
+        yield f"{self.name}_sum", self.labels, total
+        yield f"{self.name}_count", self.labels, count
+
+
+class Registry:
+    """
+    Holds every metric created by the server, keyed by name and labels. Asking for an existing metric returns
+    it, so modules can declare the metrics they use independently. Instrumentation that times the hot paths
+    (message handlers, sends, db calls) checks enabled first, so turning it off leaves a single attribute read.
+    Attributes:
+        enabled (bool): Whether timing instrumentation records observations.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.enabled = True
+        self.lock = threading.Lock()
+
+    def get_or_create(self, metric_type, name, description, labels=None, **options):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            if key not in self.metrics:
+                self.metrics[key] = metric_type(name, description, labels, **options)
+            return self.metrics[key]
+
+    def render(self):
+        """
+        :return: Every metric in the Prometheus text exposition format.
+        """
+        families = {}
+        with self.lock:
+            for metric in self.metrics.values():
+                families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, family in families.items():
+            lines.append(f"# HELP {name} {family[0].description}")
+            lines.append(f"# TYPE {name} {family[0].kind}")
+            for metric in family:
+                for sample, labels, value in metric.samples():
+                    lines.append(f"{sample}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def counter(name, description, labels=None):
+    return REGISTRY.get_or_create(Counter, name, description, labels)
+
+
+def gauge(name, description, labels=None, function=None):
+    """
+    :param function: Returns the gauge's value; replaces that of an existing gauge, so the latest owner wins.
+    """
+    metric = REGISTRY.get_or_create(Gauge, name, description, labels, function=function)
+    if function is not None:
+        metric.function = function
+    return metric
+
+
+def histogram(name, description, labels=None, buckets=LATENCY_BUCKETS):
+    return REGISTRY.get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+
+def enabled():
+    return REGISTRY.enabled
+
+
+def set_enabled(value: bool):
+    """
+    Turns the timing instrumentation on or off. Counters and gauges the server relies on keep counting.
+    """
+    REGISTRY.enabled = value
+
+
+def render():
+    return REGISTRY.render()
+
+
+def instrument(name, description, label, exclude=()):
+    """
+    Class decorator timing every public method of a class into a histogram labelled with the method name.
+    Static and class methods, properties and names starting with an underscore are left alone. While
+    instrumentation is disabled a wrapped call costs one extra function call and an attribute read.
+
+    :param name: Histogram name.
+    :param description: One line description of the histogram.
+    :param label: Label holding the method name.
+    :param exclude: Names of further methods to leave alone, such as thread loops.
+    """
+    def decorate(cls):
+        for method_name, method in list(vars(cls).items()):
+            if method_name.startswith("_") or method_name in exclude or not inspect.isfunction(method):
+                continue
+            setattr(cls, method_name, timed(method, histogram(name, description, {label: method_name})))
+        return cls
+
+    return decorate
+
+
+def timed(function, latency):
+    """
+    Wraps a function so each call is observed by the latency histogram while instrumentation is enabled.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not REGISTRY.enabled:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            latency.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers GET /metrics with the rendered registry.
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str, port: int):
+    """
+    Serves the Prometheus endpoint at http://host:port/metrics from a daemon thread.
+
+    :return: The HTTP server, so the caller can shut it down.
+    """
+    endpoint = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    endpoint.daemon_threads = True
+    threading.Thread(target=endpoint.serve_forever, daemon=True, name="metrics-http").start()
+    return endpoint
@@ -0,0 +1,83 @@
+import collections
+import logging
+
+Migration = collections.namedtuple("Migration", ["version", "description", "statements"])
+
+MIGRATIONS = (
+    Migration(1, "create users, friends, messages and ttt tables", (
+        "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, "
+        "username TEXT, password TEXT, user_status TEXT)",
+        "CREATE TABLE IF NOT EXISTS friends (id INTEGER PRIMARY KEY, "
+        "sender TEXT, receiver TEXT, status TEXT)",
+        "CREATE TABLE IF NOT EXISTS messages (message_id INTEGER PRIMARY KEY, "
+        "sender TEXT, receiver TEXT, message TEXT, timestamp TEXT, "
+        "friend_id INTEGER, FOREIGN KEY (friend_id) REFERENCES friends(id))",
+        "CREATE TABLE IF NOT EXISTS ttt (game_id INTEGER PRIMARY KEY,"
+        " sender TEXT, receiver TEXT, status TEXT, timestamp TEXT,"
+        " friend_id INTEGER, FOREIGN KEY (friend_id) REFERENCES friends(id))",
+    )),
+    Migration(2, "index hot lookups and make usernames unique", (
+        # Registration used to allow duplicate usernames; keep the first account, which is the one every
+        # lookup by username already resolved to.
+        "DELETE FROM users WHERE user_id NOT IN (SELECT MIN(user_id) FROM users GROUP BY username)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username)",
+        "CREATE INDEX IF NOT EXISTS friends_sender_receiver_status ON friends (sender, receiver, status)",
+        "CREATE INDEX IF NOT EXISTS friends_receiver_status ON friends (receiver, status)",
+        "CREATE INDEX IF NOT EXISTS messages_sender_receiver_timestamp ON messages (sender, receiver, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ttt_receiver_status ON ttt (receiver, status)",
+    )),
+    Migration(3, "conversation keys and integer timestamps for paginated message history", (
+        "ALTER TABLE messages ADD COLUMN conversation TEXT",
+        "ALTER TABLE messages ADD COLUMN created_at INTEGER",
+        "UPDATE messages SET conversation = MIN(CAST(sender AS INTEGER), CAST(receiver AS INTEGER)) || ':' || "
+        "MAX(CAST(sender AS INTEGER), CAST(receiver AS INTEGER)), "
+        "created_at = CAST(strftime('%s', timestamp) AS INTEGER) * 1000000",
+        "CREATE INDEX IF NOT EXISTS messages_conversation_id ON messages (conversation, message_id)",
+    )),
+    Migration(4, "offline inbox of direct messages awaiting delivery", (
+        "CREATE TABLE IF NOT EXISTS inbox (inbox_id INTEGER PRIMARY KEY, recipient INTEGER, sender TEXT, "
+        "message TEXT, created_at INTEGER)",
+        "CREATE INDEX IF NOT EXISTS inbox_recipient_id ON inbox (recipient, inbox_id)",
+    )),
+    Migration(5, "chat rooms and their members", (
+        "CREATE TABLE IF NOT EXISTS rooms (room_id INTEGER PRIMARY KEY, name TEXT, owner INTEGER, "
+        "created_at INTEGER)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS rooms_name ON rooms (name)",
+        "CREATE TABLE IF NOT EXISTS room_members (room_id INTEGER, user_id INTEGER, "
+        "PRIMARY KEY (room_id, user_id)) WITHOUT ROWID",
+    )),
+)
+
+
+def current_version(cursor):
+    """
+    :param cursor: Cursor on the database.
+    :return: Highest migration version applied to the database, 0 for a new database.
+    """
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, "
+                   "description TEXT, applied TEXT DEFAULT CURRENT_TIMESTAMP)")
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def migrate(cursor, migrations=MIGRATIONS):
+    """
+    Applies, in version order, every migration newer than the database's schema version and records each one
+    in the schema_version table. Runs inside the caller's transaction, so either all pending migrations are
+    applied or none are.
+
+    :param cursor: Cursor on the database, inside a transaction.
+    :param migrations: Migrations to apply, ordered by version.
+    :return: Schema version of the database afterwards.
+    """
+    version = current_version(cursor)
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        logging.info(f" Applying db migration {migration.version}: {migration.description}")
+        for statement in migration.statements:
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                       (migration.version, migration.description))
+        version = migration.version
+    return version
@@ -0,0 +1,93 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+import bcrypt
+
+import metrics
+
+POOL_WORKERS = os.cpu_count()
+MAX_PENDING = 4 * POOL_WORKERS
+
+
+class HasherBusy(Exception):
+    """
+    Raised when the password pool already has MAX_PENDING jobs queued or running.
+    """
+
+
+def hash_password_task(password):
+    started = time.monotonic()
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt())
+    return hashed, started, time.monotonic()
+
+
+def check_password_task(password, hashed):
+    started = time.monotonic()
+    matches = bcrypt.checkpw(password, hashed)
+    return matches, started, time.monotonic()
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a bounded process pool, so a login surge uses every core instead of
+    serialising on the GIL inside connection handlers. Once max_pending jobs are in flight new requests are
+    refused immediately with HasherBusy rather than queued. Records hash latency and queue wait.
+    Attributes:
+        pool (ProcessPoolExecutor): Worker processes running bcrypt.
+        pending (BoundedSemaphore): Slots for jobs queued or running in the pool.
+    """
+
+    def __init__(self, workers: int = POOL_WORKERS, max_pending: int = MAX_PENDING):
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                           mp_context=multiprocessing.get_context("spawn"))
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.hash_latency = metrics.histogram("password_hash_seconds",
+                                              "Time spent in bcrypt per hash or check.")
+        self.queue_wait = metrics.histogram("password_queue_wait_seconds",
+                                            "Time password jobs waited for a pool worker.")
+        self.rejected = metrics.counter("password_busy_total",
+                                        "Password jobs refused because the pool queue was full.")
+
+    def run(self, task, *args):
+        """
+        Submits a task to the pool and waits for its result, recording metrics.
+
+        :raises HasherBusy: If the pool has no free slots.
+        """
+        if not self.pending.acquire(blocking=False):
+            self.rejected.inc()
+            raise HasherBusy("Password pool is busy")
+        try:
+            submitted = time.monotonic()
+            result, started, finished = self.pool.submit(task, *args).result()
+        finally:
+            self.pending.release()
+        self.queue_wait.observe(max(started - submitted, 0.0))
+        self.hash_latency.observe(finished - started)
+        return result
+
+    def hash_password(self, password):
+        """
+        :param password: Password bytes.
+        :return: Salted bcrypt hash.
+        """
+        return self.run(hash_password_task, password)
+
+    def check_password(self, password, hashed):
+        """
+        :param password: Password bytes given by the client.
+        :param hashed: bcrypt hash stored in the db.
+        :return: True if the password matches.
+        """
+        return self.run(check_password_task, password, hashed)
+
+    def shutdown(self):
+        """
+        Cancels queued jobs and waits for the pool processes to exit. Waiting matters in a cluster worker, whose
+        multiprocessing exit handler would otherwise close the pool's call queue before the stop sentinels reach
+        the pool processes, and then wait on them forever.
+        """
+        self.pool.shutdown(wait=True, cancel_futures=True)
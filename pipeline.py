@@ -0,0 +1,124 @@
+import logging
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+import metrics
+
+SYNC = "sync"
+WRITE_BEHIND = "write_behind"
+DURABILITY_LEVELS = (SYNC, WRITE_BEHIND)
+MAX_PENDING_MESSAGES = 10000
+MAX_BATCH_SIZE = 500
+
+
+class MessagePipeline:
+    """
+    Persists direct messages for the server at one of two durability levels. SYNC inserts each message and waits
+    for its commit, so a delivered message is always on disk. WRITE_BEHIND queues the message and returns at once,
+    so the server delivers first; a background thread resolves the users and inserts everything queued as one
+    multi-row write, and a crash can lose at most the messages still queued. The queue is bounded: once
+    max_pending messages are waiting, submit blocks the sending client's handler until the pipeline catches up.
+    Attributes:
+        db (Database): Database the messages are written to.
+        durability (str): SYNC or WRITE_BEHIND.
+        queue (Queue): (requester, recipient, message, sent) tuples waiting to be persisted.
+        max_batch_size (int): Most messages inserted in one write.
+    """
+
+    def __init__(self, db, durability: str = WRITE_BEHIND, max_pending: int = MAX_PENDING_MESSAGES,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.db = db
+        self.durability = durability
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.max_batch_size = max_batch_size
+        self.persist_latency = metrics.histogram("dm_persist_seconds",
+                                                 "Time from a direct message being sent to its commit.")
+        self.backpressure = metrics.counter("dm_pipeline_full_total",
+                                            "Direct messages that waited for space in the pipeline queue.")
+        self.writer = threading.Thread(target=self.persist_loop, daemon=True, name="dm-pipeline")
+        self.writer.start()
+
+    def submit(self, requester, recipient, message):
+        """
+        Records a direct message. With SYNC durability returns once it is committed; with WRITE_BEHIND once it
+        is queued.
+
+        :param requester: Username of the sender.
+        :param recipient: Username of the recipient.
+        :param message: The message text.
+        """
+        sent = datetime.now()
+        if self.durability == SYNC:
+            self.db.insert_messages([(requester, recipient, message, sent)]).result()
+            self.persist_latency.observe((datetime.now() - sent).total_seconds())
+            return
+        item = (requester, recipient, message, sent)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.backpressure.inc()
+            self.queue.put(item)
+
+    def persist_loop(self):
+        """
+        Pipeline thread. Takes everything queued, up to max_batch_size messages, and inserts it as one write,
+        waiting for the commit before taking the next batch so batches grow with the load. Messages between users
+        that do not exist are dropped by the db on their own; if the write still fails, the batch is retried one
+        message at a time so only the messages that cannot be written are lost. Flush markers (Events) are set
+        once every message queued before them is committed. Stops at None.
+        """
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            messages = [item for item in batch if isinstance(item, tuple)]
+            if messages:
+                try:
+                    self.db.insert_messages(messages).result()
+                except sqlite3.Error:
+                    self.persist_each(messages)
+                committed = datetime.now()
+                for requester, recipient, message, sent in messages:
+                    self.persist_latency.observe((committed - sent).total_seconds())
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is None:
+                    running = False
+
+    def persist_each(self, messages):
+        """
+        Inserts messages one write each, after the batch holding them failed, logging those that still fail.
+
+        :param messages: (requester, recipient, message, sent) tuples.
+        """
+        for requester, recipient, message, sent in messages:
+            try:
+                self.db.insert_messages([(requester, recipient, message, sent)]).result()
+            except sqlite3.Error as e:
+                logging.error(f" Could not persist direct message from {requester} to {recipient}: {e}")
+
+    def flush(self):
+        """
+        Waits until every message submitted so far has been committed.
+        """
+        if self.durability == SYNC:
+            return
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait()
+
+    def close(self):
+        """
+        Commits every queued message and stops the pipeline thread.
+        """
+        self.queue.put(None)
+        self.writer.join()
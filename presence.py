@@ -0,0 +1,98 @@
+import threading
+
+import metrics
+import utility
+
+ONLINE = "ONLINE"
+AWAY = "AWAY"
+OFFLINE = "OFFLINE"
+CLIENT_STATUSES = (ONLINE, AWAY)
+
+
+class PresenceService:
+    """
+    Keeps the status of every user logged in to this server, and the friends of each, in memory. Status changes
+    are pushed as PRESENCE_NOTIFICATION messages only to the user's friends who are online, found by
+    intersecting the friend set with the connected users, and the db user_status column is written without
+    waiting for the commit. Friend lists are served from memory too, reading the db only for friends who are not
+    logged in here. Clients may only set CLIENT_STATUSES; OFFLINE is set when they quit or disconnect.
+    Attributes:
+        server (Server): The chat server whose clients are notified.
+        statuses (dict): Status of each user logged in to this server, keyed by username.
+        friends (dict): Set of friend usernames of each user logged in to this server.
+    """
+
+    def __init__(self, chat_server):
+        self.server = chat_server
+        self.statuses = {}
+        self.friends = {}
+        self.lock = threading.Lock()
+        self.notifications = metrics.counter("presence_notifications_total",
+                                             "Presence changes pushed to online friends.")
+
+    def go_online(self, username):
+        """
+        Loads the friends of a user who has just logged in, marks them ONLINE and tells their online friends.
+        """
+        friends = set(self.server.db.view_friends(username))
+        with self.lock:
+            self.friends[username] = friends
+        self.set_status(username, ONLINE)
+
+    def go_offline(self, username):
+        """
+        Marks a user who has quit or disconnected OFFLINE, tells their online friends and forgets them.
+        """
+        self.set_status(username, OFFLINE)
+        with self.lock:
+            self.statuses.pop(username, None)
+            self.friends.pop(username, None)
+
+    def set_status(self, username, status):
+        """
+        Records a user's new status in memory, queues the db write and notifies their online friends.
+
+        :param username: Username of the user.
+        :param status: ONLINE, AWAY or OFFLINE.
+        """
+        with self.lock:
+            if status != OFFLINE:
+                self.statuses[username] = status
+            friends = self.friends.get(username, set())
+        # Intersects from the (small) friend set side so the clients dict, which other threads mutate, is only
+        # probed, never iterated.
+        clients = self.server.clients
+        recipients = {friend for friend in friends if friend in clients}
+        self.server.db.set_status(status, username)
+        notification = self.server.build_message(utility.Responses.PRESENCE_NOTIFICATION.value, username,
+                                                 status, None)
+        for friend in recipients:
+            client_socket = self.server.clients.get(friend)
+            if client_socket is not None:
+                self.server.server_send(client_socket, notification)
+        self.notifications.inc(len(recipients))
+
+    def add_friendship(self, first, second):
+        """
+        Records a new friendship between two users in the friend sets of whichever of them is logged in here.
+        """
+        with self.lock:
+            if first in self.friends:
+                self.friends[first].add(second)
+            if second in self.friends:
+                self.friends[second].add(first)
+
+    def friend_statuses(self, username):
+        """
+        Lists the friends of a user logged in to this server with their status. Friends logged in here are given
+        their in-memory status; the others, offline or in a cluster logged in to another worker, the status in
+        the db users table.
+
+        :param username: Username of the user.
+        :return: List of (username, status) of each friend, by username.
+        """
+        with self.lock:
+            friends = sorted(self.friends.get(username, ()))
+            statuses = {friend: self.statuses[friend] for friend in friends if friend in self.statuses}
+        statuses.update(self.server.db.find_statuses([friend for friend in friends if friend not in statuses]))
+        return [(friend, statuses[friend]) for friend in friends if friend in statuses]
@@ -0,0 +1,77 @@
+import struct
+
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+class ProtocolError(ValueError):
+    """
+    Raised when a peer sends a frame that breaks the wire protocol.
+    """
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """
+    Prefixes the payload with its length as a 4 byte big-endian unsigned integer.
+
+    :param payload: Encoded message bytes.
+    :return: The complete frame, ready for sendall.
+    """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds maximum of {MAX_FRAME_SIZE}")
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """
+    Incremental decoder for length-prefixed frames. Bytes received from the socket are appended to a single
+    reusable buffer, and complete frames are sliced out of it as they become available, so messages split
+    across reads (including multibyte characters) or coalesced into one read are reassembled correctly.
+    Attributes:
+        buffer (bytearray): Received bytes not yet consumed.
+        offset (int): Position of the first unconsumed byte in the buffer.
+        max_frame_size (int): Largest payload accepted before the peer is considered broken.
+    """
+
+    def __init__(self, max_frame_size: int = MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.offset = 0
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """
+        Appends bytes received from the peer to the buffer.
+
+        :param data: Bytes received from the socket.
+        """
+        if self.offset and self.offset >= len(self.buffer) // 2:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        self.buffer += data
+
+    def next_frame(self):
+        """
+        Removes and returns the next complete frame payload.
+
+        :return: Payload bytes, or None if no complete frame has been received yet.
+        """
+        available = len(self.buffer) - self.offset
+        if available < HEADER.size:
+            return None
+        (length,) = HEADER.unpack_from(self.buffer, self.offset)
+        if length > self.max_frame_size:
+            raise ProtocolError(f"Frame of {length} bytes exceeds maximum of {self.max_frame_size}")
+        if available < HEADER.size + length:
+            return None
+        start = self.offset + HEADER.size
+        self.offset = start + length
+        return bytes(self.buffer[start:self.offset])
+
+    def frames(self):
+        """
+        Yields every complete frame payload currently buffered.
+        """
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
@@ -0,0 +1,145 @@
+import collections
+import threading
+
+import metrics
+
+HISTORY_SIZE = 50
+MAX_NAME_LENGTH = 32
+
+
+class Room:
+    """
+    A named chat room. Members stay members while offline; posts reach the members who are online.
+    Attributes:
+        room_id (int): Id of the room's row in the rooms table.
+        name (str): Name of the room.
+        members (set): Usernames of the members.
+        history (deque): The latest HISTORY_SIZE posts as [sender, message, created_at] lists, oldest first.
+    """
+
+    def __init__(self, room_id, name, history_size=HISTORY_SIZE):
+        self.room_id = room_id
+        self.name = name
+        self.members = set()
+        self.history = collections.deque(maxlen=history_size)
+
+
+class RoomRegistry:
+    """
+    Every room, keyed by name, with an index of the rooms each user is in. Posting to a room reads only its own
+    member set, so its cost grows with the room rather than with every connected user. The rooms and room_members
+    tables are the durable copy of the rooms and their members, loaded at startup; history is kept only here.
+    Attributes:
+        rooms (dict): Room keyed by name.
+        memberships (dict): Set of the names of the rooms each user is in, keyed by username.
+        history_size (int): Posts kept in each room's history.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.rooms = {}
+        self.memberships = {}
+        self.history_size = history_size
+        self.lock = threading.Lock()
+        self.posts = metrics.counter("room_posts_total", "Messages posted to rooms.")
+        metrics.gauge("rooms", "Chat rooms.", function=lambda: len(self.rooms))
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def load(self, rooms, members):
+        """
+        Rebuilds the registry from the db.
+
+        :param rooms: (room_id, name) of each room.
+        :param members: (room_id, username) of each membership.
+        """
+        with self.lock:
+            self.rooms.clear()
+            self.memberships.clear()
+            names = {}
+            for room_id, name in rooms:
+                self.rooms[name] = Room(room_id, name, self.history_size)
+                names[room_id] = name
+            for room_id, username in members:
+                if room_id in names:
+                    self.add_member(self.rooms[names[room_id]], username)
+
+    def add_member(self, room, username):
+        """
+        Adds a member to a room and the membership index. Caller holds the lock.
+        """
+        room.members.add(username)
+        self.memberships.setdefault(username, set()).add(room.name)
+
+    def create(self, room_id, name, owner):
+        """
+        Adds a room committed to the db, with its owner as the first member.
+
+        :return: The Room, or None if a room with the name already exists.
+        """
+        with self.lock:
+            if name in self.rooms:
+                return None
+            room = self.rooms[name] = Room(room_id, name, self.history_size)
+            self.add_member(room, owner)
+        return room
+
+    def get(self, name):
+        return self.rooms.get(name)
+
+    def join(self, name, username):
+        """
+        :return: The Room, or None if there is no room with the name.
+        """
+        with self.lock:
+            room = self.rooms.get(name)
+            if room is not None:
+                self.add_member(room, username)
+        return room
+
+    def leave(self, name, username):
+        """
+        :return: The Room, or None if the user is not a member of a room with the name.
+        """
+        with self.lock:
+            room = self.rooms.get(name)
+            if room is None or username not in room.members:
+                return None
+            room.members.discard(username)
+            names = self.memberships.get(username)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.memberships[username]
+        return room
+
+    def post(self, name, sender, message, created_at):
+        """
+        Records a post in a room's history.
+
+        :return: List of the room's members to deliver the post to, or None if the sender is not a member.
+        """
+        with self.lock:
+            room = self.rooms.get(name)
+            if room is None or sender not in room.members:
+                return None
+            room.history.append([sender, message, created_at])
+            members = list(room.members)
+        self.posts.inc()
+        return members
+
+    def history(self, name):
+        """
+        :return: List of the room's latest posts as [sender, message, created_at] lists, oldest first.
+        """
+        with self.lock:
+            room = self.rooms.get(name)
+            return list(room.history) if room is not None else []
+
+    def listing(self, username):
+        """
+        :return: List of [name, member count, whether the user is a member] of every room, by name.
+        """
+        with self.lock:
+            joined = self.memberships.get(username, ())
+            return [[name, len(room.members), name in joined] for name, room in sorted(self.rooms.items())]
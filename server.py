@@ -1,16 +1,32 @@
-import bcrypt
-import json
+import collections
 import logging
 import socket
+import sqlite3
 import threading
+import time
 
+import codec
+import compression
+import connection
 import database
+import games
+import metrics
+import passwords
+import pipeline
+import presence
+import protocol
+import rooms
 import ttt_game
 import utility
 
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
 ENCODE = "utf-8"
 BUFFER_SIZE = 2048
+INBOX_FRAME_SIZE = 100
+HEARTBEAT_INTERVAL = 30.0
+IDLE_TIMEOUT = 90.0
+
+Handler = collections.namedtuple("Handler", ["function", "requires_auth", "closes_connection"])
 
 
 class Server:
@@ -20,34 +36,154 @@ class Server:
         host (str): The IP address of the listening socket.
         port (int): The port number of the listening socket.
         clients (dict): a client dictionary that stores client socket address and username.
+        sessions (dict): Logged in usernames keyed by client socket, used for handler auth checks.
+        handlers (dict): Dispatch table of Handler entries keyed by header opcode.
+        outbound_queue_size (int): Maximum frames queued per client before the slow consumer policy applies.
+        slow_consumer_policy (str): connection.DROP or connection.DISCONNECT.
+        reuse_port (bool): Bind with SO_REUSEPORT so several worker processes can share the port.
+        bus (MessageBus): Cluster message bus when running as a cluster worker, else None.
         db (database): Instance attribute of the database class.
+        hasher (PasswordHasher): Process pool running bcrypt work.
+        dm_durability (str): pipeline.SYNC to persist direct messages before delivering them, or
+            pipeline.WRITE_BEHIND to deliver first and persist in batches.
+        messages (MessagePipeline): Persists direct messages at the dm_durability level.
+        metrics_port (int): Local port serving the Prometheus metrics endpoint, or None for no endpoint.
+        admins (set): Usernames allowed to run STATS once logged in. Anyone else reads the metrics endpoint.
+        handler_latency (dict): Handler latency histogram of each header opcode.
+        replying (local): Per handler thread, the (client_socket, request_id) of the request being handled, if it
+            carried a request id.
+        heartbeat_interval (float): Seconds a connection may be silent before it is sent a PING.
+        idle_timeout (float): Seconds a connection may be silent before it is reaped as dead.
+        open_connections (set): Every open client connection, logged in or not, checked by the reaper.
+        rooms (RoomRegistry): Chat rooms, their members and recent history.
+        compression_threshold (int): Smallest payload compressed on connections that negotiate compression, or
+            None to refuse compression.
     """
 
     @staticmethod
-    def recv_message(client_socket):
+    def recv_message(client_socket, decoder):
         """
-        Receives messages from client sockets.
-        Receives 2048 bytes of data and decodes using 'utf-8'.
+        Receives the next message from a client socket.
+        Reads 2048 bytes at a time into the connection's frame decoder until a whole frame is buffered,
+        then returns the frame payload for the codec module to decode.
+
+        :param client_socket: Socket of connected client.
+        :param decoder: The connection's protocol.FrameDecoder.
         """
-        return client_socket.recv(BUFFER_SIZE).decode(ENCODE)
+        frame = decoder.next_frame()
+        while frame is None:
+            data = client_socket.recv(BUFFER_SIZE)
+            if not data:
+                raise ConnectionResetError("Connection closed by client")
+            decoder.feed(data)
+            frame = decoder.next_frame()
+        return frame
 
-    def __init__(self, host: str, port: int):
-        self.recipient = None
-        self.requester = None
+    def __init__(self, host: str, port: int, outbound_queue_size: int = connection.OUTBOUND_QUEUE_SIZE,
+                 slow_consumer_policy: str = connection.DROP, dm_durability: str = pipeline.WRITE_BEHIND,
+                 metrics_port: int = None, admins=(), heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 idle_timeout: float = IDLE_TIMEOUT, compression_threshold: int = compression.THRESHOLD):
         self.host = host
         self.port = port
         self.clients = {}
+        self.sessions = {}
+        self.handlers = self.build_handlers()
+        self.outbound_queue_size = outbound_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.dm_durability = dm_durability
+        self.reuse_port = False
+        self.bus = None
         self.db = None
+        self.hasher = None
+        self.messages = None
+        self.presence = presence.PresenceService(self)
+        self.games = games.GameRegistry()
+        self.rooms = rooms.RoomRegistry()
+        self.compression_threshold = compression_threshold
+        self.offline_queued = metrics.counter("offline_messages_queued_total",
+                                              "Direct messages stored for offline recipients.")
+        self.offline_delivered = metrics.counter("offline_messages_delivered_total",
+                                                 "Stored direct messages delivered when the recipient logged in.")
+        self.inbox_full = metrics.counter("offline_inbox_full_total",
+                                          "Direct messages refused because the recipient's inbox was full.")
+        self.replying = threading.local()
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.open_connections = set()
+        self.reaper_stop = threading.Event()
+        self.reaped = metrics.counter("chat_connections_reaped_total",
+                                      "Connections closed by the reaper because they were silent or already closing.")
+        self.pings = metrics.counter("chat_pings_sent_total", "PINGs sent to silent connections.")
+        self.metrics_port = metrics_port
+        self.metrics_endpoint = None
+        self.admins = set(admins)
+        self.handler_latency = {header: metrics.histogram("chat_handler_seconds", "Time to handle each command.",
+                                                          {"command": header.name})
+                                for header in self.handlers}
+        self.unknown_headers = metrics.counter("chat_unknown_headers_total", "Messages with an unknown header.")
+        self.handler_errors = metrics.counter("chat_handler_errors_total", "Messages whose handler failed.")
+        self.send_latency = metrics.histogram("chat_send_seconds", "Time to encode and queue a frame for a client.")
+        self.frames_sent = metrics.counter("chat_frames_sent_total", "Frames queued for clients.")
+        self.bytes_sent = metrics.counter("chat_bytes_sent_total", "Bytes of frames queued for clients.")
+        self.frames_failed = metrics.counter("chat_frames_failed_total",
+                                             "Frames refused because the client connection was closed or full.")
+        self.connections = metrics.gauge("chat_connections_open", "Client connections open.")
+        metrics.gauge("chat_sessions", "Logged in connections on this server.", function=lambda: len(self.sessions))
+        metrics.gauge("chat_clients_online", "Users online, on this server or, in a cluster, any worker.",
+                      function=lambda: len(self.clients))
+        metrics.gauge("ttt_games_in_progress", "Tic tac toe games held by this server.",
+                      function=lambda: len(self.games))
+
+    def build_handlers(self):
+        """
+        Builds the dispatch table once at startup. Maps each header opcode the server accepts to the handler
+        method run for it, whether the client must be logged in first and whether the connection ends afterwards.
+        Every handler takes (client_socket, data).
+
+        :return: Dictionary of Handler tuples keyed by utility header enums.
+        """
+        return {
+            utility.LoginCommands.LOGIN: Handler(self.login, False, False),
+            utility.LoginCommands.REGISTER: Handler(self.register, False, False),
+            utility.LoginCommands.COMPRESS: Handler(self.compress, False, False),
+            utility.LoggedInCommands.BROADCAST: Handler(self.broadcast, True, False),
+            utility.LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE: Handler(self.authenticate_direct_message,
+                                                                          True, False),
+            utility.LoggedInCommands.DIRECT_MESSAGE: Handler(self.direct_message, True, False),
+            utility.LoggedInCommands.ADD_FRIEND: Handler(self.friend_request, True, False),
+            utility.LoggedInCommands.VIEW_FRIEND_REQUESTS: Handler(self.view_friend_requests, True, False),
+            utility.LoggedInCommands.VIEW_FRIENDS: Handler(self.view_friends, True, False),
+            utility.LoggedInCommands.AUTH_TIC_TAC_TOE: Handler(self.authenticate_tic_tac_toe, True, False),
+            utility.LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS: Handler(self.view_ttt_requests, True, False),
+            utility.Responses.TIC_TAC_TOE_CONFIRM: Handler(self.confirm_tic_tac_toe, True, False),
+            utility.Responses.PLAY_TIC_TAC_TOE: Handler(self.play_tic_tac_toe, True, False),
+            utility.Responses.TIC_TAC_TOE_ERROR: Handler(self.play_tic_tac_toe, True, False),
+            utility.Responses.TIC_TAC_TOE_DENY: Handler(self.deny_tic_tac_toe, True, False),
+            utility.LoggedInCommands.SET_STATUS_AWAY: Handler(self.set_status, True, False),
+            utility.LoggedInCommands.QUIT: Handler(self.quit, True, True),
+            utility.LoggedInCommands.FETCH_HISTORY: Handler(self.fetch_history, True, False),
+            utility.LoggedInCommands.STATS: Handler(self.stats, True, False),
+            utility.LoggedInCommands.CREATE_ROOM: Handler(self.create_room, True, False),
+            utility.LoggedInCommands.JOIN_ROOM: Handler(self.join_room, True, False),
+            utility.LoggedInCommands.LEAVE_ROOM: Handler(self.leave_room, True, False),
+            utility.LoggedInCommands.LIST_ROOMS: Handler(self.list_rooms, True, False),
+            utility.LoggedInCommands.POST_ROOM: Handler(self.post_room, True, False),
+            utility.Heartbeats.PING: Handler(self.ping, False, False),
+            utility.Heartbeats.PONG: Handler(self.pong, False, False),
+        }
 
     def run(self):
         """
         Creates the listening socket.
         Binds server to host IP and port.
         Starts server socket listening for client sockets.
-        Creates an instance of the database and all tables.
+        Creates an instance of the database and all tables, and the password pool. Flushes queued direct messages
+        and closes the database when the server stops.
         """
         logging.info(" Creating socket...")
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         logging.info(" Socket created")
         try:
             logging.debug(f" Binding server socket to {self.host} : {self.port}...")
@@ -56,22 +192,62 @@ class Server:
         except socket.error as e:
             logging.error(e)
         logging.info(f" Server is listening on port {self.port}...")
-        self.db = database.Database()
+        self.open_resources()
         server_socket.listen()
-        while True:
-            self.accept_connection(server_socket)
+        try:
+            while True:
+                self.accept_connection(server_socket)
+        finally:
+            self.close_resources()
+
+    def open_resources(self):
+        """
+        Creates an instance of the database and all tables, and starts the password pool, the direct message
+        pipeline, the reaper and, if a metrics port is set, the metrics endpoint on the loopback interface. A
+        cluster worker joins the message bus last, so envelopes from other workers find everything open.
+        """
+        self.db = database.Database()
+        self.hasher = passwords.PasswordHasher()
+        self.messages = pipeline.MessagePipeline(self.db, self.dm_durability)
+        self.rooms.load(*self.db.load_rooms())
+        threading.Thread(target=self.reap_loop, daemon=True, name="reaper").start()
+        if self.metrics_port is not None:
+            self.metrics_endpoint = metrics.serve("127.0.0.1", self.metrics_port)
+            logging.info(f" Serving metrics on http://127.0.0.1:{self.metrics_port}/metrics")
+        if self.bus is not None:
+            self.bus.start()
+
+    def close_resources(self):
+        """
+        Commits every queued direct message and write, closes the database and stops the password pool, the
+        reaper and the metrics endpoint.
+        """
+        self.reaper_stop.set()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.shutdown()
+        if self.messages is not None:
+            self.messages.close()
+        if self.db is not None:
+            self.db.close()
+        if self.hasher is not None:
+            self.hasher.shutdown()
 
     def accept_connection(self, server_socket):
         """
         Accepts new client connections and spins up a thread for each new connection.
-        Passes the client_socket as an argument to the thread.
-        Appends client socket to dictionary of clients{}.
+        Turns on TCP keepalive and a read timeout, so the thread of a peer that vanished never blocks forever, and
+        wraps the accepted socket in a QueuedConnection (which runs its own writer thread) and passes it as an
+        argument to the thread.
 
         :param server_socket: Socket address of server
         """
         try:
-            client_socket, client_address = server_socket.accept()
-            logging.info(f" Accepted a new connection from {client_socket.getpeername()}")
+            accepted_socket, client_address = server_socket.accept()
+            logging.info(f" Accepted a new connection from {accepted_socket.getpeername()}")
+            connection.enable_keepalive(accepted_socket)
+            accepted_socket.settimeout(self.idle_timeout + self.heartbeat_interval)
+            client_socket = connection.QueuedConnection(accepted_socket, self.outbound_queue_size,
+                                                        self.slow_consumer_policy)
             client_thread = threading.Thread(target=self.handle_client_connection,
                                              args=(client_socket,))
             client_thread.start()
@@ -80,89 +256,178 @@ class Server:
 
     def handle_client_connection(self, client_socket):
         """
-        Threaded function for each new connected client. Receives 'message' from the client sockets as json
-        and loads as 'data'. The header of the data is read and separate functions are run accordingly.
+        Threaded function for each new connected client. Receives 'message' frames from the client sockets and
+        decodes them as 'data', which is passed to handle_message until the client quits or the socket fails.
+        The connection is always forgotten and closed afterwards, whatever ended it.
 
         :param client_socket: Socket address of connected client.
         """
-        while True:
-            try:
-                message = self.recv_message(client_socket)
-                data = json.loads(message)
-                if data["header"] == utility.LoginCommands.LOGIN.value:
-                    self.login(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoginCommands.REGISTER.value:
-                    self.register(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.BROADCAST.value:
-                    if data["body"] == "QUIT":
-                        client_socket.close()
-                        continue
-                    else:
-                        print("{} : {}".format(data["addressee"], data["body"]))
-                        self.broadcast(client_socket, data)
-                        continue
-                elif data["header"] == utility.LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE.value:
-                    self.authenticate_direct_message(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.DIRECT_MESSAGE.value:
-                    self.direct_message(data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.ADD_FRIEND.value:
-                    self.friend_request(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.VIEW_FRIEND_REQUESTS.value:
-                    self.view_friend_requests(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.VIEW_FRIENDS.value:
-                    self.view_friends(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.AUTH_TIC_TAC_TOE.value:
-                    self.authenticate_tic_tac_toe(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS.value:
-                    self.view_ttt_requests(client_socket, data)
-                    continue
-                elif data["header"] == utility.Responses.TIC_TAC_TOE_CONFIRM.value:
-                    requester = data["addressee"]
-                    recipient = data["body"]
-                    self.db.insert_ttt_game_response(requester, recipient, "CONFIRM")
-                    self.start_game(data)
-                    continue
-                elif data["header"] == utility.Responses.PLAY_TIC_TAC_TOE.value:
-                    self.play_tic_tac_toe(data)
-                    continue
-                elif data["header"] == utility.Responses.TIC_TAC_TOE_ERROR.value:
-                    self.play_tic_tac_toe(data)
-                    continue
-                elif data["header"] == utility.Responses.TIC_TAC_TOE_DENY.value:
-                    requester = data["addressee"]
-                    recipient = data["body"]
-                    self.db.insert_ttt_game_response(requester, recipient, "DENY")
-                    continue
-                elif data["header"] == utility.LoggedInCommands.SET_STATUS_AWAY.value:
-                    self.set_status(client_socket, data)
-                    continue
-                elif data["header"] == utility.LoggedInCommands.QUIT.value:
-                    self.quit(client_socket, data)
+        decoder = protocol.FrameDecoder()
+        self.connections.inc()
+        self.open_connections.add(client_socket)
+        try:
+            while True:
+                message = self.recv_message(client_socket, decoder)
+                client_socket.last_received = time.monotonic()
+                client_socket.pinged = False
+                data = codec.decode(compression.decompress(client_socket.inflater, message))
+                if not self.handle_message(client_socket, data):
                     break
-            except socket.error as e:
-                client_socket.close()
-                logging.error(e)
-                break
+        except (socket.error, protocol.ProtocolError) as e:
+            logging.error(e)
+        finally:
+            self.open_connections.discard(client_socket)
+            self.connections.dec()
+            self.disconnect(client_socket)
+            client_socket.close()
+
+    def disconnect(self, client_socket):
+        """
+        Forgets the session of a connection that has closed, removing its username from the clients
+        dictionary unless the user has since logged in on another connection.
+
+        :param client_socket: Socket of the closed connection.
+        """
+        username = self.sessions.pop(client_socket, None)
+        if username is not None:
+            self.remove_client(username, client_socket)
+
+    def reap_loop(self):
+        """
+        Reaper thread. Every few seconds, until the server stops, reaps dead connections.
+        """
+        while not self.reaper_stop.wait(min(self.heartbeat_interval, self.idle_timeout) / 3):
+            self.reap()
+
+    def reap(self, now=None):
+        """
+        Sends a PING to each connection silent for heartbeat_interval, and closes each connection silent for
+        idle_timeout or already closing (its writer failed, or the slow consumer policy disconnected it). A closed
+        connection's session is removed at once, so presence is updated and broadcasts stop fanning out to it
+        without waiting for its read loop to notice.
+
+        :param now: time.monotonic() value to check against, for tests.
+        :return: Number of connections reaped.
+        """
+        now = time.monotonic() if now is None else now
+        ping = self.encode_message(self.build_message(utility.Heartbeats.PING.value, None, None, None))
+        reaped = 0
+        for client_socket in list(self.open_connections):
+            silent = now - client_socket.last_received
+            if silent >= self.idle_timeout or client_socket.is_closing():
+                self.open_connections.discard(client_socket)
+                client_socket.abort()
+                self.disconnect(client_socket)
+                reaped += 1
+            elif silent >= self.heartbeat_interval and not client_socket.pinged:
+                client_socket.pinged = True
+                client_socket.send_frame(ping)
+                self.pings.inc()
+        if reaped:
+            logging.info(f" Reaped {reaped} dead connections")
+            self.reaped.inc(reaped)
+        return reaped
+
+    def add_client(self, username, client_socket):
+        """
+        Adds a logged in client to the clients dictionary and, in a cluster, announces it to the other workers.
+
+        :param username: Username of the client.
+        :param client_socket: Socket of connected client.
+        """
+        self.clients[username] = client_socket
+        if self.bus is not None:
+            self.bus.publish_presence(username, True)
+
+    def remove_client(self, username, client_socket):
+        """
+        Removes a client from the clients dictionary unless the user has since logged in on another connection,
+        in a cluster tells the other workers, marks the user OFFLINE to their online friends and ends their tic tac
+        toe games. Runs both when the client quits and when its connection fails.
+
+        :param username: Username of the client.
+        :param client_socket: Socket of the client's connection.
+        """
+        if self.clients.get(username) is client_socket:
+            del self.clients[username]
+            if self.bus is not None:
+                self.bus.publish_presence(username, False)
+            self.presence.go_offline(username)
+            self.end_games(username)
+
+    def handle_message(self, client_socket, data):
+        """
+        Handles one message from a client. Both server engines handle a connection's messages one at a time in
+        the order they arrive, so a client may pipeline requests without waiting for each reply. If the message
+        carries a request_id, every message sent back to the client while it is handled echoes it, so replies
+        can be told apart from pushes and matched to their request. A handler that fails on a bad request is
+        logged and the client answered with ERROR, and the connection carries on; socket errors still end it.
+
+        :param client_socket: Socket address of connected client.
+        :param data: Decoded message received from the client.
+        :return: False once the client has quit and the connection should be closed, else True.
+        """
+        request_id = data.get("request_id")
+        if request_id is not None:
+            self.replying.request = (client_socket, request_id)
+        try:
+            return self.dispatch(client_socket, data)
+        except socket.error:
+            raise
+        except Exception:
+            self.handler_errors.inc()
+            logging.exception(f" Could not handle message with header {data.get('header')}")
+            if client_socket is not None:
+                response = self.build_message(utility.Responses.ERROR.value, None, "Request failed...", None)
+                self.server_send(client_socket, response)
+            return True
+        finally:
+            if request_id is not None:
+                self.replying.request = None
+
+    def dispatch(self, client_socket, data):
+        """
+        Looks up the header of the data in the dispatch table and runs its handler. Handlers that require a
+        logged in client are refused with an ERROR response until the connection has logged in. Shared by the
+        threaded and asyncio server engines. The codecs only decode message dictionaries with an integer or None
+        header, raising ProtocolError for anything else, so the lookup cannot fail.
+
+        :param client_socket: Socket address of connected client.
+        :param data: Decoded message received from the client.
+        :return: False once the client has quit and the connection should be closed, else True.
+        """
+        handler = self.handlers.get(data["header"])
+        if handler is None:
+            self.unknown_headers.inc()
+            logging.error(f" Unknown header: {data['header']}")
+            return True
+        if handler.requires_auth and client_socket not in self.sessions:
+            response = self.build_message(utility.Responses.ERROR.value, None, "Please login first...", None)
+            self.server_send(client_socket, response)
+            return True
+        if not metrics.enabled():
+            handler.function(client_socket, data)
+            return not handler.closes_connection
+        started = time.perf_counter()
+        try:
+            handler.function(client_socket, data)
+        finally:
+            self.handler_latency[data["header"]].observe(time.perf_counter() - started)
+        return not handler.closes_connection
 
     def login(self, client_socket, data):
         """
         Function run when client requests to login. Checks the db for client username. If not found, responds
         with 'username not found'. If found, checks the username against given password in the db. If not a
-        match, responds to client with 'incorrect password'. If correct responds to client with LOGGED_IN header
-        allowing client to proceed to menu. Sets users status to 'ONLINE' IN DB. Also searches and fetched friend
-        list of client and sends all friends a notification that the connected client is now online. Adds client
-        username to the 'clients' dictionary with their client socket.
+        match, responds to client with 'incorrect password'. If the password pool is saturated, responds with
+        BUSY so the client can retry. If correct responds to client with LOGGED_IN header
+        allowing client to proceed to menu, naming the codec chosen from those the client offered; every later
+        message on the connection uses that codec. Delivers any direct messages stored in the user's inbox while
+        they were offline. Adds client username to the 'clients' dictionary with their client socket and marks
+        them ONLINE with the presence service, which notifies their online friends.
 
         :param client_socket: Socket of connected client
-        :param data: LOGIN header, client username, given password
+        :param data: LOGIN header, client username, given password, offered codecs (optional)
         """
         while True:
             try:
@@ -174,40 +439,67 @@ class Server:
                                                   "Username not found. Please enter username: ", None)
                     self.server_send(client_socket, response)
                     break
+                try:
+                    password_matches = self.hasher.check_password(pw, user_in_db[0][2])
+                except passwords.HasherBusy:
+                    response = self.build_message(utility.Responses.BUSY.value, None,
+                                                  "Server busy, please retry...", None)
+                    self.server_send(client_socket, response)
+                    break
+                if password_matches:
+                    self.add_client(username, client_socket)
+                    self.sessions[client_socket] = username
+                    message_codec = codec.negotiate(data["extra_info"])
+                    response = self.build_message(utility.LoginCommands.LOGGED_IN.value, username,
+                                                  utility.Responses.SUCCESS.value, message_codec.name)
+                    self.server_send(client_socket, response)
+                    client_socket.codec = message_codec
+                    self.deliver_inbox(username)
+                    self.presence.go_online(username)
+                    break
                 else:
-                    if bcrypt.checkpw(pw, user_in_db[0][2]):
-                        self.clients[username] = client_socket
-                        self.db.set_status("ONLINE", username)
-                        response = self.build_message(utility.LoginCommands.LOGGED_IN.value, username,
-                                                      utility.Responses.SUCCESS.value, None)
-                        self.server_send(client_socket, response)
-
-                        friends_list = self.db.view_friends_and_status(username)
-                        friends_list_usernames = []
-                        for i in friends_list:
-                            friends_list_usernames.append(i[0])
-                        online_notification = self.build_message(utility.Responses.ONLINE_NOTIFICATION.value,
-                                                                 username, None, None)
-                        for username, client_socket in self.clients.items():
-                            if username in friends_list_usernames:
-                                self.server_send(client_socket, online_notification)
-                        break
-                    else:
-                        response = self.build_message(utility.LoginCommands.LOGIN.value, None,
-                                                      "Incorrect credentials. Please try again...", None)
-                        self.server_send(client_socket, response)
-                        break
+                    response = self.build_message(utility.LoginCommands.LOGIN.value, None,
+                                                  "Incorrect credentials. Please try again...", None)
+                    self.server_send(client_socket, response)
+                    break
             except socket.error as e:
                 client_socket.close()
                 logging.error(e)
                 break
 
+    def compress(self, client_socket, data):
+        """
+        Function run when a client offers compression on connecting. Replies with the method chosen from those
+        offered, or None, and the size threshold. Every frame of at least threshold bytes sent after the reply is
+        compressed, and the compressed frames the client sends are decompressed, each direction a single deflate
+        stream kept for the life of the connection. Offers after login, or once compression is negotiated, are
+        refused with ERROR.
+
+        :param client_socket: Socket of connected client.
+        :param data: COMPRESS header, offered methods in preference order, e.g. ["deflate"] (body).
+        """
+        if client_socket in self.sessions or client_socket.inflater is not None:
+            response = self.build_message(utility.Responses.ERROR.value, None,
+                                          "Compression must be negotiated on connecting...", None)
+            self.server_send(client_socket, response)
+            return
+        method = compression.negotiate(data["body"]) if self.compression_threshold is not None else None
+        if method is not None:
+            client_socket.inflater = compression.Inflater()
+        response = self.build_message(utility.LoginCommands.COMPRESS.value, None, method, self.compression_threshold)
+        self.server_send(client_socket, response)
+        if method is not None:
+            client_socket.start_compression(compression.Deflater(self.compression_threshold))
+
     def register(self, client_socket, data):
         """
-        Function run when client requests to register with new account. Checks the db against the requested
-        username given. If an exact username is found, a response is sent to client stating username is already in use
-        and to choose another. Else, the passwrd is hashed using bcrypt (and salted) and username/password are inserted
-        into the db. Server responds to client with 'REGISTERED' header, allowing the client to login.
+        Function run when client requests to register with new account. Checks the requested username is
+        available (a Bloom filter lookup, confirmed against the unique index on a possible match). If it is
+        taken, a response is sent to client stating username is already in use and to choose another. Else, the
+        passwrd is hashed using bcrypt (and salted) on the password pool and username/password are inserted into
+        the db, or BUSY is sent if the pool is saturated. If the unique username index rejects the insert (a
+        concurrent registration won), the username is reported as in use. Server responds to client with
+        'REGISTERED' header, allowing the client to login.
 
         :param client_socket: Socket of connected client.
         :param data: REGISTER header, requested username (str), requested password (str).
@@ -215,16 +507,28 @@ class Server:
         while True:
             try:
                 username = data["addressee"]
-                if not self.db.fetch_all_users_data(username):
+                if not self.db.username_available(username):
                     response = self.build_message(utility.LoginCommands.REGISTER.value, username,
                                                   "Username already registered, please choose another...", None)
                     self.server_send(client_socket, response)
                     break
                 else:
                     pw = data["body"].encode(ENCODE)
-                    salt = bcrypt.gensalt()
-                    hashed = bcrypt.hashpw(pw, salt)
-                    self.db.insert_username_and_password(username, hashed)
+                    try:
+                        hashed = self.hasher.hash_password(pw)
+                    except passwords.HasherBusy:
+                        response = self.build_message(utility.Responses.BUSY.value, None,
+                                                      "Server busy, please retry...", None)
+                        self.server_send(client_socket, response)
+                        break
+                    try:
+                        self.db.insert_username_and_password(username, hashed).result()
+                    except sqlite3.IntegrityError:
+                        response = self.build_message(utility.LoginCommands.REGISTER.value, username,
+                                                      "Username already registered, please choose another...",
+                                                      None)
+                        self.server_send(client_socket, response)
+                        break
                     response = self.build_message(utility.LoginCommands.REGISTERED.value, None,
                                                   utility.Responses.SUCCESS.value, None)
                     self.server_send(client_socket, response)
@@ -232,147 +536,460 @@ class Server:
             except socket.error as e:
                 logging.error(e)
                 client_socket.close()
-                self.clients.pop(client_socket)
+                break
 
     def broadcast(self, client_socket, data):
         """
-        Function run on request of the client. Responds with message to all clients connected to client dictionary.
+        Function run on request of the client. Responds with message to all clients connected to client dictionary,
+        sent as from the user logged in on the connection. In a cluster the message is published once on the bus
+        for the other workers to fan out.
 
         :param client_socket: Socket of connected client.
-        :param data: BROADCAST Header, client username (str), client message to broadcast (str).
+        :param data: BROADCAST Header, client username (str, unused), client message to broadcast (str).
         """
-        try:
-            data["header"] = None
-            username = data["addressee"]
-            user_msg = data["body"]
-            data["extra_info"] = None
-            response = self.build_message(utility.Responses.BROADCAST_MSG.value, username, user_msg, None)
-            for username, client_socket in self.clients.items():
-                self.server_send(client_socket, response)
-        except socket.error as e:
-            logging.error(e)
+        if data["body"] == "QUIT":
             client_socket.close()
-            del self.clients[client_socket]
+            return
+        username = self.sessions[client_socket]
+        print("{} : {}".format(username, data["body"]))
+        response = self.build_message(utility.Responses.BROADCAST_MSG.value, username, data["body"], None)
+        self.fan_out(response)
+        if self.bus is not None:
+            self.bus.publish_broadcast(response)
+
+    def fan_out(self, response, recipients=None):
+        """
+        Sends a message to every client connected to this process, or to those of the recipients connected to
+        it. The message is encoded into a frame once per codec in use and the same bytes are queued on every
+        client's connection, so a slow client never delays delivery to the others.
+
+        :param response: Message dictionary to send.
+        :param recipients: Iterable of client sockets, with None for recipients who are offline, or None for
+            every client.
+        """
+        frames = {}
+        for recipient_socket in list(self.clients.values()) if recipients is None else recipients:
+            if recipient_socket is None or isinstance(recipient_socket, connection.RemoteConnection):
+                continue
+            message_codec = recipient_socket.codec
+            if message_codec not in frames:
+                frames[message_codec] = self.encode_message(response, message_codec)
+            recipient_socket.send_frame(frames[message_codec])
+
+    def create_room(self, client_socket, data):
+        """
+        Function run when a user creates a chat room. The room is inserted into the db, where the unique name
+        index settles concurrent creations, and the user becomes its first member.
+
+        :param client_socket: Socket of connected client.
+        :param data: CREATE_ROOM header, client username (str), room name (str).
+        """
+        username = self.sessions[client_socket]
+        name = data["body"]
+        if not isinstance(name, str) or not 0 < len(name) <= rooms.MAX_NAME_LENGTH:
+            response = self.build_message(utility.Responses.ERROR.value, None,
+                                          f"Room names are 1 to {rooms.MAX_NAME_LENGTH} characters...", None)
+        elif self.rooms.get(name) is not None:
+            response = self.build_message(utility.Responses.ERROR.value, None, "Room already exists...", None)
+        else:
+            try:
+                room_id = self.db.insert_room(name, username).result()
+            except sqlite3.IntegrityError:
+                response = self.build_message(utility.Responses.ERROR.value, None, "Room already exists...", None)
+            else:
+                self.rooms.create(room_id, name, username)
+                if self.bus is not None:
+                    self.bus.publish_room("create", name, username, room_id)
+                response = self.build_message(utility.Responses.SUCCESS.value, None, "Room created", None)
+        self.server_send(client_socket, response)
+
+    def join_room(self, client_socket, data):
+        """
+        Function run when a user joins a chat room. Membership is written to the db without waiting, and the
+        user is sent the room's recent history.
+
+        :param client_socket: Socket of connected client.
+        :param data: JOIN_ROOM header, client username (str), room name (str).
+        """
+        username = self.sessions[client_socket]
+        name = data["body"]
+        room = self.rooms.join(name, username)
+        if room is None:
+            response = self.build_message(utility.Responses.ERROR.value, None, "Room not found...", None)
+        else:
+            self.db.insert_room_member(room.room_id, username)
+            if self.bus is not None:
+                self.bus.publish_room("join", name, username)
+            response = self.build_message(utility.Responses.ROOM_HISTORY.value, name, self.rooms.history(name), None)
+        self.server_send(client_socket, response)
+
+    def leave_room(self, client_socket, data):
+        """
+        Function run when a user leaves a chat room.
+
+        :param client_socket: Socket of connected client.
+        :param data: LEAVE_ROOM header, client username (str), room name (str).
+        """
+        username = self.sessions[client_socket]
+        name = data["body"]
+        room = self.rooms.leave(name, username)
+        if room is None:
+            response = self.build_message(utility.Responses.ERROR.value, None, "You are not in that room...", None)
+        else:
+            self.db.delete_room_member(room.room_id, username)
+            if self.bus is not None:
+                self.bus.publish_room("leave", name, username)
+            response = self.build_message(utility.Responses.SUCCESS.value, None, "Left room", None)
+        self.server_send(client_socket, response)
+
+    def list_rooms(self, client_socket, data):
+        """
+        Function responds with every room as a [name, member count, whether the client is a member] list.
+
+        :param client_socket: Socket of connected client.
+        :param data: LIST_ROOMS header, client username (str).
+        """
+        listing = self.rooms.listing(self.sessions[client_socket])
+        response = self.build_message(utility.Responses.ROOM_LIST.value, None, listing, None)
+        self.server_send(client_socket, response)
+
+    def post_room(self, client_socket, data):
+        """
+        Function run when a member posts to a chat room. The post goes to the room's online members, including
+        the sender, and in a cluster is published for the other workers to deliver to theirs.
+
+        :param client_socket: Socket of connected client.
+        :param data: POST_ROOM header, room name (str), message (str).
+        """
+        username = self.sessions[client_socket]
+        name = data["addressee"]
+        created_at = int(time.time() * 1000000)
+        if not self.deliver_room_post(name, username, data["body"], created_at):
+            response = self.build_message(utility.Responses.ERROR.value, None, "Join the room first...", None)
+            self.server_send(client_socket, response)
+        elif self.bus is not None:
+            self.bus.publish_room_post(name, username, data["body"], created_at)
+
+    def deliver_room_post(self, name, sender, message, created_at):
+        """
+        Adds a post to a room's history and sends it as ROOM_MSG to the room's members connected to this process.
+        Only the room's own members are looked up, so the cost grows with the room, not with every user online.
+
+        :return: False if the sender is not a member of the room, else True.
+        """
+        members = self.rooms.post(name, sender, message, created_at)
+        if members is None:
+            return False
+        response = self.build_message(utility.Responses.ROOM_MSG.value, name, message, sender)
+        clients = self.clients
+        self.fan_out(response, [clients.get(member) for member in members])
+        return True
 
     def authenticate_direct_message(self, client_socket, data):
         """
-        Searches the given username against the db user table. If found, responds to the client
-        allowing them to direct message the recipient. Also fetches all previous messages between client and
-        recipient from the db messages table. Messages list is sent as a response to client.
+        Searches the given username against the db user table. If found, responds to the client allowing them to
+        direct message the recipient, whether or not they are online. Also fetches the latest page of messages
+        between client and recipient from the db messages table, as [message_id, sender, message, created_at]
+        lists newest first. Direct messages may be written behind, so queued messages are committed first for the
+        page to include them.
+        The page is sent as a response to client; older pages are requested with FETCH_HISTORY.
         If not found in db, responds to the client with a message 'username' not found.
 
         :param client_socket: Connected client socket address
-        :param data: header (enum), client username (str), recipient username (str)
+        :param data: header (enum), recipient username (str). The requester is the user logged in on the
+            connection; the username the client sends in the body is ignored.
         """
-        requester = data["body"]
+        requester = self.sessions[client_socket]
         recipient = data["addressee"]
-        if recipient not in self.clients:
+        if not self.db.find_username_in_db(recipient):
             response = self.build_message(utility.Responses.ERROR.value, None,
                                           "Username not found", None)
             self.server_send(client_socket, response)
         else:
-            previous_messages = self.db.fetch_messages(requester, recipient)
+            self.messages.flush()
+            previous_messages = self.db.fetch_history(requester, recipient)
             response = self.build_message(utility.LoggedInCommands.DIRECT_MESSAGE.value, recipient,
                                           requester, previous_messages)
             self.server_send(client_socket, response)
 
-    def direct_message(self, data):
+    def fetch_history(self, client_socket, data):
+        """
+        Function sends the logged in client one page of their conversation with another user, older than the
+        message id given. The reply's extra_info is the message id to request the next older page with, or None
+        once the start of the conversation has been reached.
+
+        :param client_socket: Socket of connected client.
+        :param data: FETCH_HISTORY header, other username (str), page size (int), oldest message id seen (int).
+        """
+        requester = self.sessions[client_socket]
+        recipient = data["addressee"]
+        if not self.db.find_username_in_db(recipient):
+            response = self.build_message(utility.Responses.ERROR.value, None, "Username not found", None)
+            self.server_send(client_socket, response)
+            return
+        limit = max(min(data["body"] or self.db.HISTORY_PAGE_SIZE, self.db.MAX_HISTORY_PAGE), 1)
+        page = self.db.fetch_history(requester, recipient, data["extra_info"], limit)
+        before_id = page[-1][0] if len(page) == limit else None
+        response = self.build_message(utility.Responses.HISTORY.value, recipient, page, before_id)
+        self.server_send(client_socket, response)
+
+    def direct_message(self, client_socket, data):
         """
-        Function sends messages from client to recipient and inserts messages into db.
+        Function sends messages from client to recipient and inserts messages into db. With SYNC durability the
+        message is committed before it is delivered; with WRITE_BEHIND it is delivered first and queued on the
+        message pipeline. Messages to an offline recipient, or one whose connection could not take the message,
+        are stored in their inbox instead. A message to a username that does not exist is answered with ERROR.
 
         :param client_socket: Socket of connected client.
-        :param data: requester username (str), recipient username (str), message to send (str)
+        :param data: recipient username (str), message to send (str). The sender is the user logged in on the
+            connection; the username the client sends in extra_info is ignored.
         """
-        requester = data["extra_info"]
+        requester = self.sessions[client_socket]
         username = data["addressee"]
         msg = data["body"]
+        recipient_socket = self.clients.get(username)
+        if recipient_socket is None:
+            if self.db.find_user_id(username) is None:
+                response = self.build_message(utility.Responses.ERROR.value, None, "Username not found", None)
+                self.server_send(client_socket, response)
+                return
+            self.store_offline_message(client_socket, requester, username, msg)
+            self.messages.submit(requester, username, msg)
+            return
         response = self.build_message(utility.LoggedInCommands.PRINT_DM.value, username, msg, None)
-        self.db.insert_message(requester, username, msg)
-        self.server_send(self.clients[username], response)
+        if self.messages.durability == pipeline.SYNC:
+            self.messages.submit(requester, username, msg)
+            delivered = self.server_send(recipient_socket, response)
+        else:
+            delivered = self.server_send(recipient_socket, response)
+            self.messages.submit(requester, username, msg)
+        if not delivered:
+            self.store_offline_message(client_socket, requester, username, msg, recipient_socket)
+
+    def store_offline_message(self, client_socket, requester, recipient, msg, failed_socket=None):
+        """
+        Function stores a direct message in an offline recipient's inbox and waits for it to be committed. If
+        the recipient logged in meanwhile (on a connection other than the one delivery just failed on) their
+        inbox is delivered straight away. If the inbox is full the sender is told the message was not delivered.
+
+        :param client_socket: Socket of the sending client.
+        :param requester: Sender username.
+        :param recipient: Recipient username.
+        :param msg: The message text.
+        :param failed_socket: The recipient's connection that could not take the message, if any.
+        """
+        if self.db.store_offline_message(requester, recipient, msg).result():
+            self.offline_queued.inc()
+            recipient_socket = self.clients.get(recipient)
+            if recipient_socket is not None and recipient_socket is not failed_socket:
+                self.deliver_inbox(recipient)
+        else:
+            self.inbox_full.inc()
+            response = self.build_message(utility.Responses.ERROR.value, None,
+                                          f"{recipient}'s inbox is full, message not delivered", None)
+            self.server_send(client_socket, response)
+
+    def deliver_inbox(self, username):
+        """
+        Function drains a logged in user's inbox and sends the stored messages in INBOX frames of up to
+        INBOX_FRAME_SIZE [sender, message, created_at] lists each, oldest first.
+
+        :param username: Username of the recipient.
+        """
+        client_socket = self.clients.get(username)
+        if client_socket is None:
+            return
+        pending = self.db.drain_inbox(username).result()
+        for start in range(0, len(pending), INBOX_FRAME_SIZE):
+            response = self.build_message(utility.Responses.INBOX.value, username,
+                                          pending[start:start + INBOX_FRAME_SIZE], None)
+            self.server_send(client_socket, response)
+        self.offline_delivered.inc(len(pending))
 
     def friend_request(self, client_socket, data):
         """
         Function run when user requests to add another user as a friend. Recipient username is checked against the
-        db to ensure the user exists. If exists, inserts status 'SENT' to friends table in db. If status is already
-        'SENT', updates status to 'FRIENDS' and responds to the client accordingly (either friend request sent or
-        friend added).
+        db to ensure the user exists and the friend graph to ensure they are not already friends and no request
+        is already pending. If recipient has already sent a request, updates its status to 'FRIENDS' and tells the
+        presence service about the new friendship; else inserts a new request with status 'SENT'. Responds to the
+        client accordingly and, in a cluster, tells the other workers so their friend graphs stay current. The
+        requester is the user logged in on the connection.
 
         :param client_socket: Socket of connected client.
-        :param data: Requester username (str), recipient username (str).
+        :param data: Requester username (str, unused), recipient username (str).
         """
-        requester = data["addressee"]
+        requester = self.sessions[client_socket]
         recipient = data["body"]
-        if not self.db.fetch_all_users_data(recipient):
+        if not self.db.find_username_in_db(recipient):
             response = self.build_message(utility.Responses.ERROR.value, None, "Username not found...", None)
-            self.server_send(client_socket, response)
+        elif requester == recipient or self.db.are_friends(requester, recipient):
+            response = self.build_message(utility.Responses.ERROR.value, None, "Already friends...", None)
+        elif self.db.find_friendship_status(recipient, requester) == "SENT":
+            response = self.build_message(utility.Responses.ERROR.value, None, "Friend request already sent...",
+                                          None)
         elif self.db.find_friendship_status(requester, recipient) == "SENT":
-            self.db.insert_friend_relationship(requester, recipient)
+            self.db.insert_friend_relationship(requester, recipient).result()
+            self.presence.add_friendship(requester, recipient)
+            if self.bus is not None:
+                self.bus.publish_friendship(requester, recipient, None)
             response = self.build_message(utility.Responses.SUCCESS.value, None, "Friend added", None)
-            self.server_send(client_socket, response)
         else:
-            self.db.insert_friend_request(requester, recipient)
-            response = self.build_message(utility.Responses.SUCCESS.value, None,
-                                          "Friend request sent", None)
+            friendship_id = self.db.insert_friend_request(requester, recipient).result()
+            if self.bus is not None:
+                self.bus.publish_friendship(requester, recipient, friendship_id)
+            response = self.build_message(utility.Responses.SUCCESS.value, None, "Friend request sent", None)
+        self.server_send(client_socket, response)
+
+    def confirm_tic_tac_toe(self, client_socket, data):
+        """
+        Function run when the recipient of a tic tac toe request accepts it. Checks the game in the db is a pending
+        invite from the named player to this one, records the response in the db and starts the game.
+
+        :param client_socket: Socket of connected client.
+        :param data: Recipient username (str), requester username (str), game id (int).
+        """
+        game = self.pending_game(client_socket, data)
+        if game is not None:
+            self.db.insert_ttt_game_response(data["extra_info"], "CONFIRM").result()
+            self.start_game(data["extra_info"], game[0], game[1])
+
+    def deny_tic_tac_toe(self, client_socket, data):
+        """
+        Function run when the recipient of a tic tac toe request declines it. Records the response in the db.
+
+        :param client_socket: Socket of connected client.
+        :param data: Recipient username (str), requester username (str), game id (int).
+        """
+        game = self.pending_game(client_socket, data)
+        if game is not None:
+            self.db.insert_ttt_game_response(data["extra_info"], "DENY").result()
+
+    def pending_game(self, client_socket, data):
+        """
+        Looks up the game a tic tac toe invite response refers to, answering with an ERROR unless it is an
+        invite still awaiting a response, sent by the requester named to the user logged in on the connection.
+        The recipient is always the session's user, never the username the client put in the message.
+
+        :param client_socket: Socket of connected client.
+        :param data: Recipient username (str, unused), requester username (str), game id (int).
+        :return: The game's (sender, receiver, status), or None.
+        """
+        game = self.db.find_ttt_game(data["extra_info"])
+        if game != (data["body"], self.sessions[client_socket], "SENT"):
+            response = self.build_message(utility.Responses.ERROR.value, None, "Game request not found...", None)
             self.server_send(client_socket, response)
+            return None
+        return game
 
-    def start_game(self, data):
-        self.requester = data["addressee"]
-        self.recipient = data["body"]
-        help_board = ttt_game.get_help_board()
-        turn_dict = {self.requester: 'X', self.recipient: 'O'}
-        turn = turn_dict[self.requester]
-        the_board = ttt_game.return_new_board()
-        response = self.build_message(utility.Responses.PLAY_TIC_TAC_TOE.value, self.requester,
-                                      self.recipient, [help_board, the_board, turn, turn_dict])
-        self.server_send(self.clients[self.recipient], response)
-
-    def play_tic_tac_toe(self, data):
-        board, turn, move, turn_dict = [data['extra_info'][0], data['extra_info'][1],
-                                        data['extra_info'][2], data['extra_info'][3]]
-        help_board = ttt_game.get_help_board()
-        updated_board, turn = ttt_game.updateBoard(board, turn, move)
-        if isinstance(updated_board, dict):
-            self.requester, self.recipient = self.recipient, self.requester
-            if data["header"] == utility.Responses.TIC_TAC_TOE_ERROR.value:
-                turn = turn_dict[self.requester]
-                response = self.build_message(utility.Responses.PLAY_TIC_TAC_TOE.value, self.requester,
-                                              self.recipient, [help_board, updated_board, turn, turn_dict])
-                self.server_send(self.clients[self.recipient], response)
+    def start_game(self, game_id, first, second):
+        """
+        Creates the server-side session of an accepted game in the game registry and asks the player who sent
+        the invite, who plays X, for the first move.
 
-            else:
-                turn = turn_dict[self.requester]
-                response = self.build_message(utility.Responses.PLAY_TIC_TAC_TOE.value, self.requester,
-                                              self.recipient, [help_board, updated_board, turn, turn_dict])
-                self.server_send(self.clients[self.recipient], response)
-        elif isinstance(updated_board, str):
-            if updated_board == utility.Responses.TIC_TAC_TOE_SPACE_ERROR.value:
-                turn = turn_dict[self.recipient]
-                response = self.build_message(utility.Responses.TIC_TAC_TOE_ERROR.value, self.requester,
-                                              self.recipient, [help_board, board, turn, turn_dict])
-                self.server_send(self.clients[self.recipient], response)
-            elif updated_board == 'won':
-                response = self.build_message(utility.Responses.TIC_TAC_TOE_WINNER.value, self.requester,
-                                              self.recipient, [help_board, board, turn,
-                                                               f'Game Over! {turn} won!'])
-                self.server_send(self.clients[self.recipient], response)
-                self.server_send(self.clients[self.requester], response)
-            elif updated_board == 'tie':
-                response = self.build_message(utility.Responses.TIC_TAC_TOE_TIE.value, self.requester,
-                                              self.recipient, [help_board, board, turn,
-                                                               f"Game Over! It's a tie!"])
-                self.server_send(self.clients[self.recipient], response)
-                self.server_send(self.clients[self.requester], response)
+        :param game_id: Id of the game.
+        :param first: Username of the player who sent the invite.
+        :param second: Username of the player who accepted it.
+        """
+        session = self.games.start(game_id, first, second)
+        if session is not None:
+            self.send_turn(session, utility.Responses.PLAY_TIC_TAC_TOE)
+
+    def send_turn(self, session, header):
+        """
+        Sends the player to move the board, their mark and the game id, with PLAY_TIC_TAC_TOE to ask for a move
+        or TIC_TAC_TOE_ERROR to ask for another after an invalid one. Ends the game if they are not connected.
+
+        :param session: The game's GameSession.
+        :param header: Responses header enum to send.
+        """
+        player = session.turn
+        opponent = session.opponent(player)
+        response = self.build_message(header.value, player, opponent,
+                                      [ttt_game.get_help_board(), session.board.to_dict(), session.marks[player],
+                                       session.game_id])
+        player_socket = self.clients.get(player)
+        if player_socket is None or not self.server_send(player_socket, response):
+            self.end_game(session, f"{player} left the game...")
+
+    def play_tic_tac_toe(self, client_socket, data):
+        """
+        Function run when a player sends a move. The game is looked up in the game registry by its id and the
+        move checked against the turn order and the server's board; the next player is then asked to move, or
+        both players told the result. In a cluster a game is held by the worker of the player who accepted the
+        invite, so moves for games held elsewhere are forwarded over the message bus. The player is the user
+        logged in on the connection; only a forwarded move names its player, set by the worker that forwarded it.
+
+        :param client_socket: Socket of connected client, None for a move forwarded by another worker.
+        :param data: Player username (str, unused unless forwarded), opponent username (str),
+            [game id (int), square (str)].
+        """
+        username = data["addressee"] if client_socket is None else self.sessions[client_socket]
+        game_id, square = data["extra_info"][0], data["extra_info"][1]
+        session = self.games.get(game_id)
+        if session is None or username not in session.players:
+            if client_socket is None:
+                return
+            if self.bus is not None:
+                self.bus.publish_game_move(dict(data, addressee=username))
+                return
+            response = self.build_message(utility.Responses.ERROR.value, None, "Game not found...", None)
+            self.server_send(client_socket, response)
+            return
+        outcome = session.move(username, square)
+        if outcome == games.NOT_YOUR_TURN:
+            response = self.build_message(utility.Responses.ERROR.value, None, "It's not your turn...", None)
+            player_socket = client_socket if client_socket is not None else self.clients.get(username)
+            if player_socket is not None:
+                self.server_send(player_socket, response)
+        elif outcome in (games.INVALID_SQUARE, games.SPACE_FILLED):
+            self.send_turn(session, utility.Responses.TIC_TAC_TOE_ERROR)
+        elif outcome == games.PLAYING:
+            self.send_turn(session, utility.Responses.PLAY_TIC_TAC_TOE)
+        elif outcome == games.WON:
+            self.end_game(session, f"Game Over! {session.marks[username]} won!", utility.Responses.TIC_TAC_TOE_WINNER)
+        else:
+            self.end_game(session, "Game Over! It's a tie!", utility.Responses.TIC_TAC_TOE_TIE)
+
+    def end_game(self, session, result, header=utility.Responses.TIC_TAC_TOE_WINNER):
+        """
+        Removes a game from the game registry, tells whichever players are still connected the result and marks
+        the game FINISHED in the db without waiting for the write.
+
+        :param session: The game's GameSession.
+        :param result: Text of the result.
+        :param header: TIC_TAC_TOE_WINNER or TIC_TAC_TOE_TIE.
+        """
+        if self.games.finish(session.game_id) is None:
+            return
+        response = self.build_message(header.value, session.turn, session.opponent(session.turn),
+                                      [ttt_game.get_help_board(), session.board.to_dict(), session.marks[session.turn],
+                                       result])
+        for player in session.players:
+            player_socket = self.clients.get(player)
+            if player_socket is not None:
+                self.server_send(player_socket, response)
+        self.db.insert_ttt_game_response(session.game_id, "FINISHED")
+
+    def end_games(self, username):
+        """
+        Ends every game held here that a player who has gone offline is in.
+
+        :param username: Username of the player.
+        """
+        for session in self.games.games_of(username):
+            self.end_game(session, f"{username} left the game...")
 
     def view_friend_requests(self, client_socket, data):
         """
         Function that runs when user requests to view their friends requests sent to them.
         Runs the database function to retrieve list of requests from db friends table.
-        Responds to the client with a list of friend request usernames.
+        Responds to the client with a list of friend request usernames. The requester is the user logged in on the
+        connection.
 
         :param client_socket: Socket of connected client.
-        :param data: VIEW_FRIEND_REQUESTS header (enum), requester username (str).
+        :param data: VIEW_FRIEND_REQUESTS header (enum), requester username (str, unused).
         """
-        requester = data["addressee"]
+        requester = self.sessions[client_socket]
         friends_list = self.db.view_friend_requests(requester)
         response = self.build_message(utility.Responses.PRINT_FRIEND_REQUESTS.value, requester,
                                       "\n".join([x[0] for x in friends_list]), None)
@@ -381,42 +998,55 @@ class Server:
     def view_friends(self, client_socket, data):
         """
         Function that runs when user requests to view their friends list.
-        Runs the database function to retrieve list of friend from db friends table.
-        Responds to the client with a list of friends usernames.
+        Asks the presence service for the friends of the user logged in on the connection and their statuses.
+        Responds to the client with a list of friends usernames and statuses.
 
         :param client_socket: Socket of connected client.
-        :param data: Requester username (str).
+        :param data: Requester username (str, unused).
         """
-        requester = data["addressee"]
-        friends_list = self.db.view_friends_and_status(requester)
+        requester = self.sessions[client_socket]
+        friends_list = self.presence.friend_statuses(requester)
         response = self.build_message(utility.Responses.PRINT_FRIENDS_LIST.value, requester,
                                       "\n".join([x[0] + " : " + x[1] for x in friends_list]), None)
         self.server_send(client_socket, response)
 
     def authenticate_tic_tac_toe(self, client_socket, data):
-        requester = data["addressee"]
+        """
+        Function run when a user invites another to a game of tic tac toe. If the recipient is online, the invite
+        is inserted into the db and sent to them with its game id, as from the user logged in on the connection.
+
+        :param client_socket: Socket of connected client.
+        :param data: Requester username (str, unused), recipient username (str).
+        """
+        requester = self.sessions[client_socket]
         recipient = data["body"]
         if recipient not in self.clients:
             response = self.build_message(utility.Responses.ERROR.value, None,
                                           "Username not found", None)
             self.server_send(client_socket, response)
         else:
-            self.db.insert_ttt_game_request(requester, recipient)
+            game_id = self.db.insert_ttt_game_request(requester, recipient).result()
             response = self.build_message(utility.Responses.TIC_TAC_TOE_REQUEST.value, requester,
-                                          recipient, None)
+                                          recipient, game_id)
             self.server_send(self.clients[recipient], response)
 
     def set_status(self, client_socket, data):
         """
-        Function runs when client requests to change their status. Inserts given status into clients 'status' field
-        in the db users table. Responds back to the client confirming status update.
+        Function runs when client requests to change their status. The presence service records it for the user
+        logged in on the connection, pushes it to their online friends and queues the write to the db users table.
+        Responds back to the client confirming status update, or with ERROR for a status clients may not set.
 
         :param client_socket: Socket of connected client.
-        :param data: Client username (str), status requested (str).
+        :param data: Client username (str, unused), status requested (str), one of presence.CLIENT_STATUSES.
         """
-        username = data["addressee"]
+        username = self.sessions[client_socket]
         status = data["body"]
-        self.db.set_status(status, username)
+        if status not in presence.CLIENT_STATUSES:
+            response = self.build_message(utility.Responses.ERROR.value, None,
+                                          f"Status must be one of {', '.join(presence.CLIENT_STATUSES)}...", None)
+            self.server_send(client_socket, response)
+            return
+        self.presence.set_status(username, status)
         response = self.build_message(utility.Responses.PRINT_STATUS_AWAY.value, username, f"Status: {status}", None)
         self.server_send(client_socket, response)
 
@@ -438,53 +1068,98 @@ class Server:
 
     def server_send(self, client_socket, msg_to_send):
         """
-        Method takes the message dictionary and dumps into json message packet.
-        Json message packet is sent to the client.
+        Method takes the message dictionary and encodes it into a message frame with the client's codec.
+        The frame is queued on the client's connection. A reply to a request that carried a request id echoes
+        it.
 
         :param client_socket: Socket of connected client.
         :param msg_to_send: Parameter for (build_message) dictionary to be sent.
+        :return: True if the frame was queued, False if the connection is closed or dropped it.
         """
-        try:
-            msg_packet = json.dumps(msg_to_send)
-            self.send_message(client_socket, msg_packet)
-        except socket.error as e:
-            logging.error(e)
+        request = getattr(self.replying, "request", None)
+        if request is not None and request[0] is client_socket:
+            msg_to_send = dict(msg_to_send, request_id=request[1])
+        if not metrics.enabled():
+            return client_socket.send_frame(self.encode_message(msg_to_send, client_socket.codec))
+        started = time.perf_counter()
+        frame = self.encode_message(msg_to_send, client_socket.codec)
+        sent = client_socket.send_frame(frame)
+        self.send_latency.observe(time.perf_counter() - started)
+        if sent:
+            self.frames_sent.inc()
+            self.bytes_sent.inc(len(frame))
+        else:
+            self.frames_failed.inc()
+        return sent
 
     def view_ttt_requests(self, client_socket, data):
-        requester = data["addressee"]
+        """
+        Function responds with the tic tac toe invites still awaiting a response that were sent to the user logged
+        in on the connection, as (username, game id) lists.
+
+        :param client_socket: Socket of connected client.
+        :param data: Requester username (str, unused).
+        """
+        requester = self.sessions[client_socket]
         ttt_request_list = self.db.view_ttt_requests(requester)
         response = self.build_message(utility.Responses.PRINT_TTT_REQUESTS.value, requester,
                                       ttt_request_list, None)
         self.server_send(client_socket, response)
 
+    def ping(self, client_socket, data):
+        """
+        Answers a client's heartbeat PING with a PONG.
+        """
+        response = self.build_message(utility.Heartbeats.PONG.value, None, None, None)
+        self.server_send(client_socket, response)
+
+    @staticmethod
+    def pong(client_socket, data):
+        """
+        A client's answer to a PING. Receiving any frame already marked the connection as alive.
+        """
+
+    def stats(self, client_socket, data):
+        """
+        Admin command replying with every metric in the Prometheus text format. Allowed only for logged in users
+        listed in admins; the peer address is not trusted, since behind a local proxy or the cluster hub every
+        client looks local.
+
+        :param client_socket: Socket of connected client.
+        :param data: Message from the client; its fields are unused.
+        """
+        if self.sessions.get(client_socket) in self.admins:
+            response = self.build_message(utility.Responses.STATS.value, None, metrics.render(), None)
+        else:
+            response = self.build_message(utility.Responses.ERROR.value, None, "Not authorised to view stats...",
+                                          None)
+        self.server_send(client_socket, response)
+
     def quit(self, client_socket, data):
         """
-        Function run when clients request to quit the application. Changes client status to 'OFFLINE'.
-        Removes client from clients dictionary and sends 'QUIT' header back to client.
+        Function run when clients request to quit the application. Sends 'QUIT' header back to client and
+        removes the user logged in on the connection from clients dictionary, which marks them 'OFFLINE'.
 
         :param client_socket: Socket of connected client.
-        :param data: Client username (str)
+        :param data: Client username (str, unused)
         """
         try:
-            username = data["addressee"]
-            status = "OFFLINE"
-            self.db.set_status(status, username)
             response = self.build_message(utility.LoggedInCommands.QUIT.value, None, None, None)
             self.server_send(client_socket, response)
-            self.clients.pop(username)
+            self.disconnect(client_socket)
         except socket.error as e:
             logging.error(e)
 
     @staticmethod
-    def send_message(client_socket, msg):
+    def encode_message(msg_to_send, message_codec=codec.JSON):
         """
-        Sends message (from server) to client socket.
-        Encodes message beforehand using 'utf-8'.
+        Encodes the message dictionary with the given codec as a single length-prefixed frame.
 
-        :param: client_socket: Socket of connected client.
-        :param: msg: The message packet to be sent to client.
+        :param msg_to_send: Parameter for (build_message) dictionary to be encoded.
+        :param message_codec: codec.JSON or codec.BINARY.
+        :return: Frame bytes, ready to be queued on any number of connections using the same codec.
         """
-        client_socket.send(msg.encode(ENCODE))
+        return protocol.encode_frame(message_codec.encode(msg_to_send))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec  # noqa: E402
+import database  # noqa: E402
+import pipeline  # noqa: E402
+import protocol  # noqa: E402
+import server  # noqa: E402
+
+
+class RecordingConnection:
+    """
+    Stands in for a client connection, keeping every message the server sends it.
+    Attributes:
+        received (list): Decoded messages, oldest first.
+    """
+
+    def __init__(self):
+        self.codec = codec.JSON
+        self.inflater = None
+        self.received = []
+        self.closed = False
+
+    def send_frame(self, frame):
+        self.received.append(self.codec.decode(frame[protocol.HEADER.size:]))
+        return True
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def chat_server(tmp_path):
+    """
+    A threaded Server with a database in a temporary directory and no listening socket or password pool.
+    """
+    chat_server = server.Server('127.0.0.1', 0)
+    chat_server.db = database.Database(str(tmp_path / "db.sqlite"))
+    chat_server.messages = pipeline.MessagePipeline(chat_server.db)
+    yield chat_server
+    chat_server.close_resources()
+
+
+@pytest.fixture
+def login(chat_server):
+    """
+    Registers a user and logs them in on a new RecordingConnection, as the LOGIN handler does.
+    """
+
+    def login(username):
+        if chat_server.db.find_user_id(username) is None:
+            chat_server.db.insert_username_and_password(username, b"password").result()
+        client_socket = RecordingConnection()
+        chat_server.add_client(username, client_socket)
+        chat_server.sessions[client_socket] = username
+        chat_server.presence.go_online(username)
+        return client_socket
+
+    return login
@@ -0,0 +1,119 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import cluster
+import codec
+import connection
+import protocol
+import server
+import utility
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/proc") or not hasattr(socket, "SO_REUSEPORT"),
+                                reason="needs /proc and SO_REUSEPORT")
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def descendants(pid):
+    """
+    :return: Set of pids of every living process descended from pid, read from /proc.
+    """
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as stat:
+                    fields = stat.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            if fields[0] != "Z":
+                parents.setdefault(int(fields[1]), []).append(int(entry))
+    found = set()
+    pending = [pid]
+    while pending:
+        for child in parents.get(pending.pop(), ()):
+            found.add(child)
+            pending.append(child)
+    return found
+
+
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except OSError:
+        return False
+
+
+def register(port, username):
+    with socket.create_connection(("127.0.0.1", port), timeout=30) as client_socket:
+        message = server.Server.build_message(utility.LoginCommands.REGISTER.value, username, "password", None)
+        client_socket.sendall(protocol.encode_frame(codec.JSON.encode(message)))
+        decoder = protocol.FrameDecoder()
+        frame = decoder.next_frame()
+        while frame is None:
+            decoder.feed(client_socket.recv(server.BUFFER_SIZE))
+            frame = decoder.next_frame()
+    return codec.decode(frame)
+
+
+def test_sigterm_to_the_supervisor_leaves_no_child_processes(tmp_path):
+    port = free_port()
+    command = f"import cluster; cluster.run_cluster('127.0.0.1', {port}, 2)"
+    supervisor = subprocess.Popen([sys.executable, "-c", command], cwd=tmp_path, env=dict(os.environ, PYTHONPATH=ROOT),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    children = set()
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "cluster did not start"
+                time.sleep(0.1)
+        for number in range(4):
+            assert register(port, f"user{number}")["header"] == utility.LoginCommands.REGISTERED.value
+        children = descendants(supervisor.pid)
+        assert len(children) > 2
+        supervisor.send_signal(signal.SIGTERM)
+        supervisor.wait(timeout=30)
+        deadline = time.monotonic() + 10
+        while any(alive(child) for child in children) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert not [child for child in children if alive(child)]
+    finally:
+        if supervisor.poll() is None:
+            supervisor.kill()
+            supervisor.wait()
+        for child in children:
+            if alive(child):
+                os.kill(child, signal.SIGKILL)
+
+
+def test_bus_skips_envelopes_that_fail_to_apply(chat_server, tmp_path):
+    path = str(tmp_path / "bus.sock")
+    hub = cluster.MessageHub(path)
+    hub.start()
+    chat_server.bus = cluster.MessageBus(chat_server, path, 0)
+    chat_server.bus.start()
+    other = cluster.MessageBus(None, path, 1)
+    other.start()
+    other.publish({"type": "friendship", "requester": "alice"})
+    other.publish_presence("carol", True)
+    deadline = time.monotonic() + 5
+    while "carol" not in chat_server.clients and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert isinstance(chat_server.clients.get("carol"), connection.RemoteConnection)
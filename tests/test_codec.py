@@ -0,0 +1,54 @@
+import pytest
+
+import codec
+import protocol
+
+
+def binary_message(*values):
+    out = bytearray([1])
+    for value in values:
+        out += value
+    return bytes(out)
+
+
+def test_binary_round_trip():
+    message = {"header": 3, "addressee": "alice", "body": [1, 2.5, True, None, {"key": ["x"]}],
+               "extra_info": {"nested": {"deeper": []}}, "request_id": 7}
+    assert codec.decode(codec.BINARY.encode(message)) == message
+
+
+def test_binary_dict_with_list_key_is_malformed():
+    payload = binary_message(bytes([codec.DICT, 1, codec.LIST, 0, codec.NONE]), bytes([codec.NONE]),
+                             bytes([codec.NONE]))
+    with pytest.raises(protocol.ProtocolError):
+        codec.decode(payload)
+
+
+def test_binary_deeply_nested_lists_are_malformed():
+    payload = binary_message(bytes([codec.LIST, 1]) * 5000 + bytes([codec.NONE]), bytes([codec.NONE]),
+                             bytes([codec.NONE]))
+    with pytest.raises(protocol.ProtocolError):
+        codec.decode(payload)
+
+
+def test_binary_nesting_up_to_max_depth_decodes():
+    value = None
+    for _ in range(codec.MAX_DEPTH):
+        value = [value]
+    message = {"header": 3, "addressee": value, "body": None, "extra_info": None}
+    assert codec.decode(codec.BINARY.encode(message)) == message
+
+
+def test_json_deeply_nested_lists_are_malformed():
+    payload = b'{"header": 1, "addressee": ' + b"[" * 100000 + b"]" * 100000 + \
+        b', "body": null, "extra_info": null}'
+    with pytest.raises(protocol.ProtocolError):
+        codec.decode(payload)
+
+
+@pytest.mark.parametrize("payload", [b"[]", b'{"header": "1", "addressee": 0, "body": 0, "extra_info": 0}',
+                                     b'{"header": true, "addressee": 0, "body": 0, "extra_info": 0}',
+                                     b'{"header": 1}'])
+def test_json_payloads_that_are_not_messages_are_malformed(payload):
+    with pytest.raises(protocol.ProtocolError):
+        codec.decode(payload)
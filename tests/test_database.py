@@ -0,0 +1,25 @@
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = database.Database(str(tmp_path / "db.sqlite"))
+    yield db
+    db.close()
+
+
+def test_a_failing_write_fails_only_its_own_future(db):
+    def broken(cursor):
+        raise RuntimeError("bug in a write")
+
+    registered = db.insert_username_and_password("alice", b"hash")
+    overflow = db.write("UPDATE users SET user_status = ? WHERE username = ?", [2 ** 70, "alice"])
+    failed = db.submit(broken)
+    with pytest.raises(OverflowError):
+        overflow.result(timeout=5)
+    with pytest.raises(RuntimeError):
+        failed.result(timeout=5)
+    assert registered.result(timeout=5) == db.find_user_id("alice")
+    assert db.insert_username_and_password("bob", b"hash").result(timeout=5) == db.find_user_id("bob")
@@ -0,0 +1,16 @@
+import client
+import utility
+
+
+def test_every_menu_selection_runs_a_client_command():
+    menu = client.Client.build_menu(client.Client.__new__(client.Client))
+    assert len(utility.MENU_OPTIONS) == len(utility.MENU)
+    for selection, description, command in utility.MENU:
+        assert command is utility.LoggedInCommands.QUIT or command in menu, selection
+
+
+def test_printed_menu_lists_every_selection(capsys):
+    client.Client.menu_print()
+    printed = capsys.readouterr().out
+    for selection in utility.MENU_OPTIONS:
+        assert f"'{selection}':" in printed
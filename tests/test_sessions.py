@@ -0,0 +1,106 @@
+import utility
+
+
+def request(chat_server, client_socket, header, addressee, body=None, extra_info=None):
+    """
+    Handles a message from a client and returns the last message the server sent back to it, or None.
+    """
+    client_socket.received.clear()
+    chat_server.handle_message(client_socket, chat_server.build_message(header.value, addressee, body, extra_info))
+    return client_socket.received[-1] if client_socket.received else None
+
+
+def befriend(chat_server, first, second):
+    chat_server.db.insert_friend_request(first, second).result()
+    chat_server.db.insert_friend_relationship(second, first).result()
+
+
+def test_view_friends_lists_the_session_users_friends(chat_server, login):
+    login("alice")
+    login("bob")
+    mallory = login("mallory")
+    befriend(chat_server, "alice", "bob")
+    response = request(chat_server, mallory, utility.LoggedInCommands.VIEW_FRIENDS, "alice")
+    assert response["addressee"] == "mallory"
+    assert "bob" not in response["body"]
+
+
+def test_view_friend_requests_lists_the_session_users_requests(chat_server, login):
+    login("alice")
+    login("bob")
+    mallory = login("mallory")
+    chat_server.db.insert_friend_request("bob", "alice").result()
+    response = request(chat_server, mallory, utility.LoggedInCommands.VIEW_FRIEND_REQUESTS, "alice")
+    assert response["addressee"] == "mallory"
+    assert response["body"] == ""
+
+
+def test_tic_tac_toe_invite_is_sent_from_the_session_user(chat_server, login):
+    login("alice")
+    bob = login("bob")
+    mallory = login("mallory")
+    request(chat_server, mallory, utility.LoggedInCommands.AUTH_TIC_TAC_TOE, "alice", "bob")
+    invite = bob.received[-1]
+    assert invite["header"] == utility.Responses.TIC_TAC_TOE_REQUEST.value
+    assert invite["addressee"] == "mallory"
+    assert chat_server.db.view_ttt_requests("bob") == [("mallory", invite["extra_info"])]
+
+
+def test_broadcast_is_sent_from_the_session_user(chat_server, login):
+    alice = login("alice")
+    mallory = login("mallory")
+    request(chat_server, mallory, utility.LoggedInCommands.BROADCAST, "alice", "hello")
+    assert alice.received[-1]["addressee"] == "mallory"
+
+
+def test_set_status_sets_the_session_users_status(chat_server, login):
+    alice = login("alice")
+    bob = login("bob")
+    mallory = login("mallory")
+    befriend(chat_server, "alice", "bob")
+    chat_server.presence.add_friendship("alice", "bob")
+    request(chat_server, mallory, utility.LoggedInCommands.SET_STATUS_AWAY, "alice", "AWAY")
+    assert bob.received[-1:] == []
+    request(chat_server, alice, utility.LoggedInCommands.SET_STATUS_AWAY, "bob", "AWAY")
+    assert bob.received[-1]["addressee"] == "alice"
+    assert bob.received[-1]["body"] == "AWAY"
+    assert request(chat_server, bob, utility.LoggedInCommands.VIEW_FRIENDS, None)["body"] == "alice : AWAY"
+
+
+def test_set_status_refuses_unknown_statuses(chat_server, login):
+    alice = login("alice")
+    for status in ("OFFLINE", "BUSY", None):
+        response = request(chat_server, alice, utility.LoggedInCommands.SET_STATUS_AWAY, "alice", status)
+        assert response["header"] == utility.Responses.ERROR.value
+    assert chat_server.presence.statuses["alice"] == "ONLINE"
+
+
+def test_view_friends_reads_offline_friends_status_from_the_db(chat_server, login):
+    alice = login("alice")
+    login("bob")
+    befriend(chat_server, "alice", "bob")
+    chat_server.presence.add_friendship("alice", "bob")
+    chat_server.remove_client("bob", chat_server.clients["bob"])
+    chat_server.db.submit(lambda cursor: None).result()
+    assert request(chat_server, alice, utility.LoggedInCommands.VIEW_FRIENDS, None)["body"] == "bob : OFFLINE"
+
+
+def test_friend_requests_are_sent_and_accepted_as_the_session_user(chat_server, login):
+    login("alice")
+    login("bob")
+    mallory = login("mallory")
+    request(chat_server, mallory, utility.LoggedInCommands.ADD_FRIEND, "bob", "alice")
+    assert chat_server.db.view_friend_requests("alice") == [("mallory",)]
+    chat_server.db.insert_friend_request("bob", "alice").result()
+    request(chat_server, mallory, utility.LoggedInCommands.ADD_FRIEND, "alice", "bob")
+    assert not chat_server.db.are_friends("alice", "bob")
+    assert chat_server.db.view_friend_requests("alice") == [("mallory",), ("bob",)]
+
+
+def test_quit_removes_the_session_user(chat_server, login):
+    alice = login("alice")
+    mallory = login("mallory")
+    request(chat_server, mallory, utility.LoggedInCommands.QUIT, "nobody")
+    assert mallory not in chat_server.sessions
+    assert "mallory" not in chat_server.clients
+    assert chat_server.clients["alice"] is alice
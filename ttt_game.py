@@ -2,6 +2,18 @@ import json
 
 import utility
 
+WON = "won"
+TIE = "tie"
+PLAYING = "playing"
+SPACE_FILLED = "Space already filled!"
+SQUARE_BITS = {str(number): 1 << (number - 1) for number in range(1, 10)}
+BOARD_ORDER = tuple((square, SQUARE_BITS[square]) for square in '789456123')
+FULL_BOARD = (1 << 9) - 1
+WIN_LINES = (('7', '8', '9'), ('4', '5', '6'), ('1', '2', '3'), ('1', '4', '7'),
+             ('2', '5', '8'), ('3', '6', '9'), ('1', '5', '9'), ('3', '5', '7'))
+WIN_MASKS = tuple(sum(SQUARE_BITS[square] for square in line) for line in WIN_LINES)
+WINNING = tuple(any(bits & mask == mask for mask in WIN_MASKS) for bits in range(FULL_BOARD + 1))
+
 
 def return_new_board():
     return {'7': ' ', '8': ' ', '9': ' ',
@@ -28,28 +40,73 @@ def get_board(board: dict) -> str:
 
 
 def updateBoard(the_board, turn, move):
-    game_over = False
-    if the_board[move] != ' ':
-        return 'Space already filled!', turn
-    else:
-        the_board[move] = turn
-        space_list = [['7', '8', '9'], ['4', '5', '6'], ['1', '2', '3'], ['1', '4', '7'],
-                      ['2', '5', '8'], ['3', '6', '9'], ['1', '5', '9'], ['3', '5', '7']]
-
-        for win in space_list:
-            if the_board[win[0]] == the_board[win[1]] == the_board[win[2]] != ' ':
-                game_over = True
-                the_board = "won"
-                return the_board, turn
-
-        if not game_over:
-            for i in range(1, 9):
-                if the_board[str(i)] == " ":
-                    break
-            else:
-                game_over = True
-                the_board = "tie"
-
-            return the_board, turn
+    """
+    Plays a move on a board dict with the bitboard engine and copies it onto the dict.
 
+    :return: (WON, turn), (TIE, turn) or (the updated board, turn); (SPACE_FILLED, turn) if the square is taken.
+    """
+    board = BitBoard.from_dict(the_board)
+    outcome = board.play(turn, move)
+    if outcome == SPACE_FILLED:
+        return outcome, turn
+    the_board[move] = turn
+    if outcome in (WON, TIE):
+        return outcome, turn
     return the_board, turn
+
+
+class BitBoard:
+    """
+    Tic tac toe board as two 9 bit integers, one per player, where bit n - 1 is square n of the help board. A
+    move is an OR, a win is a lookup of the mover's bits in WINNING (precomputed from the win masks for all 512
+    positions) and a tie is both players' bits filling FULL_BOARD, so every check is constant time.
+    Attributes:
+        x (int): Squares taken by X.
+        o (int): Squares taken by O.
+    """
+    __slots__ = ("x", "o")
+
+    def __init__(self, x: int = 0, o: int = 0):
+        self.x = x
+        self.o = o
+
+    def play(self, mark, square):
+        """
+        Places a mark on a free square.
+
+        :param mark: 'X' or 'O'.
+        :param square: Square, '1' to '9'.
+        :return: WON, TIE or PLAYING, or SPACE_FILLED if the square was already taken.
+        """
+        bit = SQUARE_BITS[square]
+        if (self.x | self.o) & bit:
+            return SPACE_FILLED
+        if mark == 'X':
+            self.x |= bit
+            bits = self.x
+        else:
+            self.o |= bit
+            bits = self.o
+        if WINNING[bits]:
+            return WON
+        if self.x | self.o == FULL_BOARD:
+            return TIE
+        return PLAYING
+
+    def to_dict(self):
+        """
+        :return: The board in the dict format get_board and the clients use.
+        """
+        return {square: 'X' if self.x & bit else 'O' if self.o & bit else ' '
+                for square, bit in BOARD_ORDER}
+
+    @classmethod
+    def from_dict(cls, board: dict):
+        x = o = 0
+        for square, bit in BOARD_ORDER:
+            if board[square] == 'X':
+                x |= bit
+            elif board[square] == 'O':
+                o |= bit
+        return cls(x, o)
+
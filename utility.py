@@ -1,53 +1,100 @@
 import enum
 
 
-class LoginCommands(enum.Enum):
+class LoginCommands(enum.IntEnum):
     """
     Enum Header values to be used for json packets.
-    Values for login commands.
+    Values for login commands. Opcodes are unique across all header enums,
+    so any member can be used directly as a dispatch table key.
     """
-    LOGIN = '1'
-    REGISTER = '2'
-    REGISTERED = '3'
-    LOGGED_IN = '4'
+    LOGIN = 1
+    REGISTER = 2
+    REGISTERED = 3
+    LOGGED_IN = 4
+    COMPRESS = 5
 
 
-class LoggedInCommands(enum.Enum):
+class LoggedInCommands(enum.IntEnum):
     """
     Header values for logged in commands.
     """
-    BROADCAST = '1'
-    AUTHENTICATE_DIRECT_MESSAGE = '2'
-    DIRECT_MESSAGE = '3'
-    PRINT_DM = '4'
-    ADD_FRIEND = '5'
-    VIEW_FRIEND_REQUESTS = '6'
-    VIEW_FRIENDS = '7'
-    AUTH_TIC_TAC_TOE = '8'
-    VIEW_TIC_TAC_TOE_REQUESTS = '9'
-    SET_STATUS_AWAY = '10'
-    HELP = '11'
-    QUIT = '12'
+    BROADCAST = 10
+    AUTHENTICATE_DIRECT_MESSAGE = 11
+    DIRECT_MESSAGE = 12
+    PRINT_DM = 13
+    ADD_FRIEND = 14
+    VIEW_FRIEND_REQUESTS = 15
+    VIEW_FRIENDS = 16
+    AUTH_TIC_TAC_TOE = 17
+    VIEW_TIC_TAC_TOE_REQUESTS = 18
+    SET_STATUS_AWAY = 19
+    HELP = 20
+    QUIT = 21
+    FETCH_HISTORY = 22
+    STATS = 23
+    CREATE_ROOM = 24
+    JOIN_ROOM = 25
+    LEAVE_ROOM = 26
+    LIST_ROOMS = 27
+    POST_ROOM = 28
 
 
-class Responses(enum.Enum):
+class Responses(enum.IntEnum):
     """
     Header values for responses.
     """
-    SUCCESS = '1'
-    ERROR = '2'
-    BROADCAST_MSG = '3'
-    DM_ERROR = '4'
-    PRINT_FRIEND_REQUESTS = '5'
-    PRINT_FRIENDS_LIST = '6'
-    PRINT_STATUS_AWAY = '7'
-    PRINT_TTT_REQUESTS = '8'
-    ONLINE_NOTIFICATION = '9'
-    TIC_TAC_TOE_REQUEST = '10'
-    TIC_TAC_TOE_CONFIRM = '11'
-    TIC_TAC_TOE_DENY = '12'
-    PLAY_TIC_TAC_TOE = '13'
-    TIC_TAC_TOE_ERROR = '14'
-    TIC_TAC_TOE_SPACE_ERROR = '15'
-    TIC_TAC_TOE_WINNER = '16'
-    TIC_TAC_TOE_TIE = '17'
+    SUCCESS = 30
+    ERROR = 31
+    BROADCAST_MSG = 32
+    DM_ERROR = 33
+    PRINT_FRIEND_REQUESTS = 34
+    PRINT_FRIENDS_LIST = 35
+    PRINT_STATUS_AWAY = 36
+    PRINT_TTT_REQUESTS = 37
+    PRESENCE_NOTIFICATION = 38
+    TIC_TAC_TOE_REQUEST = 39
+    TIC_TAC_TOE_CONFIRM = 40
+    TIC_TAC_TOE_DENY = 41
+    PLAY_TIC_TAC_TOE = 42
+    TIC_TAC_TOE_ERROR = 43
+    TIC_TAC_TOE_SPACE_ERROR = 44
+    TIC_TAC_TOE_WINNER = 45
+    TIC_TAC_TOE_TIE = 46
+    BUSY = 47
+    HISTORY = 48
+    INBOX = 49
+    STATS = 50
+    ROOM_HISTORY = 51
+    ROOM_LIST = 52
+    ROOM_MSG = 53
+
+
+class Heartbeats(enum.IntEnum):
+    """
+    Header values for connection heartbeats, sent by either side before or after login.
+    """
+    PING = 60
+    PONG = 61
+
+
+# Main menu entries in the order they are printed, as (selection typed by the user, description, logged in command
+# run). The printed menu and the selections accepted are both built from it.
+MENU = (
+    ("broadcast", "Broadcast", LoggedInCommands.BROADCAST),
+    ("dm", "Direct Message", LoggedInCommands.AUTHENTICATE_DIRECT_MESSAGE),
+    ("af", "Add Friend", LoggedInCommands.ADD_FRIEND),
+    ("fr", "View Friend Requests", LoggedInCommands.VIEW_FRIEND_REQUESTS),
+    ("vf", "View Friends", LoggedInCommands.VIEW_FRIENDS),
+    ("ttt", "Tic Tac Toe Invite", LoggedInCommands.AUTH_TIC_TAC_TOE),
+    ("vttt", "Tic Tac Toe Requests", LoggedInCommands.VIEW_TIC_TAC_TOE_REQUESTS),
+    ("ssa", "Set Status Away", LoggedInCommands.SET_STATUS_AWAY),
+    ("help", "Help", LoggedInCommands.HELP),
+    ("quit", "Quit", LoggedInCommands.QUIT),
+    ("cr", "Create Room", LoggedInCommands.CREATE_ROOM),
+    ("jr", "Join Room", LoggedInCommands.JOIN_ROOM),
+    ("lr", "Leave Room", LoggedInCommands.LEAVE_ROOM),
+    ("rooms", "List Rooms", LoggedInCommands.LIST_ROOMS),
+)
+
+# Main menu selections typed by the user, mapped to the logged in command they run.
+MENU_OPTIONS = {selection: command for selection, description, command in MENU}